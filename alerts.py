@@ -0,0 +1,451 @@
+"""
+Alert engine on the ingest path, in place of the n8n "Check Abnormal" node
+- Rule sets indexed by devid: "devid/mcid" overrides "devid", which overrides "*";
+  the defaults keep the n8n limits (amp > 10, volt > 250) and add under-voltage,
+  low power factor (only under load) and a current rate-of-change rule
+- Each rule is a threshold (above/below) or a rate per minute (rate_above/rate_below)
+  on one of amp, volt, pf, power, energy, with
+  clear: the value has to come back past this to resolve (hysteresis)
+  for_s: the condition has to hold that long, sample after sample, before it opens
+  min_amp: only evaluated while the load draws at least this much
+  repeat_s: reminder interval while an alert stays open and unacknowledged
+- ElectricDB extension: every committed batch is evaluated with NumPy, one compare
+  per rule over all rows of the devices sharing a rule set; only devices with a hit
+  or an alert already in progress go through the state machine
+- States: pending (for_s running) -> open -> acked -> resolved; open/acked/resolved
+  are rows of electric_alerts, written in the insert transaction
+- Notifications are coalesced: one message per --alert-window seconds lists every
+  alert opened, still open or resolved in it, instead of one per abnormal sample
+- LogNotifier prints (and keeps) the messages, the local stand-in for Telegram
+- Usage: db.extend("alerts", AlertEngine(db, load_rules(path), Coalescer(LogNotifier())))
+         rules file: {"*": [{"name": "overcurrent", "series": "amp", "above": 10, "clear": 9.5}],
+                      "e089/m-001": [...]}
+"""
+
+import asyncio
+import collections
+import json
+import threading
+import time
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import numpy as np
+
+from electric_db import format_time
+
+SERIES = ("amp", "volt", "pf", "power", "energy")
+# Reminder interval for an open, unacknowledged alert
+REPEAT_S = 3600
+# Seconds of events gathered into one notification
+WINDOW_S = 30
+
+RULES = {
+    "*": [
+        # The n8n workflow's limits, now with hysteresis
+        {"name": "overcurrent", "series": "amp", "above": 10, "clear": 9.5},
+        {"name": "overvoltage", "series": "volt", "above": 250, "clear": 248},
+        {"name": "undervoltage", "series": "volt", "below": 200, "clear": 205, "for_s": 120},
+        {"name": "low_pf", "series": "pf", "below": 0.7, "clear": 0.75, "for_s": 600, "min_amp": 0.5},
+        {"name": "current_jump", "series": "amp", "rate_above": 8, "clear": 1},
+    ],
+}
+
+SQLITE_TABLE = """
+CREATE TABLE IF NOT EXISTS electric_alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    devid VARCHAR(50) NOT NULL,
+    mcid VARCHAR(50) NOT NULL,
+    rule VARCHAR(50) NOT NULL,
+    state VARCHAR(10) NOT NULL,
+    opened DATETIME,
+    acked DATETIME,
+    resolved DATETIME,
+    value REAL,
+    peak REAL,
+    samples INTEGER
+)
+"""
+
+MYSQL_TABLE = """
+CREATE TABLE IF NOT EXISTS electric_alerts (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    devid VARCHAR(50) NOT NULL,
+    mcid VARCHAR(50) NOT NULL,
+    rule VARCHAR(50) NOT NULL,
+    state VARCHAR(10) NOT NULL,
+    opened DATETIME,
+    acked DATETIME NULL,
+    resolved DATETIME NULL,
+    value DOUBLE,
+    peak DOUBLE,
+    samples INT,
+    KEY idx_alerts_state (state)
+)
+"""
+
+
+# ============== Rules ==============
+class Rule:
+    def __init__(self, spec):
+        self.name = spec["name"]
+        self.series = spec["series"]
+        if self.series not in SERIES:
+            raise ValueError("{}: unknown series {}".format(self.name, self.series))
+        kinds = [k for k in ("above", "below", "rate_above", "rate_below") if k in spec]
+        if len(kinds) != 1:
+            raise ValueError("{}: needs exactly one of above, below, rate_above, rate_below".format(self.name))
+        self.rate = kinds[0].startswith("rate")
+        self.above = kinds[0].endswith("above")
+        self.limit = float(spec[kinds[0]])
+        self.clear = float(spec.get("clear", self.limit))
+        if self.above and self.clear > self.limit or not self.above and self.clear < self.limit:
+            raise ValueError("{}: clear must be on the normal side of the limit".format(self.name))
+        self.for_s = float(spec.get("for_s", 0))
+        self.min_amp = spec.get("min_amp")
+        self.repeat_s = float(spec.get("repeat_s", REPEAT_S))
+
+    def test(self, v, amp):
+        """(hit, clear) masks; NaN (no rate yet) is neither"""
+        if self.above:
+            hit, ok = v > self.limit, v <= self.clear
+        else:
+            hit, ok = v < self.limit, v >= self.clear
+        if self.min_amp is not None:
+            # No load, no power factor to speak of: counts as back to normal
+            idle = amp < self.min_amp
+            hit &= ~idle
+            ok |= idle
+        return hit, ok
+
+    def worse(self, a, b):
+        return max(a, b) if self.above else min(a, b)
+
+    def describe(self):
+        op = ">" if self.above else "<"
+        return "{}{} {} {:g}".format(self.series, "/min" if self.rate else "", op, self.limit)
+
+
+def compile_rules(spec):
+    """{"*" | devid | "devid/mcid": [rule dicts]} -> same keys with Rule lists"""
+    if "*" not in spec:
+        raise ValueError('rules need a "*" entry')
+    return {key: [Rule(r) for r in rules] for key, rules in spec.items()}
+
+
+def load_rules(path=None):
+    if not path:
+        return compile_rules(RULES)
+    with open(path) as f:
+        return compile_rules(json.load(f))
+
+
+def epoch(stamps):
+    """DATETIME text array -> epoch seconds (local clock, used for durations and rates)"""
+    return np.array(stamps).astype("datetime64[s]").astype(np.int64).astype(np.float64)
+
+
+# ============== Engine ==============
+class AlertEngine:
+    """db.extend("alerts", AlertEngine(db, rules, notifier))"""
+    def __init__(self, db, rules=None, notifier=None):
+        self.db = db
+        self.rules = rules or compile_rules(RULES)
+        self.notifier = notifier
+        # (devid, mcid) -> rule set key, resolved once per device
+        self.index = {}
+        # (devid, mcid, rule) -> {"state", "since", "id", "opened", "value", "peak", "samples", "notified"}
+        self.state = {}
+        # (devid, mcid) -> (epoch, {series: value}) of the newest row, for rates across batches
+        self.last = {}
+        self.evaluated = 0
+        m = db.mark
+        self.open_sql = ("INSERT INTO electric_alerts (devid, mcid, rule, state, opened, value, peak, samples) "
+                         "VALUES ({0}, {0}, {0}, 'open', {0}, {0}, {0}, {0})".format(m))
+        self.resolve_sql = ("UPDATE electric_alerts SET state = 'resolved', resolved = {0}, peak = {0}, samples = {0} "
+                            "WHERE id = {0}".format(m))
+
+    def schema(self, kind):
+        return [SQLITE_TABLE if kind == "sqlite" else MYSQL_TABLE]
+
+    def on_open(self, conn):
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT id, devid, mcid, rule, state, opened, value, peak, samples FROM electric_alerts "
+                        "WHERE state IN ('open', 'acked')")
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+        # Same clock as evaluate(): DATETIME text read as if UTC
+        now = epoch([format_time(time.time())])[0]
+        for aid, devid, mcid, rule, state, opened, value, peak, samples in rows:
+            opened = str(opened)
+            self.state[(devid, mcid, rule)] = {
+                "state": state, "id": aid, "opened": opened, "value": value, "peak": peak, "samples": samples,
+                "since": epoch([opened])[0], "notified": now}
+
+    def ruleset(self, devid, mcid):
+        key = (devid, mcid)
+        name = self.index.get(key)
+        if name is None:
+            name = next(k for k in (devid + "/" + mcid, devid, "*") if k in self.rules)
+            self.index[key] = name
+        return name
+
+    def evaluate(self, rows):
+        """Batch of electric rows -> (state changes, events, newest rows); nothing is applied yet"""
+        n = len(rows)
+        keys = np.array([r[0] + "\0" + r[1] for r in rows])
+        t = epoch([str(r[6]) for r in rows])
+        # Device, then time order, so each device's samples are consecutive and in sequence
+        uniq, inv = np.unique(keys, return_inverse=True)
+        order = np.lexsort((t, inv))
+        inv = inv[order]
+        t = t[order]
+        rows = [rows[i] for i in order.tolist()]
+        stamps = [str(r[6]) for r in rows]
+        cols = {k: np.fromiter((r[i] for r in rows), np.float64, n)
+                for k, i in (("amp", 2), ("volt", 3), ("pf", 4), ("energy", 5))}
+        cols["power"] = cols["volt"] * cols["amp"]
+        devices = [tuple(u.split("\0", 1)) for u in uniq.tolist()]
+        starts = np.flatnonzero(np.diff(inv, prepend=-1))
+        ends = np.append(starts[1:], n)
+
+        # Previous sample per row: the row before within the device, the last batch's newest for the first
+        prev_t = np.empty(n)
+        prev_t[1:] = t[:-1]
+        prev = {}
+        for s in SERIES:
+            prev[s] = np.empty(n)
+            prev[s][1:] = cols[s][:-1]
+        for g, (devid, mcid) in enumerate(devices):
+            last = self.last.get((devid, mcid))
+            s0 = starts[g]
+            prev_t[s0] = last[0] if last else np.nan
+            for s in SERIES:
+                prev[s][s0] = last[1][s] if last else np.nan
+        dt = t - prev_t
+        dt[dt <= 0] = np.nan
+
+        changes = {}
+        events = []
+        sets = np.array([self.ruleset(d, m) for d, m in devices])
+        # Alerts in progress on devices of this batch, by rule name
+        where = {dev: g for g, dev in enumerate(devices)}
+        progress = collections.defaultdict(list)
+        for key in list(self.state):
+            g = where.get(key[:2])
+            if g is not None:
+                progress[key[2]].append(g)
+        for name in np.unique(sets).tolist():
+            groups = np.flatnonzero(sets == name)
+            if len(groups) == len(devices):
+                rows_in = slice(None)
+                sel = np.arange(n)
+            else:
+                sel = np.concatenate([np.arange(starts[g], ends[g]) for g in groups.tolist()])
+                rows_in = sel
+            amp = cols["amp"][rows_in]
+            for rule in self.rules[name]:
+                v = cols[rule.series][rows_in]
+                if rule.rate:
+                    v = (v - prev[rule.series][rows_in]) / dt[rows_in] * 60
+                hit, ok = rule.test(v, amp)
+                hit_rows = sel[hit]
+                # Devices with a hit in this batch, plus those with this alert in progress
+                todo = set(inv[hit_rows].tolist())
+                todo.update(g for g in progress[rule.name] if sets[g] == name)
+                if not todo:
+                    continue
+                values = np.full(n, np.nan)
+                values[sel] = v
+                hits = np.zeros(n, bool)
+                hits[sel] = hit
+                oks = np.zeros(n, bool)
+                oks[sel] = ok
+                for g in sorted(todo):
+                    key = devices[g] + (rule.name,)
+                    st = self.state.get(key)
+                    st = dict(st) if st else None
+                    for i in range(starts[g], ends[g]):
+                        st = self._step(rule, key, st, t[i], stamps[i], values[i], hits[i], oks[i], events)
+                    changes[key] = st
+        self.evaluated += n
+        newest = {devices[g]: (t[ends[g] - 1], {s: cols[s][ends[g] - 1] for s in SERIES})
+                  for g in range(len(devices))}
+        return changes, events, newest
+
+    def _step(self, rule, key, st, t, stamp, v, hit, ok, events):
+        """One sample through the state machine; returns the new state (None = idle)"""
+        if st is None:
+            if not hit:
+                return None
+            st = {"state": "pending", "since": t, "id": None, "opened": None, "value": v, "peak": v,
+                  "samples": 0, "notified": None}
+        elif st["state"] == "pending" and not hit:
+            # for_s means without a break
+            return None
+        if hit:
+            st["samples"] += 1
+            st["peak"] = rule.worse(st["peak"], v)
+            st["value"] = v
+        if st["state"] == "pending":
+            if t - st["since"] >= rule.for_s:
+                st["state"] = "open"
+                st["opened"] = stamp
+                st["notified"] = t
+                events.append(("open", key, rule, dict(st), stamp))
+            return st
+        if ok:
+            events.append(("resolved", key, rule, dict(st, value=v), stamp))
+            return None
+        if st["state"] == "open" and hit and t - st["notified"] >= rule.repeat_s:
+            st["notified"] = t
+            events.append(("still open", key, rule, dict(st), stamp))
+        return st
+
+    # ============== ElectricDB hooks ==============
+    def on_insert(self, cur, rows):
+        changes, events, newest = self.evaluate(rows)
+        ids = {}
+        for kind, key, rule, st, stamp in events:
+            if kind == "open":
+                cur.execute(self.open_sql, key + (stamp, float(st["value"]), float(st["peak"]), st["samples"]))
+                ids[key] = cur.lastrowid
+                st["id"] = cur.lastrowid
+            elif kind == "resolved":
+                aid = st["id"] or ids.get(key)
+                st["id"] = aid
+                cur.execute(self.resolve_sql, (stamp, float(st["peak"]), st["samples"], aid))
+        for key, aid in ids.items():
+            if changes.get(key) is not None:
+                changes[key]["id"] = aid
+
+        def done():
+            for key, st in changes.items():
+                if st is None:
+                    self.state.pop(key, None)
+                    continue
+                old = self.state.get(key)
+                if old and old["state"] == "acked" and st["state"] == "open":
+                    # Acknowledged while this batch was being evaluated
+                    st["state"] = "acked"
+                self.state[key] = st
+            self.last.update(newest)
+            if self.notifier and events:
+                self.notifier.push(events)
+        return done
+
+    # ============== Queries ==============
+    def _ack(self, conn, aid):
+        cur = conn.cursor()
+        try:
+            cur.execute("UPDATE electric_alerts SET state = 'acked', acked = {0} WHERE id = {0} AND state = 'open'"
+                        .format(self.db.mark), (format_time(time.time()), aid))
+            changed = cur.rowcount
+            conn.commit()
+        finally:
+            cur.close()
+        return changed
+
+    async def ack(self, aid):
+        """Acknowledge an open alert: no more reminders, it still resolves normally"""
+        if not await self.db.run(self._ack, aid):
+            return False
+        for st in list(self.state.values()):
+            if st["id"] == aid:
+                st["state"] = "acked"
+        return True
+
+    def active(self):
+        """Open and acknowledged alerts, oldest first"""
+        out = []
+        for (devid, mcid, rule), st in list(self.state.items()):
+            if st["state"] in ("open", "acked"):
+                out.append({"id": st["id"], "devid": devid, "mcid": mcid, "rule": rule, "state": st["state"],
+                            "opened": st["opened"], "value": float(st["value"]), "peak": float(st["peak"]),
+                            "samples": int(st["samples"])})
+        return sorted(out, key=lambda a: (a["opened"], a["id"]))
+
+
+# ============== Notifications ==============
+def format_event(kind, key, rule, st, stamp):
+    devid, mcid, name = key
+    if kind == "resolved":
+        return "✅ {}/{} {} resolved at {} (peak {:.3g}, {} samples since {})".format(
+            devid, mcid, name, stamp, st["peak"], st["samples"], st["opened"])
+    return "⚠️ {}/{} {} {}: {:.3g} ({}) at {}".format(
+        devid, mcid, name, kind, st["value"], rule.describe(), stamp)
+
+
+class Coalescer:
+    """Gathers events from commit threads; run() sends one message per window"""
+    def __init__(self, sink, window_s=WINDOW_S):
+        self.sink = sink
+        self.window_s = window_s
+        self.queue = collections.deque()
+        self.sent = 0
+        self.coalesced = 0
+
+    def push(self, events):
+        # deque.append is atomic, so database threads need no lock
+        self.queue.extend(events)
+
+    def message(self):
+        """Pending events as one text, or None; one line per alert, its last event wins"""
+        if not self.queue:
+            return None
+        lines = collections.OrderedDict()
+        n = 0
+        while self.queue:
+            kind, key, rule, st, stamp = self.queue.popleft()
+            n += 1
+            old = lines.pop(key, None)
+            line = format_event(kind, key, rule, st, stamp)
+            if old and old[0] == "open" and kind == "resolved":
+                line += " - opened and resolved within this window"
+            lines[key] = (kind, line)
+        self.coalesced += n - len(lines)
+        head = "*IoT ALERT* {} open, {} resolved".format(
+            sum(k != "resolved" for k, _ in lines.values()), sum(k == "resolved" for k, _ in lines.values()))
+        return head + "\n" + "\n".join(line for _, line in lines.values())
+
+    async def flush(self):
+        text = self.message()
+        if text:
+            self.sent += 1
+            await asyncio.get_running_loop().run_in_executor(None, self.sink.send, text)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.window_s)
+            try:
+                await self.flush()
+            except Exception as e:
+                print("Alert notification failed: {}".format(e))
+
+
+class LogNotifier:
+    """Stand-in for Telegram: prints and keeps every message"""
+    def __init__(self, quiet=False):
+        self.messages = []
+        self.quiet = quiet
+        self.lock = threading.Lock()
+
+    def send(self, text):
+        with self.lock:
+            self.messages.append(text)
+        if not self.quiet:
+            print(text)
+
+
+class TelegramNotifier:
+    """Bot API sendMessage, as the n8n Telegram node did"""
+    def __init__(self, token, chat_id):
+        self.url = "https://api.telegram.org/bot{}/sendMessage".format(token)
+        self.chat_id = chat_id
+
+    def send(self, text):
+        body = urlencode({"chat_id": self.chat_id, "text": text, "parse_mode": "Markdown"}).encode()
+        with urlopen(self.url, body, timeout=10) as r:
+            r.read()
@@ -0,0 +1,168 @@
+"""
+Behaviour checks for alerts.py on a temporary SQLite database
+- Sustained overload: one alert and one message, not one per sample as the n8n flow sent
+- Hysteresis, minimum duration, low PF without load, rate of change, per-device rules,
+  ack silencing reminders, alerts surviving a restart, fleet-wide coalescing
+- Then evaluation throughput for a large mixed batch
+- Usage: python alerts_check.py   (exits non-zero if a check fails)
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from alerts import AlertEngine, Coalescer, LogNotifier, compile_rules, RULES
+from electric_db import ElectricDB, format_time
+
+failed = []
+T0 = time.mktime((2026, 3, 2, 8, 0, 0, 0, 0, -1))
+
+
+def check(name, ok):
+    print("  {} {}".format("ok  " if ok else "FAIL", name))
+    if not ok:
+        failed.append(name)
+
+
+def row(devid, t, amp=5.0, volt=230.0, pf=0.9, mcid="m-001"):
+    return (devid, mcid, amp, volt, pf, 1.0, format_time(T0 + t))
+
+
+async def open_db(path, rules=None):
+    notifier = Coalescer(LogNotifier(quiet=True), window_s=3600)
+    db = ElectricDB("sqlite:" + path, 1)
+    engine = db.extend("alerts", AlertEngine(db, compile_rules(rules or RULES), notifier))
+    await db.open()
+    return db, engine, notifier
+
+
+def events(engine):
+    """Drain the coalescer's queue: [(kind, devid, rule)]"""
+    out = [(kind, key[0], key[2]) for kind, key, _, _, _ in engine.notifier.queue]
+    engine.notifier.queue.clear()
+    return out
+
+
+async def run(tmp):
+    rules = dict(RULES)
+    rules["e090"] = [{"name": "overcurrent", "series": "amp", "above": 20, "clear": 18}]
+    rules["*"] = RULES["*"] + [{"name": "overpower", "series": "power", "above": 3000, "clear": 2900,
+                                "repeat_s": 600}]
+    path = os.path.join(tmp, "alerts.db")
+    db, engine, notifier = await open_db(path, rules)
+
+    print("Sustained overload (30 samples at 12 A, one a minute):")
+    for i in range(30):
+        await db.insert_many([row("e089", i * 60, amp=12.0)])
+    ev = events(engine)
+    check("one alert opened, no repeats", ev == [("open", "e089", "overcurrent")])
+    check("alert is open", [a["rule"] for a in engine.active()] == ["overcurrent"])
+    check("samples counted", engine.active()[0]["samples"] == 30)
+
+    print("Hysteresis (clear at 9.5 A):")
+    for i, amp in enumerate((10.2, 9.8, 10.3, 9.7, 9.6)):
+        await db.insert_many([row("e089", 1800 + i * 60, amp=amp)])
+    check("no flapping between 9.5 and 10 A", events(engine) == [])
+    await db.insert_many([row("e089", 2200, amp=9.0)])
+    check("resolved below the clear level", events(engine) == [("resolved", "e089", "overcurrent")])
+    check("nothing active", engine.active() == [])
+
+    print("Minimum duration (under-voltage for 120 s):")
+    await db.insert_many([row("e091", 0, volt=195), row("e091", 60, volt=196)])
+    check("60 s below 200 V is still pending", events(engine) == [])
+    await db.insert_many([row("e091", 120, volt=215)])
+    await db.insert_many([row("e091", 180, volt=195), row("e091", 240, volt=194)])
+    check("a normal sample restarts the timer", events(engine) == [])
+    await db.insert_many([row("e091", 300, volt=193)])
+    check("opens after 120 s without a break", events(engine) == [("open", "e091", "undervoltage")])
+
+    print("Low PF only under load:")
+    await db.insert_many([row("e092", i * 60, amp=0.0, pf=0.0) for i in range(20)])
+    check("idle machine (0 A, PF 0) raises nothing", events(engine) == [])
+    await db.insert_many([row("e092", 1200 + i * 60, amp=3.0, pf=0.5) for i in range(12)])
+    check("PF 0.5 at 3 A for 10 min opens", events(engine) == [("open", "e092", "low_pf")])
+    await db.insert_many([row("e092", 2000, amp=0.0, pf=0.0)])
+    check("switching off resolves it", events(engine) == [("resolved", "e092", "low_pf")])
+
+    print("Rate of change and per-device rules:")
+    await db.insert_many([row("e093", 0, amp=1.0)])
+    await db.insert_many([row("e093", 60, amp=9.5)])
+    check("1 -> 9.5 A in a minute is a jump", events(engine) == [("open", "e093", "current_jump")])
+    await db.insert_many([row("e090", 0, amp=1.0), row("e090", 60, amp=1.5), row("e090", 120, amp=15.0)])
+    check("e090's own rules: 15 A is fine there, no jump rule", events(engine) == [])
+    await db.insert_many([row("e093", 120, amp=9.4)])
+    check("jump resolves once the current settles", events(engine) == [("resolved", "e093", "current_jump")])
+
+    print("Acknowledge and reminders (overpower repeats every 600 s):")
+    await db.insert_many([row("e094", i * 60, amp=14.0) for i in range(10)])
+    ev = events(engine)
+    check("overcurrent and overpower open", sorted(ev) == [("open", "e094", "overcurrent"),
+                                                           ("open", "e094", "overpower")])
+    await db.insert_many([row("e094", 600 + i * 60, amp=14.0) for i in range(5)])
+    check("reminder after repeat_s", events(engine) == [("still open", "e094", "overpower")])
+    aid = next(a["id"] for a in engine.active() if a["devid"] == "e094" and a["rule"] == "overpower")
+    check("ack accepted", await engine.ack(aid))
+    check("second ack refused", not await engine.ack(aid))
+    await db.insert_many([row("e094", 1000 + i * 60, amp=14.0) for i in range(30)])
+    check("no reminders once acknowledged", events(engine) == [])
+
+    print("Restart:")
+    before = sorted((a["devid"], a["rule"], a["state"]) for a in engine.active())
+    db.close()
+    db, engine, notifier = await open_db(path, rules)
+    after = sorted((a["devid"], a["rule"], a["state"]) for a in engine.active())
+    check("open and acked alerts reloaded", before == after and ("e094", "overpower", "acked") in after)
+    await db.insert_many([row("e094", 3000, amp=2.0)])
+    check("a reloaded alert resolves", sorted(events(engine)) == [("resolved", "e094", "overcurrent"),
+                                                                 ("resolved", "e094", "overpower")])
+
+    print("Coalescing (50 devices overloaded in one window):")
+    for i in range(5):
+        await db.insert_many([row("f%03d" % d, i * 60, amp=11.0) for d in range(50)])
+    text = notifier.message()
+    check("one message for 50 alerts", text is not None and text.count("\n") == 50 and notifier.message() is None)
+    await db.insert_many([row("g001", 0, amp=11.0)])
+    await db.insert_many([row("g001", 60, amp=5.0)])
+    text = notifier.message()
+    check("open + resolve in one window is one line", text.count("\n") == 1 and "opened and resolved" in text)
+    db.close()
+
+    print("Throughput:")
+    db, engine, notifier = await open_db(os.path.join(tmp, "bench.db"))
+    rng = np.random.default_rng(3)
+    n, devices = 50000, 1000
+    amp = np.clip(rng.normal(5, 3, n), 0, None)
+    volt = rng.normal(230, 8, n)
+    pf = np.clip(rng.normal(0.9, 0.08, n), 0, 1)
+    batch = [("d%04d" % (i % devices), "m-001", float(amp[i]), float(volt[i]), float(pf[i]), 1.0,
+              format_time(T0 + (i // devices) * 60)) for i in range(n)]
+    engine.evaluate(batch[:devices])
+    t0 = time.perf_counter()
+    changes, ev, _ = engine.evaluate(batch)
+    secs = time.perf_counter() - t0
+    print("  %d rows, %d devices, %d rules: %.0f ms (%.0f rows/s), %d events" % (
+        n, devices, len(engine.rules["*"]), secs * 1000, n / secs, len(ev)))
+    quiet = [("q%04d" % (i % devices), "m-001", 5.0, 230.0, 0.9, 1.0, format_time(T0 + (i // devices) * 60))
+             for i in range(n)]
+    t0 = time.perf_counter()
+    engine.evaluate(quiet)
+    secs = time.perf_counter() - t0
+    print("  same batch, all normal: %.0f ms (%.0f rows/s)" % (secs * 1000, n / secs))
+    db.close()
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(tmp))
+    if failed:
+        print("FAIL:", ", ".join(failed))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
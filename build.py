@@ -0,0 +1,241 @@
+"""
+Build webhook-iot.py for faster boot: precompiled .mpy or frozen into the firmware
+- python build.py mpy [--mpy-cross PATH]    -> build/mpy/*.mpy + main.py stub
+- python build.py deploy PORT                -> copy build/mpy to the board with mpremote
+- python build.py manifest                  -> build/frozen/ + build/manifest.py for a firmware build
+- python build.py compare source.log mpy.log [frozen.log]
+-     compares the "Boot:" lines the firmware prints (import time, first reading, free heap)
+- python build.py check                     -> every local module the app imports is in MODULES
+-     (also run before mpy / manifest, so a missing module fails the build, not the boot)
+- python build.py boot [--runs 5]           -> lazy vs eager imports on the host (host_stubs):
+-     load time and heap held once webhook-iot.py has loaded, then the same with the modules
+-     it loads on first use (pages, power, ujson) imported up front, as before the lazy imports
+"""
+
+import argparse
+import ast
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BUILD = os.path.join(HERE, "build")
+
+# The app cannot be imported as webhook-iot (not a valid module name), so it is
+# built as pzem_app and started from a two-line main.py
+APP = ("webhook-iot.py", "pzem_app")
+MODULES = ("scheduler.py", "metrics.py", "lcd_i2c.py", "profiler.py", "power.py", "pages.py",
+           "sampler.py", "config_store.py", "wifi_link.py")
+MAIN_STUB = "import pzem_app\npzem_app.main()\n"
+
+# Modules webhook-iot.py imports on first use; the eager run imports them at boot
+LAZY = ("pages", "power", "ujson")
+# One fresh interpreter per run, so nothing is imported or compiled already. Heap is
+# bytes held since the baseline (tracemalloc through host_stubs), ms is host time.
+BOOT_RUN = """
+import sys, time
+sys.path.insert(0, %r)
+import heap_budget, host_stubs, gc
+gc.collect()
+base = gc.mem_alloc()
+t0 = time.perf_counter()
+for name in sys.argv[1:]:
+    __import__(name)
+heap_budget.load_firmware()
+ms = (time.perf_counter() - t0) * 1000
+gc.collect()
+print("%%.1f %%d" %% (ms, gc.mem_alloc() - base))
+"""
+
+BOOT_RE = re.compile(r'^Boot: (imports done|first reading) at (\d+) ms, (\d+) bytes free')
+
+
+def sources():
+    """(source path, module name) for everything that goes on the board"""
+    out = [(os.path.join(HERE, APP[0]), APP[1])]
+    for name in MODULES:
+        out.append((os.path.join(HERE, name), name[:-3]))
+    return out
+
+
+def local_imports(path):
+    """Modules of this directory imported by the source at path, lazy imports included"""
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(a.name.split(".")[0] for a in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split(".")[0])
+    return {n for n in names if os.path.exists(os.path.join(HERE, n + ".py"))}
+
+
+def check_imports():
+    """Exit if a module on the board imports one of ours that is not in the build"""
+    built = {mod for _, mod in sources()}
+    missing = []
+    for src, mod in sources():
+        for name in sorted(local_imports(src) - built):
+            missing.append("%s imports %s" % (os.path.basename(src), name))
+    if missing:
+        sys.exit("Missing from MODULES: " + "; ".join(missing))
+    print("Imports OK: %d modules" % len(built))
+
+
+def fresh_dir(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+
+
+def write_main(path):
+    with open(os.path.join(path, "main.py"), "w") as f:
+        f.write(MAIN_STUB)
+
+
+# ============== .mpy ==============
+def build_mpy(mpy_cross):
+    check_imports()
+    out = os.path.join(BUILD, "mpy")
+    fresh_dir(out)
+    total_src = total_mpy = 0
+    print("%-14s %8s %8s" % ("module", "source", ".mpy"))
+    for src, mod in sources():
+        dst = os.path.join(out, mod + ".mpy")
+        subprocess.run([mpy_cross, "-O1", "-s", mod + ".py", "-o", dst, src], check=True)
+        a, b = os.path.getsize(src), os.path.getsize(dst)
+        total_src += a
+        total_mpy += b
+        print("%-14s %8d %8d" % (mod, a, b))
+    print("%-14s %8d %8d" % ("total", total_src, total_mpy))
+    write_main(out)
+    print("Built", out)
+
+
+def deploy(port):
+    out = os.path.join(BUILD, "mpy")
+    if not os.path.isdir(out):
+        sys.exit("Run 'python build.py mpy' first")
+    files = sorted(os.listdir(out))
+    # Remove stale sources of the same modules, they would shadow the .mpy files
+    stale = [":" + mod + ".py" for _, mod in sources()]
+    subprocess.run(["mpremote", "connect", port, "rm"] + stale, check=False)
+    subprocess.run(["mpremote", "connect", port, "cp"] + [os.path.join(out, f) for f in files] + [":"], check=True)
+    subprocess.run(["mpremote", "connect", port, "reset"], check=True)
+
+
+# ============== Frozen ==============
+def build_manifest():
+    check_imports()
+    frozen = os.path.join(BUILD, "frozen")
+    fresh_dir(frozen)
+    for src, mod in sources():
+        shutil.copy(src, os.path.join(frozen, mod + ".py"))
+    manifest = os.path.join(BUILD, "manifest.py")
+    with open(manifest, "w") as f:
+        f.write('include("$(PORT_DIR)/boards/manifest.py")\n')
+        f.write('freeze(%r)\n' % frozen)
+    write_main(BUILD)
+    print("Wrote", manifest)
+    print("Firmware: make -C ports/esp32 BOARD=ESP32_GENERIC FROZEN_MANIFEST=%s" % manifest)
+    print("Then copy %s to the board as main.py" % os.path.join(BUILD, "main.py"))
+
+
+# ============== Boot Comparison ==============
+def parse_boot(path):
+    """{"imports done": (ms, free), "first reading": (ms, free)} from a serial log"""
+    found = {}
+    with open(path, errors="replace") as f:
+        for line in f:
+            m = BOOT_RE.match(line.strip())
+            if m and m.group(1) not in found:
+                found[m.group(1)] = (int(m.group(2)), int(m.group(3)))
+    return found
+
+
+def compare(logs):
+    rows = []
+    for path in logs:
+        boot = parse_boot(path)
+        if not boot:
+            print("No Boot: lines in", path)
+            continue
+        imp = boot.get("imports done", (None, None))
+        first = boot.get("first reading", (None, None))
+        rows.append((os.path.basename(path), imp[0], imp[1], first[0], first[1]))
+    if not rows:
+        sys.exit(1)
+
+    print("%-20s %10s %12s %12s %12s" % ("build", "imports ms", "free after", "reading ms", "free then"))
+    for name, imp_ms, imp_free, first_ms, first_free in rows:
+        print("%-20s %10s %12s %12s %12s" % (name, fmt(imp_ms), fmt(imp_free), fmt(first_ms), fmt(first_free)))
+    base = rows[0]
+    for row in rows[1:]:
+        if None not in (base[3], row[3], base[4], row[4]):
+            print("%s vs %s: %+d ms to first reading, %+d bytes free" % (
+                row[0], base[0], row[3] - base[3], row[4] - base[4]))
+        elif None not in (base[1], row[1], base[2], row[2]):
+            print("%s vs %s: %+d ms to imports done, %+d bytes free" % (
+                row[0], base[0], row[1] - base[1], row[2] - base[2]))
+
+
+def boot(runs):
+    """Run BOOT_RUN lazy and eager, runs times each, and print the medians side by side"""
+    results = {}
+    for name, extra in (("lazy", ()), ("eager", LAZY)):
+        got = []
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-c", BOOT_RUN % HERE] + list(extra), cwd=HERE,
+                                 capture_output=True, text=True, check=True).stdout
+            ms, held = out.split()[-2:]
+            got.append((float(ms), int(held)))
+        results[name] = (sorted(g[0] for g in got)[runs // 2], sorted(g[1] for g in got)[runs // 2])
+    print("Host boot of webhook-iot.py, median of %d fresh interpreters" % runs)
+    print("(eager also imports %s at boot, as before the lazy imports)" % ", ".join(LAZY))
+    print("%-8s %10s %12s" % ("imports", "load ms", "heap held"))
+    for name, (ms, held) in results.items():
+        print("%-8s %10.1f %12d" % (name, ms, held))
+    lazy, eager = results["lazy"], results["eager"]
+    print("lazy vs eager: %+.1f ms, %+d bytes held (%.0f%%)" % (
+        lazy[0] - eager[0], lazy[1] - eager[1], (lazy[1] - eager[1]) * 100 / eager[1]))
+    print("Host figures rank the two; on the board use the Boot: lines and build.py compare")
+
+
+def fmt(v):
+    return "-" if v is None else str(v)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build webhook-iot.py as .mpy or frozen modules")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("mpy", help="precompile to build/mpy")
+    p.add_argument("--mpy-cross", default="mpy-cross", help="mpy-cross matching the board firmware")
+    p = sub.add_parser("deploy", help="copy build/mpy to the board with mpremote")
+    p.add_argument("port")
+    sub.add_parser("manifest", help="write a frozen-module manifest for a firmware build")
+    sub.add_parser("check", help="check that every local module the app imports is built")
+    p = sub.add_parser("boot", help="lazy vs eager imports on the host, through host_stubs")
+    p.add_argument("--runs", type=int, default=5)
+    p = sub.add_parser("compare", help="compare Boot: lines from serial logs (first one is the baseline)")
+    p.add_argument("logs", nargs="+")
+    args = parser.parse_args()
+
+    if args.cmd == "mpy":
+        build_mpy(args.mpy_cross)
+    elif args.cmd == "deploy":
+        deploy(args.port)
+    elif args.cmd == "manifest":
+        build_manifest()
+    elif args.cmd == "check":
+        check_imports()
+    elif args.cmd == "boot":
+        boot(args.runs)
+    else:
+        compare(args.logs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,656 @@
+"""
+Downsampled chart data for monitor.html
+- Same JSON as getData.php (labels, voltage, current, pf, energy, power, latest, count),
+  but the whole requested window is always covered instead of the first LIMIT 500 rows
+- ?points=N (default 500) picks N rows by Largest-Triangle-Three-Buckets; mode=minmax
+  keeps the lowest and highest row of one series (by=power) per bucket instead
+- LTTB scores all charted series at once (triangle areas normalised per series and
+  summed), so one label array still serves every chart
+- NumPy over the queried window; only the bucket loop of LTTB is Python
+- When the rollups extension is on and the window holds more rows than points,
+  the finest rollup level with no more buckets than points is read instead
+  (bucket averages, plus min/max per series and energy_delta)
+- cursor in the reply is the newest row id; since=<cursor> returns the window from the
+  oldest row added after it onwards (raw rows, or for rollup levels from the bucket
+  holding it), so late backlog rows with old timestamps are sent too. start and
+  cursor let monitor.html trim and replace the tail instead of reloading
+- etag() tags a reply by the table's newest row id (MAX(id), one end of the primary
+  key, as getData.php does), so an unchanged window is answered with 304 before the
+  range query runs, whichever process wrote the rows
+- pack() is the same reply as typed arrays: a JSON header, then little-endian Int64
+  epoch-ms timestamps and one Float32 column per series, written straight from the
+  NumPy columns; monitor.html reads them as BigInt64Array / Float32Array views
+- Served by ingest_server.py at /getData.php and (binary) /getData.bin
+- Usage: python chart_query.py --bench [--rows 1000000] [--points 500]
+         python chart_query.py --bench-refresh [--refreshes 120]   (exits 1 if the since cursor misses a row)
+         python chart_query.py --bench-binary [--rows 10080]   (exits 1 if the two replies differ)
+         python chart_query.py --bench-render [--refreshes 120]   (monitor.html's client side, needs node)
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+import rollups
+from latest_cache import LatestCache
+from electric_db import ElectricDB, format_time, row_dict
+
+POINTS = 500
+MAX_POINTS = 5000
+SERIES = ("voltage", "current", "pf", "energy", "power")
+# Decimals as the firmware sends them (JSON_FIELDS in webhook-iot.py)
+DECIMALS = {"voltage": 1, "current": 3, "pf": 2, "energy": 3, "power": 1}
+# Binary reply: magic, uint32 header length, JSON header padded so the Int64 block is 8-aligned
+MAGIC = b"PZB1"
+
+
+# ============== Downsampling ==============
+def lttb(x, ys, n):
+    """Indices of n rows of ys (series x rows) over x, Largest-Triangle-Three-Buckets.
+    First and last rows are always kept."""
+    size = len(x)
+    if n >= size:
+        return np.arange(size)
+    if n < 3:
+        return np.array([0, size - 1][:max(n, 1)])
+    x = np.asarray(x, dtype=np.float64) - x[0]
+    ys = np.atleast_2d(np.asarray(ys, dtype=np.float64))
+    lo = ys.min(axis=1, keepdims=True)
+    span = ys.max(axis=1, keepdims=True) - lo
+    span[span == 0] = 1
+    ys = (ys - lo) / span
+
+    # n - 2 buckets over rows 1 .. size-2; bucket means from prefix sums
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    cx = np.concatenate(([0.0], np.cumsum(x)))
+    cy = np.concatenate((np.zeros((len(ys), 1)), np.cumsum(ys, axis=1)), axis=1)
+    out = np.empty(n, dtype=np.int64)
+    out[0] = 0
+    out[-1] = size - 1
+    a = 0
+    for i in range(n - 2):
+        s = edges[i]
+        e = edges[i + 1]
+        if i < n - 3:
+            ns = e
+            ne = edges[i + 2]
+        else:
+            ns = size - 1
+            ne = size
+        mx = (cx[ne] - cx[ns]) / (ne - ns)
+        my = (cy[:, ne] - cy[:, ns]) / (ne - ns)
+        ax = x[a]
+        ay = ys[:, a]
+        area = np.abs((ax - mx) * (ys[:, s:e] - ay[:, None])
+                      - (ax - x[s:e]) * (my - ay)[:, None]).sum(axis=0)
+        a = s + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+
+def minmax(y, n):
+    """Indices of the min and max row of y in each of n // 2 equal buckets, in row order"""
+    size = len(y)
+    if n >= size:
+        return np.arange(size)
+    buckets = max(n // 2, 1)
+    bucket = np.arange(size) * buckets // size
+    order = np.lexsort((y, bucket))
+    # order is sorted by bucket then value: each bucket's first entry is its min, last its max
+    starts = np.flatnonzero(np.diff(bucket[order], prepend=-1))
+    ends = np.append(starts[1:], size) - 1
+    return np.unique(np.concatenate((order[starts], order[ends])))
+
+
+# ============== Query ==============
+def columns(rows):
+    """DB rows (id, devid, mcid, amp, volt, pf, energy, timestamp) -> dict of NumPy columns"""
+    if not rows:
+        empty = np.empty(0)
+        return {"t": np.empty(0, dtype="datetime64[s]"),
+                "voltage": empty, "current": empty, "pf": empty, "energy": empty, "power": empty}
+    # One pass per column; zip(*rows) would build million-item tuples for the GC to walk
+    n = len(rows)
+    cols = {k: np.fromiter((r[i] for r in rows), np.float64, n)
+            for k, i in (("current", 3), ("voltage", 4), ("pf", 5), ("energy", 6))}
+    # DATETIME text (SQLite) or datetime objects (PyMySQL) both parse directly
+    cols["t"] = np.array([r[7] for r in rows]).astype("datetime64[s]")
+    # getData.php's power is volt * amp
+    cols["power"] = cols["voltage"] * cols["current"]
+    return cols
+
+
+def select(cols, points=POINTS, mode="lttb", by="power"):
+    """Row indices to send for a window"""
+    size = len(cols["t"])
+    if size <= points:
+        return np.arange(size)
+    if mode == "minmax":
+        return minmax(cols[by], points)
+    x = cols["t"].astype(np.int64)
+    return lttb(x, np.vstack([cols[k] for k in ("voltage", "current", "pf", "power")]), points)
+
+
+def labels(t):
+    """datetime64 -> "YYYY-MM-DD HH:MM:SS" as getData.php sends them"""
+    if not len(t):
+        # np.char.replace has no result type for an empty array
+        return []
+    return np.char.replace(np.datetime_as_string(t, unit="s"), "T", " ").tolist()
+
+
+def epoch_ms(t):
+    """Local DATETIME values (datetime64, no zone) -> Int64 epoch ms.
+    The UTC offset is looked up once per distinct hour, so DST changes inside a window hold."""
+    naive = t.astype("datetime64[s]").astype(np.int64)
+    hours, inv = np.unique(naive // 3600, return_inverse=True)
+    # mktime reads the broken-down time as local; -1 lets it work out DST
+    offset = np.array([time.mktime(time.gmtime(h)[:8] + (-1,)) - h for h in (hours * 3600).tolist()],
+                      dtype=np.int64)
+    return (naive + offset[inv]) * 1000
+
+
+def arrays(cols, idx):
+    """(name, values) of every series sent for the selected rows, rollup min/max included"""
+    out = [(k, cols[k][idx]) for k in SERIES]
+    if "min" in cols:
+        for side in ("min", "max"):
+            out += [(side + "_" + k, v[idx]) for k, v in cols[side].items()]
+        out.append(("energy_delta", cols["energy_delta"][idx]))
+    return out
+
+
+def pack(cols, idx, meta):
+    """Binary reply for the selected rows: MAGIC, uint32 header length, JSON header
+    (meta plus count and column names, space-padded to 8 bytes), count Int64 epoch ms,
+    then count Float32 values per column, all little-endian"""
+    cols_out = arrays(cols, idx)
+    head = dict(meta, count=len(idx), columns=[k for k, _ in cols_out])
+    head = json.dumps(head).encode()
+    head += b" " * (-(len(MAGIC) + 4 + len(head)) % 8)
+    parts = [MAGIC, struct.pack("<I", len(head)), head, epoch_ms(cols["t"][idx]).astype("<i8").tobytes()]
+    parts += [v.astype("<f4").tobytes() for _, v in cols_out]
+    return b"".join(parts)
+
+
+def unpack(buf):
+    """pack() output -> (header dict, epoch ms, {column: float32 view}); views, no copies"""
+    if buf[:4] != MAGIC:
+        raise ValueError("not a chart frame")
+    size = struct.unpack_from("<I", buf, 4)[0]
+    off = 8 + size
+    head = json.loads(buf[8:off])
+    n = head["count"]
+    ms = np.frombuffer(buf, "<i8", n, off)
+    off += 8 * n
+    out = {}
+    for k in head["columns"]:
+        out[k] = np.frombuffer(buf, "<f4", n, off)
+        off += 4 * n
+    return head, ms, out
+
+
+def render(cols, points=POINTS, mode="lttb", by="power", idx=None):
+    """getData.php-shaped dict (without latest) from raw or rollup columns"""
+    if idx is None:
+        idx = select(cols, points, mode, by)
+    total = len(cols["t"])
+    # Only the rows that are sent get formatted
+    data = {"labels": labels(cols["t"][idx])}
+    for k in SERIES:
+        data[k] = np.round(cols[k][idx], DECIMALS[k]).tolist()
+    if "min" in cols:
+        for side in ("min", "max"):
+            data[side] = {k: np.round(v[idx], DECIMALS[k]).tolist() for k, v in cols[side].items()}
+        data["energy_delta"] = np.round(cols["energy_delta"][idx], 3).tolist()
+    data["count"] = len(idx)
+    data["total"] = total
+    data["mode"] = mode if total > points else "raw"
+    return data
+
+
+def build(rows, points=POINTS, mode="lttb", by="power"):
+    """getData.php-shaped dict for raw rows"""
+    data = render(columns(rows), points, mode, by)
+    data["latest"] = row_dict(rows[-1]) if rows else None
+    return data
+
+
+def parse_params(query):
+    """getData.php parameters plus points/mode/by; raises ValueError on bad input"""
+    hours = int(query.get("hours", 24))
+    points = int(query.get("points", POINTS))
+    mode = query.get("mode", "lttb")
+    by = query.get("by", "power")
+    if not 0 < hours <= 24 * 366:
+        raise ValueError("hours out of range")
+    if not 2 <= points <= MAX_POINTS:
+        raise ValueError("points must be 2..{}".format(MAX_POINTS))
+    if mode not in ("lttb", "minmax") or by not in SERIES:
+        raise ValueError("unknown mode or series")
+    since = query.get("since", "")
+    # A row id from an earlier reply's cursor
+    since = int(since) if since else None
+    if since is not None and since < 0:
+        raise ValueError("bad since")
+    return query.get("devid", ""), hours, points, mode, by, since
+
+
+async def etag(db, query):
+    """Weak ETag for a /getData.php reply.
+    Changes when any row is added (backlog rows too, whatever their timestamps, and
+    from any writer: other workers, insertE1.php, n8n) or when the window start moves
+    to the next minute. Read from the database, not counted in this process, so every
+    server answers the same tag as getData.php's MAX(id). since is left out: a client
+    revalidating with its newest cursor and the tag that came with it gets 304 as
+    long as no row was added since that reply. Another device's rows change the tag
+    too; the since fetch that follows finds nothing and sends an empty reply."""
+    start = format_time(time.time() - int(query.get("hours", 24)) * 3600)
+    key = "|".join(sorted("{}={}".format(k, v) for k, v in query.items() if k != "since"))
+    key += "|{}|{}".format(await db.max_id(), start[:16])
+    return 'W/"{}"'.format(hashlib.sha1(key.encode()).hexdigest()[:16])
+
+
+async def query(db, params):
+    """Columns of the requested window, the rows to send and the reply fields
+    besides the series (mode, total, level, latest, start, since, cursor)"""
+    devid, hours, points, mode, by, since = parse_params(params)
+    now = time.time()
+    start = format_time(now - hours * 3600)
+    loop = asyncio.get_running_loop()
+    ext = db.extensions.get("rollups")
+    cache = db.extensions.get("latest")
+    level = rollups.pick_level(hours * 3600, points) if ext else None
+    # Read first: rows committed while this reply is built are past the cursor
+    # and come again next time (the client replaces, so twice is harmless)
+    cursor = await db.max_id()
+    first = start
+    if since is not None:
+        # Everything from the oldest row added after the cursor onwards
+        first = await db.first_changed(devid, start, since, cursor) if cursor > since else None
+    meta = {}
+    if first is None:
+        # Nothing new in the window
+        rows = []
+        cols = columns(rows) if level is None else rollups.columns(rows)
+        latest = None if cache else await db.latest(devid)
+        if level is not None:
+            meta["level"] = level
+    elif level is None:
+        rows = await db.window(devid, first)
+        # NumPy work off the event loop as well
+        cols = await loop.run_in_executor(db.executor, columns, rows)
+        latest = row_dict(rows[-1]) if rows else None
+    else:
+        # The bucket holding the first change may have grown since the client saw it
+        rows = await ext.select(level, devid, first)
+        cols = await loop.run_in_executor(db.executor, rollups.columns, rows)
+        meta["level"] = level
+        latest = None if cache else await db.latest(devid)
+    idx = await loop.run_in_executor(db.executor, select, cols, points, mode, by)
+    total = len(cols["t"])
+    meta["total"] = total
+    meta["mode"] = mode if total > points else "raw"
+    meta["latest"] = cache.get(devid) if cache else latest
+    meta["start"] = start
+    meta["start_ms"] = int(now - hours * 3600) * 1000
+    meta["since"] = since
+    meta["cursor"] = cursor
+    return cols, idx, meta
+
+
+async def get_data(db, params):
+    """/getData.php reply as a dict"""
+    cols, idx, meta = await query(db, params)
+    data = await asyncio.get_running_loop().run_in_executor(db.executor, lambda: render(cols, idx=idx))
+    data.update(meta)
+    return data
+
+
+async def get_binary(db, params):
+    """/getData.bin reply bytes (see pack)"""
+    cols, idx, meta = await query(db, params)
+    return await asyncio.get_running_loop().run_in_executor(db.executor, pack, cols, idx, meta)
+
+
+# ============== Benchmark ==============
+def synthetic(n, step=60):
+    """n rows one step apart ending now, with load steps, spikes and noise"""
+    rng = np.random.default_rng(1)
+    end = int(time.time())
+    t = end - step * np.arange(n)[::-1]
+    load = np.repeat(rng.uniform(0.2, 12, n // 500 + 1), 500)[:n]
+    amp = np.clip(load + rng.normal(0, 0.2, n), 0, None)
+    spikes = rng.random(n) < 0.0005
+    amp[spikes] += 25
+    volt = 230 + 4 * np.sin(np.arange(n) / 1440 * 2 * np.pi) + rng.normal(0, 0.8, n)
+    pf = np.clip(0.9 + rng.normal(0, 0.03, n), 0, 1)
+    energy = np.cumsum(volt * amp * step / 3.6e6)
+    return t, volt, amp, pf, energy
+
+
+def bench(n, points):
+    t, volt, amp, pf, energy = synthetic(n)
+    ys = np.vstack((volt, amp, pf, volt * amp))
+    for name, fn in (("lttb", lambda: lttb(t, ys, points)), ("minmax", lambda: minmax(volt * amp, points))):
+        fn()
+        t0 = time.perf_counter()
+        idx = fn()
+        ms = (time.perf_counter() - t0) * 1000
+        kept = int((amp[idx] > 20).sum())
+        print("  %-7s %d -> %d points in %.1f ms, %d of %d spikes kept" % (
+            name, n, len(idx), ms, kept, int((amp > 20).sum())))
+
+    # End to end through SQLite: raw rows (what a LIMIT-less getData.php would send) vs downsampled
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+
+        async def run():
+            db = await ElectricDB("sqlite:" + path).open()
+            stamps = [format_time(s) for s in t.tolist()]
+            rows = list(zip(["e089"] * n, ["m-001"] * n, amp.tolist(), volt.tolist(),
+                            pf.tolist(), energy.tolist(), stamps))
+            for i in range(0, n, 50000):
+                await db.insert_many(rows[i:i + 50000])
+            hours = n * 60 // 3600 + 1
+            t0 = time.perf_counter()
+            got = await db.window("e089", format_time(time.time() - hours * 3600))
+            fetch = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            raw = json.dumps(build(got, len(got) + 1))
+            raw_s = time.perf_counter() - t0
+            for mode in ("lttb", "minmax"):
+                t0 = time.perf_counter()
+                small = json.dumps(build(got, points, mode))
+                print("  %-7s fetch %.0f ms + build %.0f ms, %d bytes (raw build %.0f ms, %d bytes)" % (
+                    mode, fetch * 1000, (time.perf_counter() - t0) * 1000, len(small), raw_s * 1000, len(raw)))
+            db.close()
+
+        asyncio.run(run())
+
+
+def delivered(replies, rid, stamp):
+    """Whether a row (id, timestamp) reached a client through its since replies
+    (since, cursor, raw, labels): the reply fetched after the row was added must
+    start at or before it, and list it when it was sent raw (LTTB keeps the first
+    and last row of a reply, not necessarily this one)"""
+    for since, cursor, raw, labels in replies:
+        if since < rid <= cursor:
+            return bool(labels) and labels[0] <= stamp and (not raw or stamp in labels)
+    return False
+
+
+def bench_refresh(refreshes, points, step=60, every=30, backlog_every=10):
+    """A 24h dashboard refreshing every `every` s while a device sends every `step` s,
+    plus now and then a backlog reading with a timestamp two hours old:
+    full reloads vs since-cursor fetches with ETag revalidation, as ingest_server answers them.
+    Every row added after the first reply is checked against the incremental client's
+    replies; a client with a timestamp cursor (rows newer than the newest one it saw)
+    runs alongside and must miss the backlog rows, or the check itself is broken.
+    Returns False if the incremental client missed a row."""
+    with tempfile.TemporaryDirectory() as tmp:
+        async def run():
+            db = ElectricDB("sqlite:" + os.path.join(tmp, "refresh.db"))
+            db.extend("latest", LatestCache(db))
+            await db.open()
+            now = time.time()
+            t, volt, amp, pf, energy = synthetic(24 * 3600 // step, step)
+            await db.insert_many(list(zip(["e089"] * len(t), ["m-001"] * len(t), amp.tolist(), volt.tolist(),
+                                          pf.tolist(), energy.tolist(), [format_time(s) for s in t.tolist()])))
+            query = {"devid": "e089", "hours": "24", "points": str(points)}
+            tag = await etag(db, query)
+            first = await get_data(db, query)
+            start = first["start"]
+            cursor = first["cursor"]
+            newest = first["labels"][-1]
+            stats = {"full": [0, 0.0], "since": [0, 0.0]}
+            unchanged = 0
+            backlog = 0
+            replies = []
+            by_time = []
+            upto = cursor
+            for i in range(1, refreshes + 1):
+                clock = now + i * every
+                if i * every % step == 0:
+                    await db.insert_many([("e089", "m-001", 5.0, 230.0, 0.9, float(energy[-1]), format_time(clock))])
+                if i % backlog_every == 0:
+                    backlog += 1
+                    await db.insert_many([("e089", "m-001", 4.0, 229.0, 0.9, float(energy[-1]),
+                                           format_time(clock - 7200 - i))])
+                t0 = time.perf_counter()
+                stats["full"][0] += len(json.dumps(await get_data(db, query)))
+                stats["full"][1] += time.perf_counter() - t0
+                t0 = time.perf_counter()
+                q = dict(query, since=str(cursor))
+                if await etag(db, q) == tag:
+                    # What ingest_server answers with 304 and an empty body
+                    unchanged += 1
+                else:
+                    tag = await etag(db, q)
+                    data = await get_data(db, q)
+                    stats["since"][0] += len(json.dumps(data))
+                    replies.append((cursor, data["cursor"], data["mode"] == "raw", data["labels"]))
+                    cursor = data["cursor"]
+                stats["since"][1] += time.perf_counter() - t0
+                # The timestamp cursor: only rows newer than the newest one shown
+                top = await db.max_id()
+                stamps = [str(r[7]) for r in await db.window("e089", newest) if str(r[7]) > newest]
+                by_time.append((upto, top, True, stamps))
+                upto = top
+                newest = stamps[-1] if stamps else newest
+            for name, (size, secs) in stats.items():
+                print("  %-5s %8.1f KB/refresh, %6.2f ms server time/refresh" % (
+                    name, size / 1024 / refreshes, secs * 1000 / refreshes))
+            print("  %d of %d incremental refreshes answered 304" % (unchanged, refreshes))
+            late = [(r[0], str(r[7])) for r in await db.window("e089", start) if r[0] > first["cursor"]]
+            missed = [rid for rid, stamp in late if not delivered(replies, rid, stamp)]
+            skipped = [rid for rid, stamp in late if not delivered(by_time, rid, stamp)]
+            print("  %d rows added (%d backlog with old timestamps): %d missed by the since cursor, "
+                  "%d by a timestamp cursor" % (len(late), backlog, len(missed), len(skipped)))
+            db.close()
+            if backlog and not skipped:
+                print("  check broken: the timestamp cursor missed nothing")
+                return False
+            return not missed
+
+        return asyncio.run(run())
+
+
+# Runs monitor.html's own script under Node: DOM, Chart and fetch are stand-ins, fetch
+# answers with the replies bench_render() saved. Chart.update() does nothing, so canvas
+# drawing is not in the times; decoding, merging, axis labels and stats are.
+RENDER_HARNESS = r"""
+const fs = require('fs'), vm = require('vm');
+const dir = process.argv[2];
+global.plan = JSON.parse(fs.readFileSync(dir + '/plan.json'));
+const page = fs.readFileSync(plan.page, 'utf8');
+const script = page.slice(page.lastIndexOf('<script>') + 8, page.lastIndexOf('</script>'));
+const els = {};
+global.document = {getElementById: id => els[id] || (els[id] = {
+    id, value: {devid: 'e089', hours: '24', refreshInterval: '30000'}[id] || '', textContent: '',
+    innerHTML: '', className: '', classList: {add() {}, remove() {}}, addEventListener() {},
+    options: [{text: '30s'}], selectedIndex: 0})};
+global.Chart = class { constructor(el, cfg) { this.data = cfg.data; } update() {} };
+global.setInterval = () => 0;
+global.clearInterval = () => {};
+global.queue = [];
+global.fetch = async url => {
+    const r = global.queue.shift() || {status: 304, etag: null};
+    const body = r.file ? fs.readFileSync(dir + '/' + r.file) : Buffer.alloc(0);
+    return {status: r.status, ok: r.status === 200, headers: {get: () => r.etag},
+            text: async () => body.toString(),
+            arrayBuffer: async () => body.buffer.slice(body.byteOffset, body.byteOffset + body.length)};
+};
+const harness = `
+(async () => {
+    const out = {};
+    for (const mode of ['json', 'binary']) {
+        binary = mode === 'binary';
+        const full = [], since = [];
+        for (let i = 0; i < plan.full_repeats; i++) {
+            shown = null;
+            queue = [plan[mode].full];
+            const t0 = process.hrtime.bigint();
+            await fetchData();
+            full.push(Number(process.hrtime.bigint() - t0) / 1e6);
+        }
+        for (const r of plan[mode].since) {
+            queue = [r];
+            const t0 = process.hrtime.bigint();
+            await fetchData();
+            if (r.status === 200) since.push(Number(process.hrtime.bigint() - t0) / 1e6);
+        }
+        out[mode] = {full, since, points: shown.labels.length,
+                     ok: document.getElementById('status').className === 'status online'};
+    }
+    console.log(JSON.stringify(out));
+})();
+`;
+vm.runInThisContext(script + harness);
+"""
+
+
+def bench_render(refreshes, points, step=60, every=30):
+    """Client-side time per refresh in monitor.html: full reload vs since-cursor merge.
+    Needs node; see RENDER_HARNESS for what is and is not timed."""
+    import shutil
+    import subprocess
+    node = shutil.which("node")
+    if not node:
+        print("  node not found, skipped")
+        return True
+    with tempfile.TemporaryDirectory() as tmp:
+        async def run():
+            db = ElectricDB("sqlite:" + os.path.join(tmp, "render.db"))
+            db.extend("latest", LatestCache(db))
+            await db.open()
+            now = time.time()
+            t, volt, amp, pf, energy = synthetic(24 * 3600 // step, step)
+            await db.insert_many(list(zip(["e089"] * len(t), ["m-001"] * len(t), amp.tolist(), volt.tolist(),
+                                          pf.tolist(), energy.tolist(), [format_time(s) for s in t.tolist()])))
+            query = {"devid": "e089", "hours": "24", "points": str(points)}
+            plan = {"page": os.path.join(os.path.dirname(os.path.abspath(__file__)), "monitor.html"),
+                    "full_repeats": 20, "json": {"since": []}, "binary": {"since": []}}
+
+            def save(name, body, tag, mode, key):
+                with open(os.path.join(tmp, name), "wb") as f:
+                    f.write(body)
+                entry = {"status": 200, "file": name, "etag": tag}
+                if key == "full":
+                    plan[mode]["full"] = entry
+                else:
+                    plan[mode]["since"].append(entry)
+
+            tag = await etag(db, query)
+            full = await get_data(db, query)
+            save("full.json", json.dumps(full).encode(), tag, "json", "full")
+            save("full.bin", await get_binary(db, query), tag, "binary", "full")
+            cursor = full["cursor"]
+            for i in range(1, refreshes + 1):
+                if i * every % step == 0:
+                    await db.insert_many([("e089", "m-001", 5.0, 230.0, 0.9, float(energy[-1]),
+                                           format_time(now + i * every))])
+                q = dict(query, since=str(cursor))
+                if await etag(db, q) == tag:
+                    for mode in ("json", "binary"):
+                        plan[mode]["since"].append({"status": 304, "etag": tag})
+                    continue
+                tag = await etag(db, q)
+                data = await get_data(db, q)
+                save("since%03d.json" % i, json.dumps(data).encode(), tag, "json", "since")
+                save("since%03d.bin" % i, await get_binary(db, q), tag, "binary", "since")
+                cursor = data["cursor"]
+            db.close()
+            with open(os.path.join(tmp, "plan.json"), "w") as f:
+                json.dump(plan, f)
+            with open(os.path.join(tmp, "harness.js"), "w") as f:
+                f.write(RENDER_HARNESS)
+
+        asyncio.run(run())
+        out = subprocess.run([node, os.path.join(tmp, "harness.js"), tmp], capture_output=True, text=True)
+        if out.returncode:
+            print(out.stderr)
+            return False
+        result = json.loads(out.stdout)
+    ok = True
+    for mode, r in result.items():
+        # The first full reload warms the JIT up
+        full = np.median(r["full"][1:])
+        since = np.median(r["since"]) if r["since"] else 0.0
+        print("  %-6s full reload %6.2f ms, since merge %6.2f ms (median of %d), %d points shown" % (
+            mode, full, since, len(r["since"]), r["points"]))
+        ok = ok and r["ok"]
+    return ok
+
+
+def bench_binary(n):
+    """JSON vs typed-array reply for n raw rows sent in full (a week at one reading a minute)"""
+    t, volt, amp, pf, energy = synthetic(n)
+    cols = {"t": np.array([format_time(s) for s in t.tolist()]).astype("datetime64[s]"),
+            "voltage": volt, "current": amp, "pf": pf, "energy": energy, "power": volt * amp}
+    idx = np.arange(n)
+    meta = {"total": n, "mode": "raw", "latest": None}
+    timings = {}
+    for name, encode, decode in (
+            ("json", lambda: json.dumps(dict(render(cols, idx=idx), **meta)).encode(), json.loads),
+            ("binary", lambda: pack(cols, idx, meta), unpack)):
+        encode()
+        t0 = time.perf_counter()
+        body = encode()
+        enc = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        decode(body)
+        timings[name] = body
+        print("  %-6s %9d bytes, encode %6.1f ms, decode %6.1f ms" % (
+            name, len(body), enc * 1000, (time.perf_counter() - t0) * 1000))
+    # Same points either way (Float32 keeps the firmware's decimals)
+    head, ms, got = unpack(timings["binary"])
+    data = json.loads(timings["json"])
+    bad = [k for k in SERIES if not np.allclose(got[k], data[k], rtol=1e-6, atol=10 ** -DECIMALS[k])]
+    stamps = [format_time(s) for s in (ms // 1000).tolist()]
+    if bad or stamps != data["labels"]:
+        print("  MISMATCH: %s" % (bad or "timestamps"))
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LTTB / min-max downsampling for chart queries")
+    parser.add_argument('--bench', action='store_true')
+    parser.add_argument('--rows', type=int, help="default 1000000, or a week of minutes for --bench-binary")
+    parser.add_argument('--points', type=int, default=POINTS)
+    parser.add_argument('--bench-refresh', action='store_true')
+    parser.add_argument('--refreshes', type=int, default=120)
+    parser.add_argument('--bench-binary', action='store_true')
+    parser.add_argument('--bench-render', action='store_true')
+    args = parser.parse_args()
+    if args.bench_binary:
+        rows = args.rows or 7 * 1440
+        print("%d rows as JSON vs typed arrays:" % rows)
+        if not bench_binary(rows):
+            raise SystemExit(1)
+    elif args.bench_render:
+        print("monitor.html, 24h window refreshed every 30 s, %d refreshes:" % args.refreshes)
+        if not bench_render(args.refreshes, args.points):
+            raise SystemExit(1)
+    elif args.bench_refresh:
+        print("24h window refreshed every 30 s, %d refreshes:" % args.refreshes)
+        if not bench_refresh(args.refreshes, args.points):
+            raise SystemExit(1)
+    elif args.bench:
+        rows = args.rows or 1000000
+        print("Downsampling %d rows to %d points:" % (rows, args.points))
+        bench(rows, args.points)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+"""
+Append-only columnar store for PZEM series, alongside the electric table
+- One directory per device and machine, one segment per local day:
+  ROOT/<devid>/<mcid>/<YYYY-MM-DD>/<column>.bin, each a flat little-endian array
+- Fixed-width columns: t int64 epoch s, volt/amp/power/freq/pf float32, energy float64
+  (the kWh counter keeps its 3 decimals past 10000); no strings repeated per row
+- Appends are plain writes at the end of each column file; a crash mid-batch is
+  cut back to the shortest column when the segment is next opened
+- Reads mmap the column files and wrap them with numpy.frombuffer: no per-row decoding,
+  and a range inside one segment comes back as views of the mapped pages
+- Sparse time index in memory: the segments of a device by day, and inside a
+  segment every STRIDE-th timestamp, so a range is found without touching the
+  pages it does not need; late rows (backlog uploads) mark a segment unsorted and
+  are found by a mask instead
+- ElectricDB extension as well: ingest_server.py --store DIR appends every committed
+  batch (freq is not in the electric rows, it stays NaN there)
+- Usage: python column_store.py --bench [--rows 2000000] [--devices 20]
+         python column_store.py --import DIR [--db sqlite:electric.db]
+"""
+
+import argparse
+import asyncio
+import collections
+import mmap
+import os
+import tempfile
+import time
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+from electric_db import ElectricDB, format_time
+
+COLUMNS = (("t", "<i8"), ("volt", "<f4"), ("amp", "<f4"), ("power", "<f4"),
+           ("energy", "<f8"), ("freq", "<f4"), ("pf", "<f4"))
+DTYPES = dict(COLUMNS)
+# One sparse index entry per this many rows of a segment
+STRIDE = 1024
+# Segments whose column files stay open for appending
+MAX_OPEN = 128
+
+
+def local_days(t):
+    """Epoch seconds -> local day number (days since 1970-01-01 on the local calendar);
+    the UTC offset is looked up once per distinct hour, so DST changes hold"""
+    hours, inv = np.unique(t // 3600, return_inverse=True)
+    offset = np.array([time.localtime(h).tm_gmtoff for h in (hours * 3600).tolist()], dtype=np.int64)
+    return (t + offset[inv]) // 86400
+
+
+def day_name(day):
+    return str(np.datetime64(int(day), "D"))
+
+
+def local_epoch(stamps):
+    """DATETIME text (local time) -> epoch seconds"""
+    naive = np.array(stamps).astype("datetime64[s]").astype(np.int64)
+    hours, inv = np.unique(naive // 3600, return_inverse=True)
+    # mktime reads the broken-down time as local; -1 lets it work out DST
+    offset = np.array([time.mktime(time.gmtime(h)[:8] + (-1,)) - h for h in (hours * 3600).tolist()],
+                      dtype=np.int64)
+    return naive + offset[inv]
+
+
+# ============== Segment ==============
+class Segment:
+    """One device's columns for one local day"""
+    def __init__(self, path):
+        self.path = path
+        self.loaded = False
+        self.files = None
+        self.maps = {}
+
+    def load(self):
+        """Row count from the column files (cut back to the shortest), bounds and sparse index"""
+        os.makedirs(self.path, exist_ok=True)
+        sizes = {}
+        for name, dtype in COLUMNS:
+            p = os.path.join(self.path, name + ".bin")
+            sizes[name] = os.path.getsize(p) // np.dtype(dtype).itemsize if os.path.exists(p) else 0
+        self.count = min(sizes.values())
+        for name, dtype in COLUMNS:
+            if sizes[name] != self.count:
+                with open(os.path.join(self.path, name + ".bin"), "r+b") as f:
+                    f.truncate(self.count * np.dtype(dtype).itemsize)
+        t = self.column("t")
+        self.sparse = t[::STRIDE].copy()
+        self.ordered = bool(self.count < 2 or (np.diff(t) >= 0).all())
+        self.tmin = int(t.min()) if self.count else None
+        self.tmax = int(t.max()) if self.count else None
+        self.loaded = True
+        return self
+
+    def column(self, name):
+        """Whole column as a read-only array over the mapped file"""
+        if not self.count:
+            return np.empty(0, DTYPES[name])
+        mm = self.maps.get(name)
+        size = self.count * np.dtype(DTYPES[name]).itemsize
+        if mm is None or len(mm) < size:
+            with open(os.path.join(self.path, name + ".bin"), "rb") as f:
+                # Arrays handed out keep the old map alive; it is dropped, not closed
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[name] = mm
+        return np.frombuffer(mm, DTYPES[name], self.count)
+
+    def append(self, t, cols):
+        if self.files is None:
+            self.files = {name: open(os.path.join(self.path, name + ".bin"), "ab") for name, _ in COLUMNS}
+        n = len(t)
+        for name, dtype in COLUMNS:
+            v = t if name == "t" else cols.get(name)
+            if v is None:
+                v = np.full(n, np.nan)
+            self.files[name].write(np.ascontiguousarray(v, dtype=dtype).tobytes())
+        # Out of the process buffers at once; a torn batch is trimmed by load()
+        for f in self.files.values():
+            f.flush()
+        first = self.count
+        if self.count and t[0] < self.tmax or (n > 1 and (np.diff(t) < 0).any()):
+            self.ordered = False
+        self.count += n
+        self.tmin = int(t.min()) if self.tmin is None else min(self.tmin, int(t.min()))
+        self.tmax = int(t.max()) if self.tmax is None else max(self.tmax, int(t.max()))
+        # Sparse entries for the rows at multiples of STRIDE
+        pos = np.arange(-first % STRIDE, n, STRIDE)
+        if len(pos):
+            self.sparse = np.concatenate((self.sparse, t[pos]))
+
+    def close_files(self):
+        if self.files:
+            for f in self.files.values():
+                f.close()
+        self.files = None
+
+    def rows(self, t0, t1):
+        """Row slice (or index array, if the segment has late rows) with t0 <= t < t1"""
+        t = self.column("t")
+        if not self.ordered:
+            return np.flatnonzero((t >= t0) & (t < t1))
+        # The sparse index narrows each bound to one block of STRIDE rows
+        bounds = []
+        for x in (t0, t1):
+            block = max(int(np.searchsorted(self.sparse, x, "right")) - 1, 0)
+            lo = block * STRIDE
+            hi = min(lo + STRIDE, self.count)
+            bounds.append(lo + int(np.searchsorted(t[lo:hi], x, "left")))
+        return slice(*bounds)
+
+
+# ============== Store ==============
+class ColumnStore:
+    def __init__(self, root):
+        self.root = root
+        # (devid, mcid) -> {day number: Segment}; directories are listed at open,
+        # column files are read on first use
+        self.index = collections.defaultdict(dict)
+        self.open_files = collections.OrderedDict()
+        self.rows_appended = 0
+        os.makedirs(root, exist_ok=True)
+        for d in os.listdir(root):
+            for m in os.listdir(os.path.join(root, d)):
+                for day in os.listdir(os.path.join(root, d, m)):
+                    self.index[(unquote(d), unquote(m))][int(np.datetime64(day, "D").astype(np.int64))] = \
+                        Segment(os.path.join(root, d, m, day))
+
+    def segment(self, devid, mcid, day, create=False):
+        segs = self.index[(devid, mcid)]
+        seg = segs.get(day)
+        if seg is None:
+            if not create:
+                return None
+            seg = segs[day] = Segment(os.path.join(self.root, quote(devid, safe=""), quote(mcid, safe=""),
+                                                   day_name(day)))
+        return seg if seg.loaded else seg.load()
+
+    def append(self, devid, mcid, t, cols):
+        """Rows of one device: t (epoch s) and {column: values}; split by local day"""
+        t = np.asarray(t, dtype=np.int64)
+        days = local_days(t)
+        for day in np.unique(days).tolist():
+            sel = days == day
+            part = {k: np.asarray(v)[sel] for k, v in cols.items()}
+            seg = self.segment(devid, mcid, day, create=True)
+            seg.append(t[sel], part)
+            self.open_files[seg.path] = seg
+            self.open_files.move_to_end(seg.path)
+            while len(self.open_files) > MAX_OPEN:
+                self.open_files.popitem(last=False)[1].close_files()
+        self.rows_appended += len(t)
+
+    def append_rows(self, rows):
+        """Electric rows (devid, mcid, amp, volt, pf, energy, timestamp), any device mix"""
+        n = len(rows)
+        keys = np.array([r[0] + "\0" + r[1] for r in rows])
+        uniq, inv = np.unique(keys, return_inverse=True)
+        order = np.argsort(inv, kind="stable")
+        rows = [rows[i] for i in order.tolist()]
+        inv = inv[order]
+        cols = {k: np.fromiter((r[i] for r in rows), np.float64, n)
+                for k, i in (("amp", 2), ("volt", 3), ("pf", 4), ("energy", 5))}
+        cols["power"] = cols["volt"] * cols["amp"]
+        t = local_epoch([str(r[6]) for r in rows])
+        starts = np.flatnonzero(np.diff(inv, prepend=-1))
+        ends = np.append(starts[1:], n)
+        for g, key in enumerate(uniq.tolist()):
+            devid, mcid = key.split("\0", 1)
+            s, e = starts[g], ends[g]
+            self.append(devid, mcid, t[s:e], {k: v[s:e] for k, v in cols.items()})
+
+    def scan(self, devid, mcid, t0, t1, columns=None):
+        """{column: array} for t0 <= t < t1 in storage order (time order unless rows came late).
+        Within one segment these are views of the mapped files; across segments, one copy."""
+        names = ["t"] + [c for c in (columns or DTYPES) if c != "t"]
+        segs = self.index.get((devid, mcid), {})
+        # Day bounds with a day of slack either side for the UTC offset
+        first, last = t0 // 86400 - 1, t1 // 86400 + 1
+        parts = []
+        for day in sorted(d for d in segs if first <= d <= last):
+            seg = self.segment(devid, mcid, day)
+            if not seg.count or seg.tmax < t0 or seg.tmin >= t1:
+                continue
+            rows = seg.rows(t0, t1)
+            parts.append({k: seg.column(k)[rows] for k in names})
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            return {k: np.empty(0, DTYPES[k]) for k in names}
+        return {k: np.concatenate([p[k] for p in parts]) for k in names}
+
+    def devices(self):
+        return sorted(self.index)
+
+    def size(self):
+        """Bytes on disk"""
+        total = 0
+        for base, _, files in os.walk(self.root):
+            total += sum(os.path.getsize(os.path.join(base, f)) for f in files)
+        return total
+
+    def close(self):
+        for seg in self.open_files.values():
+            seg.close_files()
+        self.open_files.clear()
+
+    # ============== ElectricDB hooks ==============
+    def schema(self, kind):
+        return []
+
+    def on_insert(self, cur, rows):
+        # Files are written once the rows are committed
+        return lambda: self.append_rows(rows)
+
+
+# ============== Benchmark ==============
+def file_size(path):
+    return sum(os.path.getsize(path + s) for s in ("", "-wal") if os.path.exists(path + s))
+
+
+async def bench(rows, devices, chunk=50000):
+    from chart_query import columns
+    from rollups import synthetic_rows
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        db = await ElectricDB("sqlite:" + path).open()
+        store = ColumnStore(os.path.join(tmp, "store"))
+        span = rows // devices * 60
+        start = int(time.time()) - span
+        db_s = store_s = 0.0
+        for i in range(0, rows, chunk):
+            batch = synthetic_rows(start + (i // devices) * 60, min(chunk, rows - i), devices)
+            t0 = time.perf_counter()
+            await db.insert_many(batch)
+            db_s += time.perf_counter() - t0
+            t0 = time.perf_counter()
+            store.append_rows(batch)
+            store_s += time.perf_counter() - t0
+        store.close()
+        await db.run(lambda c: c.execute("PRAGMA wal_checkpoint(TRUNCATE)"))
+        db_size = file_size(path)
+        print("ingest %d rows, %d devices, %d days:" % (rows, devices, span // 86400 + 1))
+        print("  %-14s %9.0f rows/s  %7.1f MB  %5.1f bytes/row" % (
+            "electric table", rows / db_s, db_size / 1e6, db_size / rows))
+        print("  %-14s %9.0f rows/s  %7.1f MB  %5.1f bytes/row  (7 columns incl. power, freq)" % (
+            "column store", rows / store_s, store.size() / 1e6, store.size() / rows))
+
+        # Reopen: scans start from the directory listing, as after a restart
+        store = ColumnStore(store.root)
+        now = time.time()
+        print("%-8s %8s %12s %12s" % ("range", "rows", "table ms", "store ms"))
+        ok = True
+        for hours in (1, 24, 24 * 7, 24 * 30):
+            if hours * 3600 > span:
+                continue
+            since = now - hours * 3600
+            t0 = time.perf_counter()
+            got = columns(await db.window("e001", format_time(since)))
+            table_ms = (time.perf_counter() - t0) * 1000
+            t0 = time.perf_counter()
+            cols = store.scan("e001", "m-001", int(since), int(now) + 1, ("volt", "amp", "pf", "energy", "power"))
+            # Touch the values so mapped pages are really read
+            float(cols["volt"].sum() + cols["amp"].sum())
+            store_ms = (time.perf_counter() - t0) * 1000
+            print("%-8s %8d %12.1f %12.1f" % ("%dh" % hours, len(cols["t"]), table_ms, store_ms))
+            same = len(got["t"]) == len(cols["t"]) and np.allclose(got["voltage"], cols["volt"], atol=1e-4)
+            ok = ok and same
+        db.close()
+        store.close()
+        if not ok:
+            print("MISMATCH between table and store")
+        return ok
+
+
+async def import_table(url, root, chunk=100000):
+    """Copy the electric table into a store, in id order"""
+    db = await ElectricDB(url, 1).open()
+    store = ColumnStore(root)
+    sql = ("SELECT id, devid, mcid, amp, volt, pf, energy, timestamp FROM electric "
+           "WHERE id > {0} ORDER BY id LIMIT {0}".format(db.mark))
+
+    def fetch(conn, last):
+        cur = conn.cursor()
+        try:
+            cur.execute(sql, (last, chunk))
+            return cur.fetchall()
+        finally:
+            cur.close()
+
+    last = 0
+    total = 0
+    while True:
+        batch = await db.run(fetch, last)
+        if not batch:
+            break
+        last = batch[-1][0]
+        store.append_rows([r[1:] for r in batch])
+        total += len(batch)
+        print("{} rows".format(total))
+    store.close()
+    db.close()
+    print("{} rows in {} ({:.1f} MB)".format(total, root, store.size() / 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Append-only columnar store for PZEM series")
+    parser.add_argument('--bench', action='store_true')
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--import', dest='into', metavar='DIR', help="copy the electric table into DIR")
+    parser.add_argument('--db', default="sqlite:electric.db")
+    args = parser.parse_args()
+    if args.bench:
+        if not asyncio.run(bench(args.rows, args.devices)):
+            raise SystemExit(1)
+    elif args.into:
+        asyncio.run(import_table(args.db, args.into))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
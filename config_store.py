@@ -0,0 +1,198 @@
+"""
+Unified config store for the PZEM firmware
+- One record (config.json) instead of device_config.txt / wifi_config.txt / lcd_config.txt
+- Record = header line "PZEMCFG <version> <seq> <crc32>" + JSON body, so a torn
+  or corrupted file is detected and the previous copy is used instead
+- Atomic save: write config.tmp, then rename over config.json
+- Reads come from the in-memory cache, never from flash
+- set() only marks the record dirty when a value really changed; writes are
+  coalesced and happen at most once per COALESCE_MS (or on flush())
+- Legacy .txt files are migrated on first load
+"""
+
+import os
+import time
+
+try:
+    import ujson as json
+except ImportError:
+    json = __import__("json")
+
+try:
+    from binascii import crc32
+except ImportError:
+    crc32 = None
+
+VERSION = 1
+MAGIC = "PZEMCFG"
+PATH = "config.json"
+TMP = "config.tmp"
+COALESCE_MS = 10000
+
+try:
+    ticks_ms = time.ticks_ms
+    ticks_diff = time.ticks_diff
+except AttributeError:
+    # CPython, for config_wear.py
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_diff(a, b):
+        return a - b
+
+def checksum(body):
+    if crc32:
+        return crc32(body) & 0xFFFFFFFF
+    # Fallback for ports built without binascii.crc32
+    c = 0
+    for b in body:
+        c = (c * 31 + b) & 0xFFFFFFFF
+    return c
+
+# ============== Legacy Files ==============
+def _lines(path):
+    with open(path) as f:
+        return [line.strip() for line in f.read().split("\n")]
+
+def _legacy_device(path):
+    lines = _lines(path) + ["", "", ""]
+    out = {}
+    if lines[0]:
+        out["devid"] = lines[0]
+    if lines[1]:
+        out["mcid"] = lines[1]
+    if lines[2]:
+        out["interval"] = int(lines[2])
+    return out
+
+def _legacy_wifi(path):
+    lines = _lines(path) + ["", ""]
+    if not lines[0]:
+        return {}
+    return {"ssid": lines[0], "password": lines[1]}
+
+def _legacy_lcd(path):
+    return {"backlight": _lines(path)[0] == "1"}
+
+LEGACY = (
+    ("device_config.txt", _legacy_device),
+    ("wifi_config.txt", _legacy_wifi),
+    ("lcd_config.txt", _legacy_lcd),
+)
+
+# ============== Store ==============
+class ConfigStore:
+    def __init__(self, defaults, path=PATH, tmp=TMP, coalesce_ms=COALESCE_MS, clock=ticks_ms):
+        self.defaults = defaults
+        self.path = path
+        self.tmp = tmp
+        self.coalesce_ms = coalesce_ms
+        self.clock = clock
+        self.data = dict(defaults)
+        self.seq = 0
+        self.dirty = False
+        self.dirty_since = 0
+        self.writes = 0
+        self.skipped = 0
+
+    # ============== Load ==============
+    def _read(self, path):
+        """(seq, dict) from a record file, or None if missing, corrupt or another version"""
+        try:
+            with open(path) as f:
+                header = f.readline().split()
+                body = f.read()
+            if len(header) != 4 or header[0] != MAGIC or int(header[1]) != VERSION:
+                return None
+            if int(header[3], 16) != checksum(body.encode()):
+                return None
+            return int(header[2]), json.loads(body)
+        except:
+            return None
+
+    def load(self):
+        """Fill the cache from flash; returns "record", "tmp", "legacy" or "defaults" """
+        best = None
+        source = "defaults"
+        # A crash between writing the temp file and the rename leaves the newer copy in tmp
+        for path, name in ((self.path, "record"), (self.tmp, "tmp")):
+            rec = self._read(path)
+            if rec and (best is None or rec[0] > best[0]):
+                best = rec
+                source = name
+        if best:
+            self.seq = best[0]
+            self.data = dict(self.defaults)
+            self.data.update(best[1])
+            return source
+
+        migrated = False
+        for path, parse in LEGACY:
+            try:
+                self.data.update(parse(path))
+                migrated = True
+            except:
+                pass
+        if migrated:
+            self.dirty = True
+            if self.flush():
+                for path, _ in LEGACY:
+                    try:
+                        os.remove(path)
+                    except:
+                        pass
+            return "legacy"
+        return source
+
+    # ============== Cache ==============
+    def get(self, key):
+        return self.data.get(key, self.defaults.get(key))
+
+    def set(self, key, value):
+        """Update the cache; the record is only marked dirty if the value changed"""
+        if self.data.get(key) == value:
+            self.skipped += 1
+            return False
+        self.data[key] = value
+        if not self.dirty:
+            self.dirty = True
+            self.dirty_since = self.clock()
+        return True
+
+    def update(self, values):
+        changed = False
+        for key in values:
+            if self.set(key, values[key]):
+                changed = True
+        return changed
+
+    # ============== Save ==============
+    def poll(self):
+        """Write if something has been dirty for coalesce_ms (call from a periodic task)"""
+        if self.dirty and ticks_diff(self.clock(), self.dirty_since) >= self.coalesce_ms:
+            return self.flush()
+        return False
+
+    def flush(self):
+        """Write now if dirty (e.g. before a reset)"""
+        if not self.dirty:
+            return False
+        body = json.dumps(self.data)
+        seq = self.seq + 1
+        try:
+            with open(self.tmp, "w") as f:
+                f.write("%s %d %d %08x\n" % (MAGIC, VERSION, seq, checksum(body.encode())))
+                f.write(body)
+            try:
+                os.rename(self.tmp, self.path)
+            except OSError:
+                # FAT cannot rename over an existing file
+                os.remove(self.path)
+                os.rename(self.tmp, self.path)
+        except Exception as e:
+            print("Config save error:", str(e))
+            return False
+        self.seq = seq
+        self.dirty = False
+        self.writes += 1
+        return True
@@ -0,0 +1,144 @@
+"""
+Count config flash writes per simulated day, legacy .txt files vs config_store
+- Replays eps32_pzem.py's LCD cycle: timer expiry saves the backlight state every cycle
+- Plus a settings change every few hours and a WiFi change once a day
+- Also checks legacy migration, torn-write recovery and skip-if-unchanged
+- Usage: python config_wear.py [--cycle 60] [--days 1]
+- Runs in a temporary directory; exits non-zero if a check fails
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+import config_store
+from config_store import ConfigStore
+
+DEFAULTS = {"devid": "e089", "mcid": "m-001", "interval": 60,
+            "ssid": "TP-Link_5B9A", "password": "97180937", "backlight": True}
+
+
+class Clock:
+    def __init__(self):
+        self.ms = 0
+
+    def __call__(self):
+        return self.ms
+
+
+def legacy_writes(events):
+    # Old code rewrote its whole file on every save, changed or not
+    return len(events)
+
+
+def simulate(cycle_s, days):
+    """Returns (events, store writes)"""
+    clock = Clock()
+    store = ConfigStore(DEFAULTS, clock=clock)
+    store.load()
+    events = []
+    poll_ms = 5000
+    end = days * 86400 * 1000
+    next_cycle = cycle_s * 1000
+    next_settings = 4 * 3600 * 1000
+    next_wifi = 86400 * 1000 - 1000
+    interval = 60
+    while clock.ms < end:
+        clock.ms += poll_ms
+        if clock.ms >= next_cycle:
+            # LCD timer expired: backlight off, state saved (always the same value)
+            events.append("backlight")
+            store.set("backlight", False)
+            next_cycle += cycle_s * 1000
+        if clock.ms >= next_settings:
+            # A settings form submit: three fields, one of them changed
+            interval = 120 if interval == 60 else 60
+            events.append("settings")
+            store.update({"devid": "e089", "mcid": "m-001", "interval": interval})
+            next_settings += 4 * 3600 * 1000
+        if clock.ms >= next_wifi:
+            events.append("wifi")
+            store.update({"ssid": "Site-AP", "password": "secret"})
+            store.flush()
+            next_wifi += 86400 * 1000
+        store.poll()
+    store.flush()
+    return events, store.writes
+
+
+def check(name, ok, failed):
+    print("  %-44s %s" % (name, "ok" if ok else "FAIL"))
+    if not ok:
+        failed.append(name)
+
+
+def checks():
+    failed = []
+
+    # Migration from the three legacy files
+    with open("device_config.txt", "w") as f:
+        f.write("dev-7\nmc-9\n300\n")
+    with open("wifi_config.txt", "w") as f:
+        f.write("Plant-WiFi\npw123\n")
+    with open("lcd_config.txt", "w") as f:
+        f.write("0\n")
+    store = ConfigStore(DEFAULTS)
+    source = store.load()
+    check("legacy files migrated", source == "legacy" and store.get("devid") == "dev-7"
+          and store.get("interval") == 300 and store.get("ssid") == "Plant-WiFi"
+          and store.get("backlight") is False, failed)
+    check("legacy files removed", not any(os.path.exists(p) for p, _ in config_store.LEGACY), failed)
+
+    store2 = ConfigStore(DEFAULTS)
+    check("record reloads with same values", store2.load() == "record" and store2.data == store.data, failed)
+
+    # Unchanged values never reach flash
+    writes = store2.writes
+    store2.set("devid", "dev-7")
+    store2.flush()
+    check("unchanged set skips the write", store2.writes == writes and not store2.dirty, failed)
+
+    # Corrupt record: falls back to a valid temp copy, else defaults
+    store2.set("mcid", "mc-10")
+    store2.flush()
+    with open(config_store.TMP, "w") as f:
+        with open(config_store.PATH) as src:
+            f.write(src.read())
+    with open(config_store.PATH, "r+") as f:
+        f.seek(40)
+        f.write("#")
+    store3 = ConfigStore(DEFAULTS)
+    check("corrupt record falls back to temp copy", store3.load() == "tmp" and store3.get("mcid") == "mc-10", failed)
+    os.remove(config_store.TMP)
+    store4 = ConfigStore(DEFAULTS)
+    check("corrupt record alone gives defaults", store4.load() == "defaults" and store4.get("mcid") == "m-001", failed)
+    os.remove(config_store.PATH)
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate config flash writes")
+    parser.add_argument('--cycle', type=int, default=60, help="LCD cycle in seconds")
+    parser.add_argument('--days', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        print("Checks:")
+        failed = checks()
+
+        events, writes = simulate(args.cycle, args.days)
+        old = legacy_writes(events)
+        print("\n%d day(s), LCD cycle %d s: %d config saves" % (args.days, args.cycle, len(events)))
+        print("  legacy .txt files: %6d flash writes (%d per day)" % (old, old // args.days))
+        print("  config_store:      %6d flash writes (%d per day)" % (writes, writes // args.days))
+        os.chdir("/")
+
+    if failed:
+        print("FAIL:", ", ".join(failed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
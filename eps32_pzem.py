@@ -4,6 +4,8 @@ ESP32 LCD Display + PZEM - Complete Final Version
 - LCD loop resumes automatically after 20 seconds
 - LCD loop active by default on boot
 - PZEM auto-restart on 3 consecutive failures
+- Scheduler-driven main loop, sleeps between tasks instead of spinning
+- LCD state kept in the cached config store, flash only written on change
 """
 
 import network
@@ -11,6 +13,9 @@ import time
 from machine import Pin, I2C, RTC, UART, WDT
 from micropython import const
 import gc
+from lcd_i2c import I2cLcd, I2C_FREQ
+from scheduler import Scheduler
+from config_store import ConfigStore
 
 print("\n" + "="*50)
 print("ESP32 PZEM Monitor - Final")
@@ -24,7 +29,7 @@ connections = set()
 tx_handle = None
 rx_handle = None
 i2c = None
-lcd_addr = None
+lcd = None
 rtc = None
 lcd_backlight = True
 lcd_timer_active = False
@@ -48,6 +53,10 @@ pzem_power_factor = None
 pzem_last_read = 0
 pzem_read_interval = 10000
 pzem_device_id = 0x01
+pzem_fail_count = 0
+max_pzem_failures = 3
+
+wdt = None
 
 # Default WiFi credentials
 DEFAULT_SSID = "TP-Link_5B9A"
@@ -56,24 +65,20 @@ DEFAULT_PASSWORD = "97180937"
 wifi_ssid = ""
 wifi_password = ""
 
+config = ConfigStore({"backlight": True})
+
 def save_lcd_backlight_state():
-    try:
-        with open('lcd_config.txt', 'w') as f:
-            f.write('1\n' if lcd_backlight else '0\n')
-        return True
-    except:
-        return False
+    # Cached; task_config only writes flash when the state actually changed
+    config.set("backlight", lcd_backlight)
+    return True
 
 def load_lcd_backlight_state():
     global lcd_backlight
-    try:
-        with open('lcd_config.txt', 'r') as f:
-            state = f.read().strip()
-            lcd_backlight = (state == '1')
-            return True
-    except:
-        lcd_backlight = True
-        return False
+    lcd_backlight = config.get("backlight")
+    return True
+
+def task_config():
+    config.poll()
 
 
 # PZEM Functions
@@ -213,41 +218,10 @@ def pzem_reset_energy():
         return False
 
 # LCD Functions
-def lcd_write(data):
-    if i2c and lcd_addr:
-        try:
-            if lcd_backlight:
-                data = data | 0x08
-            else:
-                data = data & 0xF7
-            i2c.writeto(lcd_addr, bytearray([data]))
-        except:
-            pass
-
-def lcd_pulse(data):
-    bl = 0x08 if lcd_backlight else 0x00
-    lcd_write(data | 0x04 | bl)
-    time.sleep_us(1)
-    lcd_write(data | bl)
-    time.sleep_us(50)
-
-def lcd_write_nibble(data):
-    bl = 0x08 if lcd_backlight else 0x00
-    lcd_write(data | bl)
-    lcd_pulse(data)
-
-def lcd_cmd(cmd):
-    lcd_write_nibble(cmd & 0xF0)
-    lcd_write_nibble((cmd << 4) & 0xF0)
-
-def lcd_char(data):
-    lcd_write_nibble(0x01 | (data & 0xF0))
-    lcd_write_nibble(0x01 | ((data << 4) & 0xF0))
-
 def lcd_init():
-    global i2c, lcd_addr
+    global i2c, lcd
     try:
-        i2c = I2C(0, scl=Pin(22), sda=Pin(21), freq=100000)
+        i2c = I2C(0, scl=Pin(22), sda=Pin(21), freq=I2C_FREQ)
         time.sleep_ms(50)
         devices = i2c.scan()
         if not devices:
@@ -255,59 +229,28 @@ def lcd_init():
             return False
         for addr in [0x27, 0x3F]:
             if addr in devices:
-                lcd_addr = addr
+                lcd = I2cLcd(i2c, addr, 20, 4)
                 break
-        if not lcd_addr:
+        if not lcd:
             i2c = None
             return False
-        time.sleep_ms(50)
-        lcd_write_nibble(0x30)
-        time.sleep_ms(5)
-        lcd_write_nibble(0x30)
-        time.sleep_ms(1)
-        lcd_write_nibble(0x30)
-        time.sleep_ms(1)
-        lcd_write_nibble(0x20)
-        lcd_cmd(0x28)
-        lcd_cmd(0x0C)
-        lcd_cmd(0x01)
-        time.sleep_ms(2)
-        lcd_cmd(0x06)
+        lcd.backlight = lcd_backlight
+        lcd.init()
         print("LCD initialized")
         return True
     except Exception as e:
         print("LCD init error:", str(e))
         i2c = None
-        lcd_addr = None
+        lcd = None
         return False
 
-def lcd_clear():
-    if i2c and lcd_addr:
-        lcd_cmd(0x01)
-        time.sleep_ms(2)
-
-def lcd_set_pos(row, col):
-    if i2c and lcd_addr:
-        offsets = [0x00, 0x40, 0x14, 0x54]
-        if row < 4 and col < 20:
-            lcd_cmd(0x80 | (offsets[row] + col))
-
-def lcd_text(text, row=0, col=0):
-    if i2c and lcd_addr:
-        lcd_set_pos(row, col)
-        for c in text[:20]:
-            lcd_char(ord(c))
-
 def lcd_set_backlight(state):
     global lcd_backlight
-    if not i2c or not lcd_addr:
+    if not lcd:
         return False
     lcd_backlight = state
     try:
-        if lcd_backlight:
-            lcd_write(0x08)
-        else:
-            lcd_write(0x00)
+        lcd.set_backlight(state)
         time.sleep_ms(10)
         return True
     except:
@@ -315,7 +258,7 @@ def lcd_set_backlight(state):
 
 def lcd_timer_on():
     global lcd_timer_active, lcd_timer_start
-    if not i2c or not lcd_addr:
+    if not lcd:
         return False
     if lcd_set_backlight(True):
         lcd_timer_active = True
@@ -356,18 +299,10 @@ def check_lcd_loop():
             lcd_loop_timer = now
 
 def lcd_display(line1="", line2="", line3="", line4=""):
-    if not i2c or not lcd_addr:
+    if not lcd:
         return
     try:
-        lcd_clear()
-        if line1:
-            lcd_text(line1, 0, 0)
-        if line2:
-            lcd_text(line2, 1, 0)
-        if line3:
-            lcd_text(line3, 2, 0)
-        if line4:
-            lcd_text(line4, 3, 0)
+        lcd.show(line1, line2, line3, line4)
     except:
         pass
 
@@ -381,7 +316,7 @@ def get_signal_quality(rssi):
 def update_lcd_status():
     global pzem_last_webhook, pzem_webhook_interval
     
-    if not i2c or not lcd_addr:
+    if not lcd:
         return
     try:
         now = time.ticks_ms()
@@ -404,9 +339,47 @@ def update_lcd_status():
         print("LCD update error:", str(e))
 
 
+# Tasks
+def task_feed_wdt():
+    if wdt:
+        wdt.feed()
+
+def task_lcd_timers():
+    check_lcd_timer()
+    check_lcd_loop()
+
+def task_read_pzem():
+    global pzem_enabled, pzem_fail_count
+    if not pzem_enabled:
+        return
+    print("time to read pzem..")
+    if pzem_read_all():
+        pzem_fail_count = 0
+    else:
+        pzem_fail_count += 1
+        print("PZEM read failed ({}/{})".format(pzem_fail_count, max_pzem_failures))
+        
+        if pzem_fail_count >= max_pzem_failures:
+            print("PZEM restart triggered!")
+            print("Reinitializing PZEM...")
+            pzem_enabled = False
+            time.sleep_ms(500)
+            if pzem_init():
+                print("PZEM reinitialized successfully")
+                pzem_fail_count = 0
+            else:
+                print("PZEM reinit failed, will retry later")
+    
+    update_lcd_status()
+
+def task_gc():
+    gc.collect()
+
+
 def main():
     global lcd_loop_active, lcd_loop_state, lcd_loop_timer
     global pzem_enabled, uart_pzem, lcd_timer_active, lcd_timer_start
+    global wdt
     
     print("\n" + "="*50)
     print("Starting System...")
@@ -414,6 +387,7 @@ def main():
     
     gc.collect()
     print("Initial memory:", gc.mem_free())
+    print("Config:", config.load())
     
     # Initialize Watchdog Timer
     print("\nInitializing Watchdog (30s)...")
@@ -479,66 +453,22 @@ def main():
     print("Free memory:", gc.mem_free())
     print("="*50 + "\n")
     
-    counter = 0
-    last_update = 0
-    last_lcd = 0
-    last_gc = 0
-    last_pzem_read = 0
-    pzem_fail_count = 0
-    max_pzem_failures = 3
-    
-    # Initialize webhook timer
-    pzem_last_webhook = time.ticks_ms()
+    sched = Scheduler()
+    sched.every(5000, task_feed_wdt, "wdt")
+    sched.every(1000, task_lcd_timers, "lcd_timer")
+    sched.every(pzem_read_interval, task_read_pzem, "pzem")
+    sched.every(60000, task_gc, "gc", 60000)
+    sched.every(5000, task_config, "config", 5000)
+    if lcd_ok:
+        sched.every(5000, update_lcd_status, "lcd", 5000)
     
     try:
-        while True:
-            # Feed watchdog
-            if wdt:
-                wdt.feed()
-            
-            now = time.ticks_ms()
-            
-            check_lcd_timer()
-            check_lcd_loop()
-                      
-            # PZEM reading every 10 seconds
-            if pzem_enabled and time.ticks_diff(now, last_pzem_read) >= pzem_read_interval:
-                print("time to read pzem..")
-                read_success = pzem_read_all()
-                last_pzem_read = now
-                
-                if read_success:
-                    pzem_fail_count = 0
-                else:
-                    pzem_fail_count += 1
-                    print("PZEM read failed ({}/{})".format(pzem_fail_count, max_pzem_failures))
-                    
-                    if pzem_fail_count >= max_pzem_failures:
-                        print("PZEM restart triggered!")
-                        print("Reinitializing PZEM...")
-                        pzem_enabled = False
-                        time.sleep_ms(500)
-                        if pzem_init():
-                            print("PZEM reinitialized successfully")
-                            pzem_fail_count = 0
-                        else:
-                            print("PZEM reinit failed, will retry later")
-                
-                if lcd_ok:
-                    update_lcd_status()
-                       
-            # GC every 60s
-            if time.ticks_diff(now, last_gc) > 60000:
-                gc.collect()
-                last_gc = now
-                    
-            # LCD update every 5s
-            if lcd_ok and time.ticks_diff(now, last_lcd) > 5000:
-                update_lcd_status()
-                last_lcd = now
+        sched.run()
     
     except KeyboardInterrupt:
         print("\nStopping...")
+        config.flush()
+        sched.report()
         if lcd_ok:
             lcd_display("Stopped", "Goodbye!", "", "")
 
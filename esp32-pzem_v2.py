@@ -6,6 +6,8 @@ Simple PZEM readout displayed on I2C LCD
 from machine import Pin, I2C, UART
 import time
 import gc
+from lcd_i2c import I2cLcd, I2C_FREQ
+from scheduler import Scheduler
 
 print("\n" + "="*40)
 print("ESP32 PZEM -> LCD 16x2")
@@ -16,7 +18,7 @@ gc.collect()
 
 # Global variables
 i2c = None
-lcd_addr = None
+lcd = None
 
 # PZEM variables
 uart_pzem = None
@@ -127,35 +129,10 @@ def pzem_read_all():
         return False
 
 # ============== LCD 16x2 Functions ==============
-def lcd_write(data):
-    if i2c and lcd_addr:
-        try:
-            i2c.writeto(lcd_addr, bytearray([data | 0x08]))  # Backlight ON
-        except:
-            pass
-
-def lcd_pulse(data):
-    lcd_write(data | 0x04)
-    time.sleep_us(1)
-    lcd_write(data)
-    time.sleep_us(50)
-
-def lcd_write_nibble(data):
-    lcd_write(data)
-    lcd_pulse(data)
-
-def lcd_cmd(cmd):
-    lcd_write_nibble(cmd & 0xF0)
-    lcd_write_nibble((cmd << 4) & 0xF0)
-
-def lcd_char(data):
-    lcd_write_nibble(0x01 | (data & 0xF0))
-    lcd_write_nibble(0x01 | ((data << 4) & 0xF0))
-
 def lcd_init():
-    global i2c, lcd_addr
+    global i2c, lcd
     try:
-        i2c = I2C(0, scl=Pin(22), sda=Pin(21), freq=100000)
+        i2c = I2C(0, scl=Pin(22), sda=Pin(21), freq=I2C_FREQ)
         time.sleep_ms(50)
         devices = i2c.scan()
         if not devices:
@@ -164,64 +141,31 @@ def lcd_init():
         
         for addr in [0x27, 0x3F]:
             if addr in devices:
-                lcd_addr = addr
+                lcd = I2cLcd(i2c, addr, 16, 2)
                 break
         
-        if not lcd_addr:
+        if not lcd:
             print("LCD: No compatible address")
             return False
         
-        time.sleep_ms(50)
-        lcd_write_nibble(0x30)
-        time.sleep_ms(5)
-        lcd_write_nibble(0x30)
-        time.sleep_ms(1)
-        lcd_write_nibble(0x30)
-        time.sleep_ms(1)
-        lcd_write_nibble(0x20)
-        lcd_cmd(0x28)  # 4-bit, 2-line
-        lcd_cmd(0x0C)  # Display ON, cursor OFF
-        lcd_cmd(0x01)  # Clear
-        time.sleep_ms(2)
-        lcd_cmd(0x06)  # Entry mode
-        print("LCD initialized at 0x{:02X}".format(lcd_addr))
+        lcd.init()
+        print("LCD initialized at 0x{:02X}".format(lcd.addr))
         return True
     except Exception as e:
         print("LCD init error:", str(e))
         return False
 
-def lcd_clear():
-    if i2c and lcd_addr:
-        lcd_cmd(0x01)
-        time.sleep_ms(2)
-
-def lcd_set_pos(row, col):
-    if i2c and lcd_addr:
-        offsets = [0x00, 0x40]  # 16x2 LCD
-        if row < 2 and col < 16:
-            lcd_cmd(0x80 | (offsets[row] + col))
-
-def lcd_text(text, row=0, col=0):
-    if i2c and lcd_addr:
-        lcd_set_pos(row, col)
-        for c in text[:16]:
-            lcd_char(ord(c))
-
 def lcd_display(line1="", line2=""):
-    if not i2c or not lcd_addr:
+    if not lcd:
         return
     try:
-        lcd_clear()
-        if line1:
-            lcd_text(line1, 0, 0)
-        if line2:
-            lcd_text(line2, 1, 0)
+        lcd.show(line1, line2)
     except:
         pass
 
 def update_lcd():
     """Update LCD with PZEM readings"""
-    if not i2c or not lcd_addr:
+    if not lcd:
         return
     
     # Line 1: Voltage and Current
@@ -238,6 +182,16 @@ def update_lcd():
     
     lcd_display(line1, line2)
 
+# ============== Tasks ==============
+def task_read_pzem():
+    if not pzem_enabled:
+        return
+    pzem_read_all()
+    update_lcd()
+
+def task_gc():
+    gc.collect()
+
 # ============== Main ==============
 def main():
     global pzem_enabled, uart_pzem
@@ -267,27 +221,12 @@ def main():
     print("Free mem:", gc.mem_free())
     print("="*40 + "\n")
     
-    last_read = 0
-    last_gc = 0
+    sched = Scheduler()
+    sched.every(pzem_read_interval, task_read_pzem, "pzem")
+    sched.every(60000, task_gc, "gc", 60000)
     
     try:
-        while True:
-            now = time.ticks_ms()
-            
-            # Read PZEM at interval
-            if pzem_enabled and time.ticks_diff(now, last_read) >= pzem_read_interval:
-                pzem_read_all()
-                last_read = now
-                
-                if lcd_ok:
-                    update_lcd()
-            
-            # GC every 60s
-            if time.ticks_diff(now, last_gc) > 60000:
-                gc.collect()
-                last_gc = now
-            
-            time.sleep_ms(100)
+        sched.run()
     
     except KeyboardInterrupt:
         print("\nStopped")
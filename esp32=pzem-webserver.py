@@ -8,8 +8,12 @@ ESP32 PZEM Monitor with WiFi Manager & Web Server
 from machine import Pin, I2C, UART
 import network
 import socket
+import select
 import time
 import gc
+from lcd_i2c import I2cLcd, I2C_FREQ
+from scheduler import Scheduler
+from config_store import ConfigStore
 
 print("\n" + "="*40)
 print("ESP32 PZEM + WiFi + WebServer")
@@ -26,10 +30,11 @@ AP_PASSWORD = "12345678"
 
 # Global variables
 i2c = None
-lcd_addr = None
+lcd = None
 wlan = None
 ap = None
 server = None
+poller = None
 ip_address = "0.0.0.0"
 
 # PZEM variables
@@ -45,25 +50,16 @@ pzem_device_id = 0x01
 pzem_read_interval = 5000
 
 # ============== WiFi Manager ==============
+config = ConfigStore({"ssid": DEFAULT_SSID, "password": DEFAULT_PASSWORD})
+
 def save_wifi_config(ssid, password):
-    try:
-        with open('wifi_config.txt', 'w') as f:
-            f.write(ssid + '\n')
-            f.write(password + '\n')
-        return True
-    except:
-        return False
+    # Written straight away, a reset follows
+    config.update({"ssid": ssid, "password": password})
+    config.flush()
+    return not config.dirty
 
 def load_wifi_config():
-    try:
-        with open('wifi_config.txt', 'r') as f:
-            ssid = f.readline().strip()
-            password = f.readline().strip()
-            if ssid:
-                return ssid, password
-    except:
-        pass
-    return DEFAULT_SSID, DEFAULT_PASSWORD
+    return config.get("ssid"), config.get("password")
 
 def connect_wifi():
     global wlan, ip_address
@@ -227,13 +223,15 @@ def pzem_web_page():
     return html
 
 def start_web_server():
-    global server
+    global server, poller
     try:
         server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         server.bind(('0.0.0.0', 80))
         server.listen(5)
         server.setblocking(False)
+        poller = select.poll()
+        poller.register(server, select.POLLIN)
         print("Web server started on port 80")
         return True
     except Exception as e:
@@ -388,35 +386,10 @@ def pzem_read_all():
         return False
 
 # ============== LCD 16x2 Functions ==============
-def lcd_write(data):
-    if i2c and lcd_addr:
-        try:
-            i2c.writeto(lcd_addr, bytearray([data | 0x08]))
-        except:
-            pass
-
-def lcd_pulse(data):
-    lcd_write(data | 0x04)
-    time.sleep_us(1)
-    lcd_write(data)
-    time.sleep_us(50)
-
-def lcd_write_nibble(data):
-    lcd_write(data)
-    lcd_pulse(data)
-
-def lcd_cmd(cmd):
-    lcd_write_nibble(cmd & 0xF0)
-    lcd_write_nibble((cmd << 4) & 0xF0)
-
-def lcd_char(data):
-    lcd_write_nibble(0x01 | (data & 0xF0))
-    lcd_write_nibble(0x01 | ((data << 4) & 0xF0))
-
 def lcd_init():
-    global i2c, lcd_addr
+    global i2c, lcd
     try:
-        i2c = I2C(0, scl=Pin(22), sda=Pin(21), freq=100000)
+        i2c = I2C(0, scl=Pin(22), sda=Pin(21), freq=I2C_FREQ)
         time.sleep_ms(50)
         devices = i2c.scan()
         if not devices:
@@ -424,63 +397,30 @@ def lcd_init():
         
         for addr in [0x27, 0x3F]:
             if addr in devices:
-                lcd_addr = addr
+                lcd = I2cLcd(i2c, addr, 16, 2)
                 break
         
-        if not lcd_addr:
+        if not lcd:
             return False
         
-        time.sleep_ms(50)
-        lcd_write_nibble(0x30)
-        time.sleep_ms(5)
-        lcd_write_nibble(0x30)
-        time.sleep_ms(1)
-        lcd_write_nibble(0x30)
-        time.sleep_ms(1)
-        lcd_write_nibble(0x20)
-        lcd_cmd(0x28)
-        lcd_cmd(0x0C)
-        lcd_cmd(0x01)
-        time.sleep_ms(2)
-        lcd_cmd(0x06)
+        lcd.init()
         print("LCD initialized")
         return True
     except Exception as e:
         print("LCD error:", str(e))
         return False
 
-def lcd_clear():
-    if i2c and lcd_addr:
-        lcd_cmd(0x01)
-        time.sleep_ms(2)
-
-def lcd_set_pos(row, col):
-    if i2c and lcd_addr:
-        offsets = [0x00, 0x40]
-        if row < 2 and col < 16:
-            lcd_cmd(0x80 | (offsets[row] + col))
-
-def lcd_text(text, row=0, col=0):
-    if i2c and lcd_addr:
-        lcd_set_pos(row, col)
-        for c in text[:16]:
-            lcd_char(ord(c))
-
 def lcd_display(line1="", line2=""):
-    if not i2c or not lcd_addr:
+    if not lcd:
         return
     try:
-        lcd_clear()
-        if line1:
-            lcd_text(line1, 0, 0)
-        if line2:
-            lcd_text(line2, 1, 0)
+        lcd.show(line1, line2)
     except:
         pass
 
 def update_lcd():
     """Update LCD: Line1=IP, Line2=Amp & Volt"""
-    if not i2c or not lcd_addr:
+    if not lcd:
         return
     
     # Line 1: IP Address
@@ -494,12 +434,38 @@ def update_lcd():
     
     lcd_display(line1, line2)
 
+# ============== Tasks ==============
+def task_read_pzem():
+    if not pzem_enabled:
+        return
+    if pzem_read_all():
+        print("V:{:.1f} A:{:.2f} W:{:.1f} PF:{:.2f}".format(
+            pzem_voltage, pzem_current, pzem_power, pzem_power_factor))
+    update_lcd()
+
+def task_gc():
+    gc.collect()
+
+def wait_for_client(ms):
+    """Scheduler idle hook: sleep until the next task is due or a web client connects.
+    Returns the ms spent waiting, so serving the client is not counted as idle."""
+    if not poller:
+        time.sleep_ms(ms)
+        return ms
+    start = time.ticks_ms()
+    for _ in poller.ipoll(ms):
+        waited = time.ticks_diff(time.ticks_ms(), start)
+        handle_web_client()
+        return waited
+    return None
+
 # ============== Main ==============
 def main():
     global ip_address
     
     print("\nStarting System...")
     gc.collect()
+    print("Config:", config.load())
     
     # Initialize LCD
     lcd_ok = lcd_init()
@@ -541,32 +507,12 @@ def main():
     if lcd_ok:
         update_lcd()
     
-    last_read = 0
-    last_gc = 0
+    sched = Scheduler(wait=wait_for_client)
+    sched.every(pzem_read_interval, task_read_pzem, "pzem")
+    sched.every(60000, task_gc, "gc", 60000)
     
     try:
-        while True:
-            now = time.ticks_ms()
-            
-            # Handle web clients
-            handle_web_client()
-            
-            # Read PZEM every 5 seconds
-            if pzem_enabled and time.ticks_diff(now, last_read) >= pzem_read_interval:
-                if pzem_read_all():
-                    print("V:{:.1f} A:{:.2f} W:{:.1f} PF:{:.2f}".format(
-                        pzem_voltage, pzem_current, pzem_power, pzem_power_factor))
-                last_read = now
-                
-                if lcd_ok:
-                    update_lcd()
-            
-            # GC every 60s
-            if time.ticks_diff(now, last_gc) > 60000:
-                gc.collect()
-                last_gc = now
-            
-            time.sleep_ms(50)
+        sched.run()
     
     except KeyboardInterrupt:
         print("\nStopped")
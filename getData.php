@@ -1,6 +1,8 @@
 <?php
 header('Content-Type: application/json');
 header('Access-Control-Allow-Origin: *');
+header('Access-Control-Expose-Headers: ETag');
+header('Cache-Control: no-cache');
 
 $conn = new mysqli("localhost", "root3", "pS@0922648640Sp", "iot_db");
 
@@ -10,15 +12,60 @@ if ($conn->connect_error) {
 
 $hours = isset($_GET['hours']) ? intval($_GET['hours']) : 24;
 $devid = isset($_GET['devid']) ? $_GET['devid'] : '';
+// Cursor from the previous reply: the newest row id it saw. Ids only grow, also for
+// backlog uploads whose timestamps are hours old, so those are not skipped.
+$since = isset($_GET['since']) ? $_GET['since'] : '';
+if ($since !== '' && !ctype_digit($since)) {
+    http_response_code(400);
+    die(json_encode(["error" => "bad since"]));
+}
 
-// Build query
-if ($devid) {
-    $sql = "SELECT * FROM electric WHERE devid = '$devid' AND timestamp >= DATE_SUB(NOW(), INTERVAL $hours HOUR) ORDER BY timestamp ASC LIMIT 500";
-} else {
-    $sql = "SELECT * FROM electric WHERE timestamp >= DATE_SUB(NOW(), INTERVAL $hours HOUR) ORDER BY timestamp ASC LIMIT 500";
+// ETag: newest row id plus the minute the window starts in (MAX(id) reads one end of the
+// primary key). Same tag as the client's -> nothing new, answer 304 before the range query.
+// Read before the rows, so anything committed meanwhile is past the cursor and comes again.
+$stmt = $conn->prepare("SELECT MAX(id) AS id, DATE_FORMAT(DATE_SUB(NOW(), INTERVAL ? HOUR), '%Y-%m-%d %H:%i') AS start FROM electric");
+$stmt->bind_param("i", $hours);
+$stmt->execute();
+$mark = $stmt->get_result()->fetch_assoc();
+$stmt->close();
+$cursor = intval($mark['id']);
+$etag = 'W/"' . substr(sha1("$hours|$devid|$cursor|{$mark['start']}"), 0, 16) . '"';
+header('ETag: ' . $etag);
+if (isset($_SERVER['HTTP_IF_NONE_MATCH']) && $_SERVER['HTTP_IF_NONE_MATCH'] === $etag) {
+    http_response_code(304);
+    $conn->close();
+    exit;
+}
+
+// Without a cursor the whole window; with one, the window from the oldest row added
+// after it (walks the primary key over the new ids only), which the client replaces
+$from = '1970-01-01 00:00:00';
+if ($since !== '') {
+    $since = intval($since);
+    if ($devid) {
+        $stmt = $conn->prepare("SELECT MIN(timestamp) AS first FROM electric WHERE id > ? AND id <= ? AND timestamp >= DATE_SUB(NOW(), INTERVAL ? HOUR) AND devid = ?");
+        $stmt->bind_param("iiis", $since, $cursor, $hours, $devid);
+    } else {
+        $stmt = $conn->prepare("SELECT MIN(timestamp) AS first FROM electric WHERE id > ? AND id <= ? AND timestamp >= DATE_SUB(NOW(), INTERVAL ? HOUR)");
+        $stmt->bind_param("iii", $since, $cursor, $hours);
+    }
+    $stmt->execute();
+    $from = $stmt->get_result()->fetch_assoc()['first'];
+    $stmt->close();
 }
 
-$result = $conn->query($sql);
+// Build query (prepared: devid comes straight from the URL)
+// Range scans use idx_electric_devid_ts / idx_electric_ts (python electric_db.py migrate)
+// Nothing new after the cursor: no range query at all
+if ($from === null) {
+    $stmt = null;
+} elseif ($devid) {
+    $stmt = $conn->prepare("SELECT * FROM electric WHERE devid = ? AND timestamp >= DATE_SUB(NOW(), INTERVAL ? HOUR) AND timestamp >= ? ORDER BY timestamp ASC LIMIT 500");
+    $stmt->bind_param("sis", $devid, $hours, $from);
+} else {
+    $stmt = $conn->prepare("SELECT * FROM electric WHERE timestamp >= DATE_SUB(NOW(), INTERVAL ? HOUR) AND timestamp >= ? ORDER BY timestamp ASC LIMIT 500");
+    $stmt->bind_param("is", $hours, $from);
+}
 
 $labels = [];
 $voltage = [];
@@ -27,18 +74,30 @@ $pf = [];
 $energy = [];
 $power = [];
 
-while ($row = $result->fetch_assoc()) {
-    $labels[] = $row['timestamp'];
-    $voltage[] = floatval($row['volt']);
-    $current[] = floatval($row['amp']);
-    $pf[] = floatval($row['pf']);
-    $energy[] = floatval($row['energy']);
-    $power[] = floatval($row['volt']) * floatval($row['amp']);
+if ($stmt) {
+    $stmt->execute();
+    $result = $stmt->get_result();
+    while ($row = $result->fetch_assoc()) {
+        $labels[] = $row['timestamp'];
+        $voltage[] = floatval($row['volt']);
+        $current[] = floatval($row['amp']);
+        $pf[] = floatval($row['pf']);
+        $energy[] = floatval($row['energy']);
+        $power[] = floatval($row['volt']) * floatval($row['amp']);
+    }
+    $stmt->close();
 }
 
-// Get latest
-$sql2 = "SELECT * FROM electric ORDER BY id DESC LIMIT 1";
-$latest = $conn->query($sql2)->fetch_assoc();
+// Get latest of the selected device (any device only when none is selected)
+if ($devid) {
+    $stmt = $conn->prepare("SELECT * FROM electric WHERE devid = ? ORDER BY timestamp DESC, id DESC LIMIT 1");
+    $stmt->bind_param("s", $devid);
+} else {
+    $stmt = $conn->prepare("SELECT * FROM electric ORDER BY id DESC LIMIT 1");
+}
+$stmt->execute();
+$latest = $stmt->get_result()->fetch_assoc();
+$stmt->close();
 
 $data = [
     'labels' => $labels,
@@ -48,7 +107,11 @@ $data = [
     'energy' => $energy,
     'power' => $power,
     'latest' => $latest,
-    'count' => count($labels)
+    'count' => count($labels),
+    'start' => $mark['start'] . ':00',
+    'since' => $since,
+    // Cut off by LIMIT 500: rows past it have no id cursor, so the client reloads in full
+    'cursor' => count($labels) < 500 ? $cursor : ''
 ];
 
 $conn->close();
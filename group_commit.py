@@ -0,0 +1,173 @@
+"""
+Group commit for the electric table
+- Rows from every connection share one buffer, flushed as multi-row INSERTs in
+  one transaction when max_rows are waiting or the oldest row has waited
+  max_delay_ms, whichever comes first
+- One flush at a time, so database round trips follow the clock, not the number
+  of devices
+- Backpressure: at most max_pending rows may be buffered or in flight; submit()
+  waits for room, which stalls that client, and raises Overloaded after wait_ms
+  (the server answers 503 and the device keeps the reading in its backlog)
+- Per-flush size/latency stats and why each flush happened
+- Usage: gc = GroupCommitter(db.insert_many); task = create_task(gc.run());
+         await gc.submit(row); ...; await gc.drain()
+"""
+
+import asyncio
+import time
+from collections import deque
+
+
+class Overloaded(Exception):
+    pass
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(len(s) * p / 100))]
+
+
+class GroupCommitter:
+    def __init__(self, flush, max_rows=500, max_delay_ms=200, max_pending=20000, wait_ms=2000, window=1024):
+        """flush: async callable taking a list of rows, committing them in one transaction"""
+        self.flush_rows = flush
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000
+        self.max_pending = max_pending
+        self.wait = wait_ms / 1000
+        self.room = asyncio.Semaphore(max_pending)
+        self.kick = asyncio.Event()
+        self.buf = []
+        self.waiters = []
+        self.oldest = 0.0
+        self.flushing = 0
+
+        self.rows = 0
+        self.flushes = 0
+        self.by_size = 0
+        self.by_time = 0
+        self.failed = 0
+        self.stalled = 0
+        self.overloaded = 0
+        self.size_max = 0
+        self.latency_max = 0.0
+        self.age_max = 0.0
+        # Recent flushes only, for percentiles
+        self.sizes = deque(maxlen=window)
+        self.latencies = deque(maxlen=window)
+
+    @property
+    def pending(self):
+        return len(self.buf) + self.flushing
+
+    # ============== Producers ==============
+    async def submit(self, row):
+        """Buffer a row and wait until its transaction committed (re-raises its error)"""
+        if self.room.locked():
+            # Database is behind: hold this client until a flush frees room
+            self.stalled += 1
+            try:
+                await asyncio.wait_for(self.room.acquire(), self.wait)
+            except asyncio.TimeoutError:
+                self.overloaded += 1
+                raise Overloaded("{} rows pending".format(self.pending))
+        else:
+            await self.room.acquire()
+        done = asyncio.get_running_loop().create_future()
+        if not self.buf:
+            self.oldest = time.monotonic()
+            self.kick.set()
+        self.buf.append(row)
+        self.waiters.append(done)
+        if len(self.buf) >= self.max_rows:
+            self.kick.set()
+        await done
+
+    # ============== Writer ==============
+    async def run(self):
+        while True:
+            if not self.buf:
+                self.kick.clear()
+                await self.kick.wait()
+                continue
+            if len(self.buf) < self.max_rows:
+                delay = self.oldest + self.max_delay - time.monotonic()
+                if delay > 0:
+                    self.kick.clear()
+                    try:
+                        await asyncio.wait_for(self.kick.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+            await self._flush()
+
+    async def _flush(self):
+        n = min(len(self.buf), self.max_rows)
+        rows = self.buf[:n]
+        waiters = self.waiters[:n]
+        del self.buf[:n]
+        del self.waiters[:n]
+        if n == self.max_rows:
+            self.by_size += 1
+        else:
+            self.by_time += 1
+        # Rows left behind keep the old start time, so they never wait longer than max_delay
+        start = time.monotonic()
+        age = start - self.oldest
+        self.flushing = n
+        try:
+            await self.flush_rows(rows)
+        except Exception as e:
+            self.failed += n
+            print("Group commit of {} rows failed: {}".format(n, e))
+            for done in waiters:
+                if not done.done():
+                    done.set_exception(e)
+        else:
+            self.rows += n
+            for done in waiters:
+                if not done.done():
+                    done.set_result(None)
+        finally:
+            self.flushing = 0
+            for _ in range(n):
+                self.room.release()
+
+        latency = time.monotonic() - start
+        self.flushes += 1
+        self.sizes.append(n)
+        self.latencies.append(latency)
+        if n > self.size_max:
+            self.size_max = n
+        if latency > self.latency_max:
+            self.latency_max = latency
+        if age > self.age_max:
+            self.age_max = age
+
+    async def drain(self):
+        """Flush everything still buffered (shutdown)"""
+        while self.buf:
+            await self._flush()
+
+    # ============== Stats ==============
+    def stats(self):
+        lat = [t * 1000 for t in self.latencies]
+        return {
+            "rows": self.rows,
+            "flushes": self.flushes,
+            "flush_by_size": self.by_size,
+            "flush_by_time": self.by_time,
+            "rows_per_flush": round(self.rows / self.flushes, 1) if self.flushes else 0,
+            "flush_rows_p50": percentile(self.sizes, 50),
+            "flush_rows_max": self.size_max,
+            "flush_ms_p50": round(percentile(lat, 50), 2),
+            "flush_ms_p99": round(percentile(lat, 99), 2),
+            "flush_ms_max": round(self.latency_max * 1000, 2),
+            "oldest_wait_ms_max": round(self.age_max * 1000, 2),
+            "pending": self.pending,
+            "failed": self.failed,
+            "stalled": self.stalled,
+            "overloaded": self.overloaded,
+        }
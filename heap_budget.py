@@ -0,0 +1,422 @@
+"""
+Heap allocation budget harness for webhook-iot.py
+- Runs the firmware with host_stubs' machine / micropython and fake network / urequests
+- Drives the real scheduler on a virtual clock for thousands of loop iterations, with
+  sampling started by sample_timer_start(): the fake Timer fires on the virtual clock,
+  its callback goes through micropython.schedule, the loop waits in wait_for_client
+- The PZEM reply changes every read, so each sample also redraws the LCD (writes counted)
+- Records bytes allocated per loop iteration, per task and per HTTP route
+- Fails (exit 1) when any maximum exceeds its budget, the heap grows over the run,
+  or the timer / LCD paths did not run
+- On the MicroPython unix port the numbers are bytes allocated; on CPython (tracemalloc)
+  they are bytes still held, which still catches leaks and retained buffers
+- Usage: micropython heap_budget.py [iterations] [name=bytes ...] [-v]
+-        python heap_budget.py 5000 sample=1536 index=12000
+"""
+
+import sys
+import gc
+import time
+
+import host_stubs
+host_stubs.install()
+from host_stubs import I2C, UART, Timer, Machine
+
+FIRMWARE = "webhook-iot.py"
+ITERATIONS = 3000
+WARMUP = 50
+HTTP_EVERY = 7      # one web request every N loop iterations
+
+# Max bytes allocated by one run of each item. Starting values: run with a
+# larger budget to see the measured maximum, then tighten to just above it.
+BUDGETS = {
+    "loop": 4096,
+    "sample": 2048,
+    "send": 4096,
+    "gc": 64,
+    "api": 3072,
+    "metrics": 8192,
+    "export": 4096,
+    "settings": 12288,
+    "setup": 8192,
+    "send_route": 6144,
+    "profile": 4096,
+    "index": 16384,
+    "leak": 1024,   # heap in use after the run minus after warm-up
+}
+
+ROUTES = (
+    ("api", b"GET /api HTTP/1.1\r\n\r\n"),
+    ("metrics", b"GET /metrics HTTP/1.1\r\n\r\n"),
+    ("export", b"GET /export?fmt=csv&from=&to= HTTP/1.1\r\n\r\n"),
+    ("settings", b"GET /settings HTTP/1.1\r\n\r\n"),
+    ("setup", b"GET /setup HTTP/1.1\r\n\r\n"),
+    ("send_route", b"GET /send HTTP/1.1\r\n\r\n"),
+    ("profile", b"GET /api/profile HTTP/1.1\r\n\r\n"),
+    ("index", b"GET / HTTP/1.1\r\n\r\n"),
+)
+
+verbose = False
+
+# ============== Virtual Clock ==============
+_now = 0
+
+class FakeTime:
+    """Stands in for the firmware's time module so sleeps cost no wall time"""
+    @staticmethod
+    def ticks_ms():
+        return _now
+
+    @staticmethod
+    def ticks_us():
+        return _now * 1000
+
+    @staticmethod
+    def ticks_add(t, delta):
+        return time.ticks_add(t, delta)
+
+    @staticmethod
+    def ticks_diff(a, b):
+        return time.ticks_diff(a, b)
+
+    @staticmethod
+    def sleep_ms(ms):
+        """Advance the clock, firing timers at their ticks on the way; callbacks they
+        schedule run right after, as they would between bytecodes of the sleep"""
+        global _now
+        end = time.ticks_add(_now, max(0, ms))
+        while True:
+            due = host_stubs.next_timer()
+            if due is None or time.ticks_diff(due, end) > 0:
+                break
+            if time.ticks_diff(due, _now) > 0:
+                _now = due
+            host_stubs.fire_timers(_now)
+            host_stubs.run_scheduled()
+        _now = end
+
+    @staticmethod
+    def sleep_us(us):
+        FakeTime.sleep_ms(us // 1000)
+
+    @staticmethod
+    def sleep(s):
+        FakeTime.sleep_ms(int(s * 1000))
+
+    @staticmethod
+    def time():
+        return 800000000 + _now // 1000
+
+    @staticmethod
+    def gmtime(t=None):
+        return time.gmtime(FakeTime.time() if t is None else t)
+
+    @staticmethod
+    def localtime(t=None):
+        return FakeTime.gmtime(t)
+
+# ============== Fake Hardware ==============
+# Pin, I2C, UART, Timer and RTC come from host_stubs; the network side is faked here
+
+class FakeWLAN:
+    def __init__(self, iface=0):
+        self.iface = iface
+
+    def active(self, state=None):
+        return True
+
+    def connect(self, ssid=None, password=None, bssid=None):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def isconnected(self):
+        return True
+
+    def scan(self):
+        return [(b"TP-Link_5B9A", b"\x10\x20\x30\x40\x50\x60", 6, -55, 3, False)]
+
+    def ifconfig(self, *args):
+        return ("192.168.1.50", "255.255.255.0", "192.168.1.1", "8.8.8.8")
+
+    def config(self, *args, **kwargs):
+        return 6
+
+class FakePoller:
+    """No client ever connects while the loop waits; the harness sends requests itself"""
+    def ipoll(self, ms):
+        FakeTime.sleep_ms(ms)
+        return ()
+
+class FakeNetwork:
+    STA_IF = 0
+    AP_IF = 1
+    WLAN = FakeWLAN
+
+class FakeResponse:
+    status_code = 200
+
+    def close(self):
+        pass
+
+class FakeRequests:
+    posts = 0
+    response = FakeResponse()
+
+    @staticmethod
+    def post(url, data=None, headers=None, timeout=None):
+        FakeRequests.posts += 1
+        return FakeRequests.response
+
+# ============== Fake Web Client ==============
+class FakeClient:
+    def __init__(self):
+        self.request = b""
+        self.sent = 0
+
+    def settimeout(self, t):
+        pass
+
+    def recv(self, n):
+        return self.request
+
+    def send(self, data):
+        self.sent += len(data)
+        return len(data)
+
+    def sendall(self, data):
+        self.sent += len(data)
+
+    def close(self):
+        pass
+
+class FakeServer:
+    addr = ("192.168.1.2", 50000)
+
+    def __init__(self):
+        self.client = FakeClient()
+
+    def accept(self):
+        return self.client, FakeServer.addr
+
+class FakeGc:
+    """The firmware's gc.collect() calls are counted but left to the harness,
+    so a collection never hides the allocations of the task that ran it"""
+    collects = 0
+
+    @staticmethod
+    def collect():
+        FakeGc.collects += 1
+
+    @staticmethod
+    def enable():
+        pass
+
+    @staticmethod
+    def disable():
+        pass
+
+    @staticmethod
+    def mem_free():
+        return gc.mem_free()
+
+    @staticmethod
+    def mem_alloc():
+        return gc.mem_alloc()
+
+# ============== Measurement ==============
+class Stat:
+    def __init__(self, name):
+        self.name = name
+        self.n = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, used):
+        self.n += 1
+        self.total += used
+        if used > self.max:
+            self.max = used
+
+stats = {}
+
+def stat(name):
+    if name not in stats:
+        stats[name] = Stat(name)
+    return stats[name]
+
+def measured(st, fn):
+    def run():
+        a0 = gc.mem_alloc()
+        fn()
+        st.add(gc.mem_alloc() - a0)
+    return run
+
+def quiet(*args, **kwargs):
+    pass
+
+# ============== Firmware Setup ==============
+def load_firmware():
+    sys.modules["network"] = FakeNetwork
+    sys.modules["urequests"] = FakeRequests
+    fw = {"__name__": "firmware"}
+    with open(FIRMWARE) as f:
+        src = f.read()
+    exec(src, fw)
+    del src
+    fw["time"] = FakeTime
+    fw["gc"] = FakeGc
+    if not verbose:
+        fw["print"] = quiet
+    return fw
+
+def pzem_replies(fw):
+    """UART reply source: 230.1 V, 283.9 W, 50.0 Hz, PF 0.98, current and energy
+    stepping on every read so the LCD line changes"""
+    n = [0]
+    def reply():
+        n[0] += 1
+        return pzem_reply(fw, 1000 + n[0] % 100 * 10, 1234 + n[0] // 60)
+    return reply
+
+def pzem_reply(fw, amp_ma, wh):
+    regs = (2301, amp_ma, 0, 2839, 0, wh, 0, 500, 98, 0)
+    data = bytearray([0x01, 0x04, 20])
+    for r in regs:
+        data.append(r >> 8)
+        data.append(r & 0xFF)
+    crc = fw["pzem_calculate_crc"](data)
+    data.append(crc & 0xFF)
+    data.append(crc >> 8)
+    return bytes(data)
+
+def setup(fw):
+    from scheduler import Scheduler
+
+    fw["load_device_config"]()
+    Timer.clock = FakeTime.ticks_ms
+    Machine.sleep = FakeTime.sleep_ms
+    fw["lcd_init"]()
+    UART.reply = pzem_replies(fw)
+    fw["pzem_init"]()
+    # Bring the link up without the boot-time side effects (NTP, real web server, tasks)
+    fw["wifi_up"] = quiet
+    fw["wifi_down"] = quiet
+    fw["connect_wifi"]()
+    fw["link"].step()
+    fw["ip_address"] = fw["wlan"].ifconfig()[0]
+    fw["server"] = FakeServer()
+    fw["poller"] = FakePoller()
+
+    sched = Scheduler(clock=FakeTime.ticks_ms, wait=fw["wait_for_client"])
+    fw["sched"] = sched
+    send_ms = fw["send_interval"] * 1000
+    # Sampling starts the way main() starts it: timer, on-demand task, first trigger
+    fw["task_sample"] = measured(stat("sample"), fw["task_sample"])
+    if not fw["sample_timer_start"]():
+        raise SystemExit("sample_timer_start() fell back to the scheduler")
+    fw["send_task"] = sched.every(send_ms, measured(stat("send"), fw["task_send"]), "send", send_ms)
+    sched.every(60000, measured(stat("gc"), fw["task_gc"]), "gc", 60000)
+    return sched
+
+def request(fw, name, raw):
+    server = fw["server"]
+    server.client.request = raw
+    server.client.sent = 0
+    a0 = gc.mem_alloc()
+    fw["handle_web_client"]()
+    used = gc.mem_alloc() - a0
+    if not server.client.sent:
+        print("WARNING: route {} sent nothing".format(name))
+    return used
+
+def run(fw, sched, iterations, record):
+    loop = stat("loop")
+    r = 0
+    for i in range(iterations):
+        a0 = gc.mem_alloc()
+        ran = sched.run_once()
+        used = gc.mem_alloc() - a0
+        if record and ran >= 0:
+            loop.add(used)
+        if i % HTTP_EVERY == 0:
+            name, raw = ROUTES[r % len(ROUTES)]
+            r += 1
+            used = request(fw, name, raw)
+            if record:
+                stat(name).add(used)
+        gc.collect()
+
+# ============== Main ==============
+def main():
+    global verbose
+    iterations = ITERATIONS
+    for arg in sys.argv[1:]:
+        if arg == "-v":
+            verbose = True
+        elif "=" in arg:
+            k, v = arg.split("=", 1)
+            BUDGETS[k] = int(v)
+        else:
+            iterations = int(arg)
+
+    gc.collect()
+    fw = load_firmware()
+    sched = setup(fw)
+
+    # First runs fill caches and module-level state; only steady state counts
+    run(fw, sched, WARMUP + len(ROUTES) * HTTP_EVERY, False)
+    # Create every Stat now, so the harness' own bookkeeping does not count as a leak
+    for name in ("loop", "leak") + tuple(r[0] for r in ROUTES):
+        stat(name)
+    for s in stats.values():
+        s.n = s.total = s.max = 0
+    gc.collect()
+    base = gc.mem_alloc()
+    timer = fw["sample_timer"]
+    fired0 = timer.fired
+    writes0 = I2C.writes
+    bytes0 = I2C.bytes
+
+    start = time.ticks_ms()
+    run(fw, sched, iterations, True)
+    gc.collect()
+    leak = stat("leak")
+    leak.add(max(0, gc.mem_alloc() - base))
+
+    print("{} iterations, {} s simulated, {} ms real, {} webhook posts, {} firmware gc.collect()".format(
+        iterations, _now // 1000, time.ticks_diff(time.ticks_ms(), start), FakeRequests.posts, FakeGc.collects))
+    print("{:<12} {:>7} {:>9} {:>9} {:>9}".format("item", "runs", "avg B", "max B", "budget"))
+    failed = []
+    for name in sorted(stats):
+        s = stats[name]
+        budget = BUDGETS.get(name)
+        over = budget is not None and s.max > budget
+        if over:
+            failed.append(name)
+        print("{:<12} {:>7} {:>9} {:>9} {:>9}{}".format(
+            name, s.n, s.total // s.n if s.n else 0, s.max,
+            budget if budget is not None else "-", "  OVER" if over else ""))
+
+    samples = stats["sample"].n
+    fired = timer.fired - fired0
+    lcd_writes = I2C.writes - writes0
+    print("timer fired {}, samples {}, LCD {} writeto / {} bytes".format(
+        fired, samples, lcd_writes, I2C.bytes - bytes0))
+    paths = []
+    if not samples or samples < fired - 1:
+        paths.append("timer-driven sampling")
+    if lcd_writes < samples:
+        paths.append("LCD redraw per sample")
+
+    if failed:
+        print("FAIL: over budget:", ", ".join(failed))
+    if paths:
+        print("FAIL: path not exercised:", ", ".join(paths))
+    if failed or paths:
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Host stand-ins for the MicroPython modules the firmware imports, for checks on CPython
+- time: ticks_ms / ticks_us / ticks_add / ticks_diff / sleep_ms / sleep_us, only where missing
+- micropython: const, schedule() queued like the firmware's (8 slots, RuntimeError
+  when full) and run by run_scheduled(), native/viper as no-op decorators
+- gc.mem_alloc / mem_free from tracemalloc (CPython frees garbage at once, so this
+  is bytes still held, not bytes allocated as on MicroPython)
+- machine: Pin, I2C counting writeto, UART with a canned reply, Timer fired by
+  fire_timers() from a virtual clock, RTC memory, sleeps through a hook
+- On the MicroPython unix port the built-in modules are kept; only machine is faked
+- Usage: import host_stubs; host_stubs.install()   (before importing firmware modules)
+"""
+
+import gc
+import sys
+import time
+
+try:
+    import micropython
+except ImportError:
+    micropython = None
+
+# ============== micropython ==============
+SCHEDULE_DEPTH = 8
+scheduled = []
+
+
+class MicroPython:
+    @staticmethod
+    def const(x):
+        return x
+
+    @staticmethod
+    def schedule(fn, arg):
+        if len(scheduled) >= SCHEDULE_DEPTH:
+            raise RuntimeError("schedule queue full")
+        scheduled.append((fn, arg))
+
+    @staticmethod
+    def native(fn):
+        return fn
+
+    viper = native
+
+    @staticmethod
+    def alloc_emergency_exception_buf(size):
+        pass
+
+    @staticmethod
+    def mem_info(*args):
+        pass
+
+
+def run_scheduled():
+    """Run callbacks queued by micropython.schedule(), as the VM does between bytecodes;
+    returns how many ran"""
+    n = 0
+    while scheduled:
+        fn, arg = scheduled.pop(0)
+        fn(arg)
+        n += 1
+    return n
+
+
+# ============== machine ==============
+class Pin:
+    IN = 1
+    OUT = 3
+    PULL_UP = 2
+
+    def __init__(self, *args, **kwargs):
+        self.v = 0
+
+    def value(self, v=None):
+        if v is None:
+            return self.v
+        self.v = v
+
+
+class I2C:
+    """Every writeto is counted across instances: writes (transactions) and bytes"""
+    devices = [0x27]
+    writes = 0
+    bytes = 0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def scan(self):
+        return list(I2C.devices)
+
+    def writeto(self, addr, buf):
+        I2C.writes += 1
+        I2C.bytes += len(buf)
+        return len(buf)
+
+
+class UART:
+    """write() arms a reply: UART.reply as bytes, or a callable returning bytes"""
+    reply = b""
+
+    def __init__(self, *args, **kwargs):
+        self.pending = None
+
+    def write(self, buf):
+        self.pending = UART.reply() if callable(UART.reply) else UART.reply
+        return len(buf)
+
+    def flush(self):
+        pass
+
+    def any(self):
+        return len(self.pending or b"")
+
+    def read(self, n=-1):
+        data = self.pending
+        self.pending = None
+        return data
+
+
+class Timer:
+    """Periodic / one-shot timer; fire_timers(now) runs the callbacks that came due.
+    Timer.clock is the virtual clock init() measures the first period from."""
+    PERIODIC = 1
+    ONE_SHOT = 0
+    clock = None
+    live = []
+
+    def __init__(self, id=0, **kwargs):
+        self.id = id
+        self.callback = None
+        self.fired = 0
+
+    def init(self, period=1000, mode=PERIODIC, callback=None, **kwargs):
+        self.deinit()
+        self.period = period
+        self.mode = mode
+        self.callback = callback
+        self.due = time.ticks_add(Timer.clock(), period)
+        Timer.live.append(self)
+
+    def deinit(self):
+        if self in Timer.live:
+            Timer.live.remove(self)
+
+
+def next_timer():
+    """Tick of the earliest armed timer, or None"""
+    due = None
+    for t in Timer.live:
+        if due is None or time.ticks_diff(t.due, due) < 0:
+            due = t.due
+    return due
+
+
+def fire_timers(now):
+    """Call the callback of every timer due at or before `now`, once per period passed"""
+    n = 0
+    for t in list(Timer.live):
+        while t in Timer.live and time.ticks_diff(now, t.due) >= 0:
+            t.fired += 1
+            n += 1
+            if t.mode == Timer.PERIODIC:
+                t.due = time.ticks_add(t.due, t.period)
+            else:
+                t.deinit()
+            t.callback(t)
+    return n
+
+
+class RTC:
+    _mem = b""
+
+    def memory(self, data=None):
+        if data is None:
+            return RTC._mem
+        RTC._mem = bytes(data)
+
+
+class Machine:
+    Pin = Pin
+    I2C = I2C
+    UART = UART
+    Timer = Timer
+    RTC = RTC
+    DEEPSLEEP_RESET = 4
+    PWRON_RESET = 1
+    cause = PWRON_RESET
+    # lightsleep(ms) calls this, e.g. to advance a virtual clock
+    sleep = None
+
+    @staticmethod
+    def reset():
+        raise SystemExit("machine.reset()")
+
+    @staticmethod
+    def reset_cause():
+        return Machine.cause
+
+    @staticmethod
+    def lightsleep(ms=0):
+        if Machine.sleep:
+            Machine.sleep(ms)
+
+    @staticmethod
+    def deepsleep(ms=0):
+        raise SystemExit("machine.deepsleep(%d)" % ms)
+
+    @staticmethod
+    def freq(hz=None):
+        return 240000000
+
+
+# ============== Install ==============
+# Free heap reported on CPython: a typical ESP32 figure minus what was allocated since install()
+HEAP_FREE = 110000
+tracemalloc = None
+_base = 0
+
+
+def _mem_alloc():
+    return tracemalloc.get_traced_memory()[0]
+
+
+def _mem_free():
+    return max(0, HEAP_FREE - (_mem_alloc() - _base))
+
+
+def install():
+    """Fill in what CPython lacks and put the fake machine module in sys.modules"""
+    global tracemalloc, _base
+    if not hasattr(time, "ticks_ms"):
+        # Plain integers are enough for virtual clocks; nothing here runs long enough to wrap
+        time.ticks_ms = lambda: int(time.monotonic() * 1000)
+        time.ticks_us = lambda: int(time.monotonic() * 1000000)
+        time.ticks_add = lambda t, d: t + d
+        time.ticks_diff = lambda a, b: a - b
+        time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+        time.sleep_us = lambda us: time.sleep(us / 1000000)
+    if micropython is None:
+        sys.modules["micropython"] = MicroPython
+    if not hasattr(gc, "mem_alloc"):
+        import tracemalloc as tm
+        tracemalloc = tm
+        if not tm.is_tracing():
+            tm.start()
+        gc.mem_alloc = _mem_alloc
+        gc.mem_free = _mem_free
+        _base = _mem_alloc()
+    for name, real in (("ujson", "json"), ("ustruct", "struct"), ("ubinascii", "binascii")):
+        if name not in sys.modules:
+            try:
+                __import__(name)
+            except ImportError:
+                sys.modules[name] = __import__(real)
+    if Timer.clock is None:
+        Timer.clock = time.ticks_ms
+    sys.modules["machine"] = Machine
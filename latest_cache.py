@@ -0,0 +1,114 @@
+"""
+Latest reading per (devid, mcid), kept in memory and in the electric_latest table
+- ElectricDB extension: each committed batch updates one entry per device it touched;
+  an older backlog row never replaces a newer reading
+- electric_latest is upserted in the same transaction and loaded at startup (seeded
+  from electric once, through the (devid, timestamp) index)
+- get(devid) and fleet() are O(devices) dictionary reads; history is never touched
+- Served by ingest_server.py at /api/latest?devid=.. and /api/fleet, and used for
+  the "latest" field of /getData.php
+"""
+
+import time
+
+from electric_db import TIME_FORMAT
+
+FIELDS = ("devid", "mcid", "amp", "volt", "pf", "energy", "timestamp")
+# A device is offline after this long without a reading (5 send intervals at the default 60 s)
+STALE_S = 300
+
+
+def age_s(stamp, now):
+    return now - time.mktime(time.strptime(stamp, TIME_FORMAT))
+
+
+class LatestCache:
+    """db.extend("latest", LatestCache(db))"""
+    def __init__(self, db):
+        self.db = db
+        self.rows = {}
+        upd = "excluded.{0}".format if db.kind == "sqlite" else "VALUES({0})".format
+        if db.kind == "sqlite":
+            head = "ON CONFLICT(devid, mcid) DO UPDATE SET"
+        else:
+            head = "ON DUPLICATE KEY UPDATE"
+        # Only a newer reading wins; timestamp is assigned last (MySQL evaluates left to right)
+        sets = ", ".join("{0} = CASE WHEN {1} >= timestamp THEN {2} ELSE {0} END".format(
+            c, upd("timestamp"), upd(c)) for c in ("amp", "volt", "pf", "energy", "timestamp"))
+        self.upsert_sql = "INSERT INTO electric_latest ({}) VALUES ({}) {} {}".format(
+            ", ".join(FIELDS), ", ".join([db.mark] * len(FIELDS)), head, sets)
+
+    def schema(self, kind):
+        real = "REAL" if kind == "sqlite" else "DOUBLE"
+        return ["CREATE TABLE IF NOT EXISTS electric_latest (\n    devid VARCHAR(50) NOT NULL,\n"
+                "    mcid VARCHAR(50) NOT NULL,\n    amp {0},\n    volt {0},\n    pf {0},\n    energy {0},\n"
+                "    timestamp DATETIME,\n    PRIMARY KEY (devid, mcid)\n)".format(real)]
+
+    def on_open(self, conn):
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT " + ", ".join(FIELDS) + " FROM electric_latest")
+            rows = cur.fetchall()
+            if not rows:
+                # First start on an existing table: newest row per (devid, mcid)
+                cur.execute("SELECT e.devid, e.mcid, e.amp, e.volt, e.pf, e.energy, e.timestamp FROM electric e "
+                            "JOIN (SELECT devid, mcid, MAX(timestamp) AS ts FROM electric GROUP BY devid, mcid) m "
+                            "ON e.devid = m.devid AND e.mcid = m.mcid AND e.timestamp = m.ts")
+                rows = cur.fetchall()
+                if rows:
+                    cur.executemany(self.upsert_sql, rows)
+                    conn.commit()
+        finally:
+            cur.close()
+        for row in rows:
+            self._put(tuple(row[:6]) + (str(row[6]),))
+
+    def _put(self, row):
+        key = (row[0], row[1])
+        old = self.rows.get(key)
+        if old is None or row[6] >= old[6]:
+            self.rows[key] = row
+
+    def on_insert(self, cur, rows):
+        newest = {}
+        for row in rows:
+            key = (row[0], row[1])
+            old = newest.get(key)
+            if old is None or str(row[6]) >= str(old[6]):
+                newest[key] = row
+        cur.executemany(self.upsert_sql, list(newest.values()))
+
+        def done():
+            for row in newest.values():
+                self._put(tuple(row[:6]) + (str(row[6]),))
+        return done
+
+    # ============== Queries ==============
+    def get(self, devid="", mcid=""):
+        """Newest reading as a getData.php "latest" dict: of a device (any mcid unless given),
+        or of the whole fleet when devid is empty"""
+        best = None
+        # list() copies in one step, so a commit on a database thread cannot resize it under us
+        for key, row in list(self.rows.items()):
+            if devid and key[0] != devid or mcid and key[1] != mcid:
+                continue
+            if best is None or row[6] > best[6]:
+                best = row
+        return dict(zip(FIELDS, best)) if best else None
+
+    def fleet(self, stale_s=STALE_S):
+        """Current state of every (devid, mcid), plus online count and total power"""
+        now = time.time()
+        devices = []
+        online = 0
+        power = 0.0
+        for _, row in sorted(list(self.rows.items())):
+            d = dict(zip(FIELDS, row))
+            d["power"] = round(d["volt"] * d["amp"], 1)
+            d["age_s"] = round(age_s(d["timestamp"], now))
+            d["online"] = d["age_s"] <= stale_s
+            if d["online"]:
+                online += 1
+                power += d["power"]
+            devices.append(d)
+        return {"devices": devices, "count": len(devices), "online": online, "power": round(power, 1)}
@@ -0,0 +1,177 @@
+"""
+Shadow-buffer and batching checks for lcd_i2c.py against a counting fake I2C bus
+- The fake decodes the PCF8574 nibble stream like an HD44780 would, so the checks
+  see what ends up on the glass, not just how many bytes went out
+- One writeto per flush, unchanged cells not re-sent, short gaps bridged,
+  worst-case updates fit the preallocated buffer, bus errors swallowed
+- Runs on CPython or the MicroPython unix port
+- Usage: python lcd_check.py   (exits non-zero if a check fails)
+"""
+
+import sys
+import time
+
+if not hasattr(time, "sleep_ms"):
+    time.sleep_ms = lambda ms: None
+    time.ticks_us = lambda: int(time.perf_counter() * 1000000)
+    time.ticks_diff = lambda a, b: a - b
+
+from lcd_i2c import I2cLcd, ROW_OFFSETS, LCD_ENABLE, LCD_RS
+
+ADDR = 0x27
+
+
+class FakeI2C:
+    """Counts writeto transactions and bytes, and replays them into a model of the
+    display (4-bit mode: a nibble is latched when the enable bit falls)"""
+    def __init__(self, cols, rows):
+        self.cols = cols
+        self.rows = rows
+        self.writes = 0
+        self.bytes = 0
+        self.total_writes = 0
+        self.total_bytes = 0
+        self.fail = False
+        self.glass = bytearray(b" " * (cols * rows))
+        self.addr = 0
+        self.high = None
+        self.enable = False
+
+    def writeto(self, addr, buf):
+        if self.fail:
+            raise OSError(19)
+        assert addr == ADDR
+        self.writes += 1
+        self.bytes += len(buf)
+        self.total_writes += 1
+        self.total_bytes += len(buf)
+        for b in bytes(buf):
+            enable = bool(b & LCD_ENABLE)
+            if self.enable and not enable:
+                self._nibble(b)
+            self.enable = enable
+        return len(buf)
+
+    def _nibble(self, b):
+        if self.high is None:
+            self.high = b
+            return
+        value = (self.high & 0xF0) | (b >> 4)
+        rs = self.high & LCD_RS
+        self.high = None
+        if rs:
+            row, col = self.cell(self.addr)
+            self.glass[row * self.cols + col] = value
+            self.addr += 1
+        elif value & 0x80:
+            self.addr = value & 0x7F
+        elif value == 0x01:
+            self.glass[:] = b" " * len(self.glass)
+            self.addr = 0
+
+    def cell(self, addr):
+        for row in range(self.rows):
+            if 0 <= addr - ROW_OFFSETS[row] < self.cols:
+                return row, addr - ROW_OFFSETS[row]
+        raise AssertionError("DDRAM address %02x is off the glass" % addr)
+
+    def reset(self):
+        self.writes = 0
+        self.bytes = 0
+
+    def lines(self):
+        return [bytes(self.glass[r * self.cols:(r + 1) * self.cols]).decode() for r in range(self.rows)]
+
+
+failed = []
+
+
+def check(name, ok):
+    print("  %-52s %s" % (name, "ok" if ok else "FAIL"))
+    if not ok:
+        failed.append(name)
+
+
+def make(cols, rows):
+    bus = FakeI2C(cols, rows)
+    lcd = I2cLcd(bus, ADDR, cols, rows)
+    lcd.init()
+    # init() talks 8-bit first; decode only what flush() sends
+    bus.high = None
+    bus.reset()
+    bus.total_writes = bus.total_bytes = 0
+    lcd.writes = lcd.bytes = 0
+    return bus, lcd
+
+
+def frame_lines(lcd):
+    return [bytes(lcd.frame[r * lcd.cols:(r + 1) * lcd.cols]).decode() for r in range(lcd.rows)]
+
+
+def main():
+    print("16x2 updates:")
+    bus, lcd = make(16, 2)
+    lcd.show("192.168.1.50", "A:1.234 V:230.1")
+    check("first frame is one writeto", bus.writes == 1)
+    check("glass shows the frame", bus.lines() == frame_lines(lcd))
+    # Both rows start at column 0: cursor-set + chars, 6 bus bytes each
+    check("only non-blank cells sent", bus.bytes == 6 * (1 + 12 + 1 + 15))
+
+    bus.reset()
+    lcd.show("192.168.1.50", "A:1.234 V:230.1")
+    check("same frame again sends nothing", bus.writes == 0 and bus.bytes == 0)
+
+    bus.reset()
+    lcd.show("192.168.1.50", "A:1.235 V:230.1")
+    check("one changed char: one writeto, cursor + 1 char", bus.writes == 1 and bus.bytes == 6 * 2)
+
+    bus.reset()
+    lcd.show("192.168.1.50", "A:1.236 V:230.2")
+    check("two far apart changes: two runs, one writeto", bus.writes == 1 and bus.bytes == 6 * 4)
+
+    bus.reset()
+    lcd.show("192.168.1.50", "A:1.337 V:230.2")
+    check("1-char gap rewritten instead of a second cursor-set", bus.writes == 1 and bus.bytes == 6 * 4)
+    check("glass still matches", bus.lines() == frame_lines(lcd))
+
+    bus.reset()
+    lcd.line(1, "A:1.337")
+    lcd.flush()
+    check("shorter text blanks the rest of the row", bus.lines()[1] == "A:1.337         " and bus.writes == 1)
+
+    bus.reset()
+    lcd.invalidate()
+    lcd.flush()
+    check("invalidate: full redraw in one writeto", bus.writes == 1 and bus.bytes == 6 * 2 * (1 + 16))
+
+    print("20x4 worst case:")
+    bus, lcd = make(20, 4)
+    lcd.show(*["X" * 20] * 4)
+    check("all 80 cells in one writeto", bus.writes == 1 and bus.bytes == 6 * 4 * 21)
+    # Every third cell changed: too far apart to bridge, each needs its own cursor-set
+    bus.reset()
+    lcd.show(*["".join("y" if c % 3 == 0 else "X" for c in range(20))] * 4)
+    check("1-in-3 pattern: one writeto, glass matches", bus.writes == 1 and bus.lines() == frame_lines(lcd))
+    check("7 runs per row, changed cells only", bus.bytes == 6 * 4 * (7 + 7))
+    bus.reset()
+    lcd.show(*["".join("z" if c % 3 < 2 else "y" for c in range(20))] * 4)
+    check("2-of-3 changed: gaps bridged into one run per row", bus.bytes == 6 * 4 * (1 + 20))
+    check("full redraw fits the preallocated buffer", 6 * 4 * 21 <= len(lcd._buf))
+
+    check("lcd.writes / lcd.bytes match the bus", lcd.writes == bus.total_writes and lcd.bytes == bus.total_bytes)
+
+    print("Bus errors:")
+    writes = lcd.writes
+    bus.fail = True
+    lcd.show("offline")
+    check("writeto error swallowed, not counted", lcd.writes == writes)
+    bus.fail = False
+
+    if failed:
+        print("FAIL:", ", ".join(failed))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+HD44780 LCD on a PCF8574 I2C backpack (16x2 or 20x4)
+- Frame buffer plus a shadow copy of what is on the glass
+- flush() only sends cursor-set + chars for runs that changed
+- No clear command (and its 2 ms wait) after init, so no flicker
+- Each update is built into one preallocated buffer and sent with a single writeto
+- writes / bytes count I2C transactions for diagnostics
+"""
+
+import time
+
+ROW_OFFSETS = (0x00, 0x40, 0x14, 0x54)
+
+# PCF8574 is specified for 100 kHz, most backpacks also run at 400 kHz.
+# Either way one byte on the bus outlasts the 37 us HD44780 execution time.
+I2C_FREQ = 100000
+
+LCD_BACKLIGHT = 0x08
+LCD_ENABLE = 0x04
+LCD_RS = 0x01
+
+class I2cLcd:
+    def __init__(self, i2c, addr, cols=16, rows=2):
+        self.i2c = i2c
+        self.addr = addr
+        self.cols = cols
+        self.rows = rows
+        self.backlight = True
+        self.frame = bytearray(b' ' * (cols * rows))
+        self.shadow = bytearray(b' ' * (cols * rows))
+        self.writes = 0
+        self.bytes = 0
+        # Worst case flush: every row is chars plus one cursor-set per 3 columns,
+        # 6 bus bytes (2 nibbles x data/enable-high/enable-low) each
+        self._buf = bytearray(6 * rows * (cols + cols // 3 + 1))
+        self._mv = memoryview(self._buf)
+
+    # ============== Low Level ==============
+    def _put_nibble(self, pos, data):
+        bl = LCD_BACKLIGHT if self.backlight else 0
+        buf = self._buf
+        buf[pos] = data | bl
+        buf[pos + 1] = data | bl | LCD_ENABLE
+        buf[pos + 2] = data | bl
+        return pos + 3
+
+    def _put_byte(self, pos, value, rs):
+        pos = self._put_nibble(pos, rs | (value & 0xF0))
+        return self._put_nibble(pos, rs | ((value << 4) & 0xF0))
+
+    def _send(self, n):
+        try:
+            self.i2c.writeto(self.addr, self._mv[:n])
+            self.writes += 1
+            self.bytes += n
+        except:
+            pass
+
+    def _write(self, data):
+        self._buf[0] = data | (LCD_BACKLIGHT if self.backlight else 0)
+        self._send(1)
+
+    def _nibble(self, data):
+        self._send(self._put_nibble(0, data))
+
+    def cmd(self, cmd):
+        self._send(self._put_byte(0, cmd, 0))
+
+    def init(self):
+        time.sleep_ms(50)
+        self._nibble(0x30)
+        time.sleep_ms(5)
+        self._nibble(0x30)
+        time.sleep_ms(1)
+        self._nibble(0x30)
+        time.sleep_ms(1)
+        self._nibble(0x20)
+        self.cmd(0x28)  # 4-bit, 2-line
+        self.cmd(0x0C)  # Display ON, cursor OFF
+        self.cmd(0x01)  # Clear
+        time.sleep_ms(2)
+        self.cmd(0x06)  # Entry mode
+        for i in range(len(self.shadow)):
+            self.frame[i] = 32
+            self.shadow[i] = 32
+
+    def set_backlight(self, state):
+        self.backlight = state
+        self._write(0)
+
+    # ============== Frame Buffer ==============
+    def line(self, row, text):
+        """Put text on a row of the frame, padded with spaces"""
+        if row >= self.rows:
+            return
+        base = row * self.cols
+        n = min(len(text), self.cols)
+        for i in range(n):
+            self.frame[base + i] = ord(text[i])
+        for i in range(n, self.cols):
+            self.frame[base + i] = 32
+
+    def show(self, *lines):
+        """Replace the whole screen; rows not given are blanked"""
+        for row in range(self.rows):
+            self.line(row, lines[row] if row < len(lines) else "")
+        self.flush()
+
+    def flush(self):
+        """Write only the changed runs of each row to the glass"""
+        frame = self.frame
+        shadow = self.shadow
+        cols = self.cols
+        pos = 0
+        for row in range(self.rows):
+            base = row * cols
+            col = 0
+            while col < cols:
+                if frame[base + col] == shadow[base + col]:
+                    col += 1
+                    continue
+                start = col
+                end = col + 1
+                # Extend the run; a single unchanged char is cheaper to rewrite than a new cursor-set
+                while end < cols and (frame[base + end] != shadow[base + end] or
+                                      (end + 1 < cols and frame[base + end + 1] != shadow[base + end + 1])):
+                    end += 1
+                pos = self._put_byte(pos, 0x80 | (ROW_OFFSETS[row] + start), 0)
+                for i in range(base + start, base + end):
+                    pos = self._put_byte(pos, frame[i], LCD_RS)
+                    shadow[i] = frame[i]
+                col = end
+        if pos:
+            self._send(pos)
+
+    def invalidate(self):
+        """Force a full redraw on the next flush (e.g. after the LCD was power cycled)"""
+        for i in range(len(self.shadow)):
+            self.shadow[i] = 0
+
+
+def bench(lcd, n=20):
+    """REPL helper: full-screen redraw throughput and I2C transactions"""
+    text = "0123456789ABCDEFGHIJ"
+    w0 = lcd.writes
+    b0 = lcd.bytes
+    t0 = time.ticks_us()
+    for k in range(n):
+        lcd.invalidate()
+        for row in range(lcd.rows):
+            lcd.line(row, text[k % 10:])
+        lcd.flush()
+    us = time.ticks_diff(time.ticks_us(), t0)
+    chars = n * lcd.rows * lcd.cols
+    print("{} chars in {} ms: {} chars/s, {} writes, {} bus bytes".format(
+        chars, us // 1000, chars * 1000000 // max(us, 1), lcd.writes - w0, lcd.bytes - b0))
@@ -0,0 +1,361 @@
+"""
+Load generator: N virtual ESP32 PZEM boards posting to the webhook
+- Each board sends the bytes send_to_remote builds (reading_json in webhook-iot.py):
+  fixed-point JSON in the same field order and decimals, Content-Type: application/json;
+  --insert sends the insertE1.php GET form instead
+- Readings follow a load profile per board: fridge compressor cycling, motor on day
+  shifts with inrush spikes, office hours, steady base load; mains voltage sags with
+  load, PF depends on the profile, the energy counter keeps counting
+- Each board sends every --interval s with timer drift (--jitter) from a random phase;
+  --sync starts them all together (boards coming back after a power cut)
+- Like urequests, a board waits for its POST (10 s timeout) before its next reading;
+  a board a whole period late skips the missed sends, as scheduler.py does
+- asyncio, over a pool of --connections keep-alive connections (default one per board:
+  every request waits for its commit, so the pool bounds the request rate at about
+  connections / latency); --no-keepalive opens one connection per POST as the firmware does
+- Reports throughput, latency percentiles (server time, and the wait for a pooled
+  connection apart), schedule lag and errors by kind, and the
+  electric row count before and after (--db, or the server --spawn started);
+  exits 1 if rows were acknowledged but not stored
+- --spawn runs ingest_server.py on a temporary SQLite database, so it runs offline
+- Usage: python load_gen.py --spawn --devices 2000 --interval 5 --duration 30
+         python load_gen.py --url http://host:8080/webhook/iot-data --db mysql://u:p@host/iot_db
+         python load_gen.py --insert --url http://host/insertE1.php --devices 500
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+from electric_db import ElectricDB
+from group_commit import percentile
+
+# POST timeout of post_json in webhook-iot.py
+TIMEOUT_S = 10
+PROFILES = ("fridge", "motor", "office", "base")
+
+
+def fixed(value, decimals):
+    """Raw register value as put_fixed writes it: 2341, 1 -> "234.1"; 5, 3 -> "0.005" """
+    if not decimals:
+        return str(value)
+    scale = 10 ** decimals
+    return "%d.%0*d" % (value // scale, decimals, value % scale)
+
+
+def json_str(s):
+    return s.replace("\\", "\\\\").replace('"', '\\"')
+
+
+# ============== Virtual board ==============
+class Board:
+    def __init__(self, n, rng, interval):
+        self.rng = rng
+        self.devid = "sim%05d" % n
+        self.mcid = "m-%03d" % (n % 4 + 1)
+        self.interval = interval
+        self.profile = PROFILES[n % len(PROFILES)]
+        self.rated = {"fridge": 1.2, "motor": 7.5, "office": 3.5, "base": 1.0}[self.profile] * rng.uniform(0.7, 1.3)
+        self.cycle = rng.uniform(1200, 2400)
+        self.phase = rng.random()
+        self.wh = rng.uniform(0, 500000)
+        self.amp = 0.0
+        self.head = '{"devid":"%s","mcid":"%s"' % (json_str(self.devid), json_str(self.mcid))
+
+    def current(self, now):
+        rng = self.rng
+        hour = time.localtime(now).tm_hour
+        if self.profile == "fridge":
+            on = (now / self.cycle + self.phase) % 1 < 0.4
+            return self.rated * rng.gauss(1, 0.04) if on else rng.uniform(0.01, 0.03), 0.85 if on else 0.3
+        if self.profile == "motor":
+            if not 7 <= hour < 19:
+                return 0.0, 0.0
+            if rng.random() < 0.01:
+                # Inrush caught by the sample
+                return self.rated * rng.uniform(3, 4), 0.6
+            return self.rated * rng.gauss(1, 0.08), 0.8
+        if self.profile == "office":
+            if 8 <= hour < 18:
+                # Random walk around the rated load
+                self.amp = min(max(self.amp + rng.gauss(0, 0.2), self.rated * 0.5), self.rated * 1.5)
+                return self.amp, 0.95
+            return 0.3 * rng.gauss(1, 0.05), 0.9
+        return self.rated * rng.gauss(1, 0.05), 0.9
+
+    def reading(self, now):
+        """Raw registers (voltage 0.1 V, current mA, power 0.1 W, energy Wh, frequency 0.1 Hz, pf 0.01)"""
+        amp, pf = self.current(now)
+        amp = max(amp, 0.0)
+        volt = 230 + 3 * math.sin(now / 86400 * 2 * math.pi) - 0.15 * amp + self.rng.gauss(0, 0.8)
+        watts = volt * amp * pf
+        self.wh += watts * self.interval / 3600
+        return (int(volt * 10), int(amp * 1000), int(watts * 10), int(self.wh),
+                int(500 + self.rng.gauss(0, 0.5)), int(pf * 100))
+
+    def payload(self, now):
+        """reading_json(): same keys, order and decimals"""
+        v, a, p, e, f, pf = self.reading(now)
+        return ('%s,"voltage":%s,"current":%s,"power":%s,"energy":%s,"frequency":%s,"pf":%s,"interval":%d}' % (
+            self.head, fixed(v, 1), fixed(a, 3), fixed(p, 1), fixed(e, 3), fixed(f, 1), fixed(pf, 2),
+            self.interval)).encode()
+
+    def query(self, now):
+        """insertE1.php form: amp=0.000&volt=234.1&pf=0.00&energy=0.24"""
+        v, a, _, e, _, pf = self.reading(now)
+        return "devid=%s&mcid=%s&amp=%s&volt=%s&pf=%s&energy=%s" % (
+            self.devid, self.mcid, fixed(a, 3), fixed(v, 1), fixed(pf, 2), fixed(e, 3))
+
+
+# ============== HTTP ==============
+class Pool:
+    """Keep-alive HTTP/1.1 connections to one host, opened on demand up to size"""
+    def __init__(self, host, port, size, keepalive=True):
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.free = asyncio.Queue()
+        for _ in range(size):
+            self.free.put_nowait(None)
+        self.opened = 0
+
+    async def request(self, head, body=b""):
+        """Send one request (head without the Connection header);
+        returns (status code, seconds waited for a connection)"""
+        t0 = time.time()
+        conn = await self.free.get()
+        waited = time.time() - t0
+        try:
+            if conn is None:
+                conn = await asyncio.open_connection(self.host, self.port)
+                self.opened += 1
+            reader, writer = conn
+            writer.write(head + (b"Connection: keep-alive\r\n\r\n" if self.keepalive
+                                 else b"Connection: close\r\n\r\n") + body)
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            close = not self.keepalive
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                k, _, v = line.partition(b":")
+                k = k.strip().lower()
+                if k == b"content-length":
+                    length = int(v)
+                elif k == b"connection" and v.strip().lower() == b"close":
+                    close = True
+            if length:
+                await reader.readexactly(length)
+            if close:
+                writer.close()
+                conn = None
+            return status, waited
+        except BaseException:
+            if conn:
+                conn[1].close()
+            conn = None
+            raise
+        finally:
+            self.free.put_nowait(conn)
+
+    def close(self):
+        while not self.free.empty():
+            conn = self.free.get_nowait()
+            if conn:
+                conn[1].close()
+
+
+class Stats:
+    def __init__(self):
+        self.sent = 0
+        self.ok = 0
+        self.errors = {}
+        self.latency = []
+        self.waits = []
+        self.lag = []
+        self.skipped = 0
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+async def run_board(board, pool, url, insert, start, end, jitter, stats):
+    host = url.netloc.encode()
+    due = start
+    while due < end and time.time() < end:
+        now = time.time()
+        if due > now:
+            await asyncio.sleep(due - now)
+        began = time.time()
+        stats.lag.append(began - due)
+        if insert:
+            head = b"GET %s?%s HTTP/1.1\r\nHost: %s\r\n" % (url.path.encode(), board.query(began).encode(), host)
+            body = b""
+        else:
+            body = board.payload(began)
+            head = b"POST %s HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n" % (
+                url.path.encode(), host, len(body))
+        stats.sent += 1
+        waited = 0.0
+        try:
+            status, waited = await asyncio.wait_for(pool.request(head, body), TIMEOUT_S)
+            if status == 200:
+                stats.ok += 1
+            else:
+                stats.error("HTTP %d" % status)
+        except asyncio.TimeoutError:
+            stats.error("timeout")
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError) as e:
+            stats.error(type(e).__name__)
+        stats.waits.append(waited)
+        stats.latency.append(time.time() - began - waited)
+        # The scheduler's period, give or take the board's timer drift
+        period = board.interval * (1 + board.rng.uniform(-jitter, jitter))
+        due += period
+        behind = time.time() - due
+        if behind >= period:
+            skipped = int(behind // period) + 1
+            stats.skipped += skipped
+            due += skipped * period
+
+
+async def report(stats, every, started):
+    last = 0
+    while True:
+        await asyncio.sleep(every)
+        recent = stats.latency[last:]
+        last = len(stats.latency)
+        print("%6.0f s  %7d sent  %7.0f req/s  p99 %6.1f ms  errors %d" % (
+            time.time() - started, stats.sent, len(recent) / every, percentile(recent, 99) * 1000,
+            sum(stats.errors.values())))
+
+
+async def count_rows(url):
+    db = await ElectricDB(url, 1).open()
+    try:
+        return await db.count()
+    finally:
+        db.close()
+
+
+async def generate(args, url):
+    parts = urlsplit(url)
+    pool = Pool(parts.hostname, parts.port or 80, args.connections or args.devices, not args.no_keepalive)
+    rng = random.Random(args.seed)
+    interval = max(1, int(args.interval))
+    boards = [Board(n, random.Random(rng.random()), interval) for n in range(args.devices)]
+    stats = Stats()
+    start = time.time() + 0.5
+    end = start + args.duration
+    tasks = [asyncio.create_task(run_board(b, pool, parts, args.insert,
+                                           start + (0 if args.sync else b.rng.uniform(0, interval)),
+                                           end, args.jitter, stats)) for b in boards]
+    reporter = asyncio.create_task(report(stats, args.report, start)) if args.report else None
+    await asyncio.gather(*tasks)
+    if reporter:
+        reporter.cancel()
+    pool.close()
+    return stats, time.time() - start, pool.opened
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn(db_url, port, extra):
+    """ingest_server.py on 127.0.0.1:port (its alert messages and stats line are not shown);
+    returns the process once it accepts connections"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.Popen([sys.executable, os.path.join(here, "ingest_server.py"), "--host", "127.0.0.1",
+                             "--port", str(port), "--db", db_url, "--report", "0"] + extra,
+                            stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.2).close()
+            return proc
+        except OSError:
+            if proc.poll() is not None:
+                raise SystemExit("ingest_server.py exited with code {}".format(proc.returncode))
+            time.sleep(0.1)
+    proc.kill()
+    raise SystemExit("ingest_server.py did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many ESP32 PZEM boards posting readings")
+    parser.add_argument('--url', default="http://127.0.0.1:8080/webhook/iot-data")
+    parser.add_argument('--insert', action='store_true', help="GET insertE1.php query strings instead of JSON")
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--interval', type=float, default=60, help="send_interval of every board (s)")
+    parser.add_argument('--jitter', type=float, default=0.02, help="timer drift, fraction of the interval")
+    parser.add_argument('--sync', action='store_true', help="all boards start at the same moment")
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--connections', type=int, default=0, help="connection pool size (0 = one per board)")
+    parser.add_argument('--no-keepalive', action='store_true', help="one connection per request, like urequests")
+    parser.add_argument('--db', help="electric database to count rows in (sqlite:PATH or mysql://...)")
+    parser.add_argument('--spawn', action='store_true', help="start ingest_server.py on a temporary SQLite db")
+    parser.add_argument('--server-args', default="", help="extra ingest_server.py arguments with --spawn")
+    parser.add_argument('--report', type=float, default=5, help="seconds between progress lines (0 = off)")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    url = args.url
+    proc = None
+    tmp = None
+    if args.spawn:
+        tmp = tempfile.TemporaryDirectory()
+        args.db = "sqlite:" + os.path.join(tmp.name, "load.db")
+        port = free_port()
+        proc = spawn(args.db, port, args.server_args.split())
+        url = "http://127.0.0.1:{}{}".format(port, "/insertE1.php" if args.insert else "/webhook/iot-data")
+
+    try:
+        before = asyncio.run(count_rows(args.db)) if args.db else None
+        print("%d boards, every %.0f s (+-%.0f%%), %.0f s against %s" % (
+            args.devices, args.interval, args.jitter * 100, args.duration, url))
+        stats, elapsed, opened = asyncio.run(generate(args, url))
+    finally:
+        if proc:
+            # SIGINT: the server drains its commit queue before it exits
+            proc.send_signal(signal.SIGINT)
+            proc.wait(30)
+
+    offered = args.devices / args.interval
+    print("sent %d in %.1f s: %.0f req/s (offered %.0f/s), %d ok, %d connections opened" % (
+        stats.sent, elapsed, stats.sent / elapsed, offered, stats.ok, opened))
+    print("latency ms  p50 %.1f  p90 %.1f  p99 %.1f  max %.1f" % tuple(
+        v * 1000 for v in (percentile(stats.latency, 50), percentile(stats.latency, 90),
+                           percentile(stats.latency, 99), max(stats.latency or [0]))))
+    print("pool wait ms  p50 %.1f  p99 %.1f" % (percentile(stats.waits, 50) * 1000,
+                                              percentile(stats.waits, 99) * 1000))
+    print("schedule lag ms  p50 %.1f  p99 %.1f  (sends later than the board's timer), %d sends skipped" % (
+        percentile(stats.lag, 50) * 1000, percentile(stats.lag, 99) * 1000, stats.skipped))
+    failed = sum(stats.errors.values())
+    print("errors %d (%.2f%%) %s" % (failed, 100.0 * failed / max(stats.sent, 1),
+                                      " ".join("%s=%d" % kv for kv in sorted(stats.errors.items()))))
+    lost = False
+    if args.db:
+        rows = asyncio.run(count_rows(args.db)) - before
+        lost = rows < stats.ok
+        print("rows written %d for %d ok responses%s" % (rows, stats.ok, "  ROWS MISSING" if lost else ""))
+    if tmp:
+        tmp.cleanup()
+    if lost:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+ESP32 PZEM Metrics
+- Counters, gauges and histograms kept in one preallocated array
+- Recording (inc / set_gauge / observe) never allocates
+- render() writes Prometheus text format for the /metrics endpoint
+"""
+
+from array import array
+from micropython import const
+import time
+import gc
+
+try:
+    import esp32
+except ImportError:
+    esp32 = None
+
+# ============== Slots ==============
+# HTTP requests by route (order must match ROUTES)
+HTTP_API = const(0)
+HTTP_METRICS = const(1)
+HTTP_SETTINGS = const(2)
+HTTP_SETUP = const(3)
+HTTP_SAVESETTINGS = const(4)
+HTTP_SAVEWIFI = const(5)
+HTTP_SEND = const(6)
+HTTP_INDEX = const(7)
+HTTP_EXPORT = const(8)
+HTTP_PROFILE = const(9)
+
+# Counters
+PZEM_READS = const(10)
+PZEM_TIMEOUTS = const(11)
+PZEM_CRC_ERRORS = const(12)
+PZEM_EXCEPTIONS = const(13)
+PZEM_RESTARTS = const(14)
+WEBHOOK_OK = const(15)
+WEBHOOK_ERRORS = const(16)
+SAMPLE_OVERRUNS = const(17)
+SAMPLE_DROPPED = const(18)
+WIFI_DISCONNECTS = const(19)
+
+# Gauges
+HEAP_FREE = const(20)
+HEAP_ALLOC = const(21)
+HEAP_LARGEST = const(22)
+UPTIME = const(23)
+
+# Histograms: one slot per bound, then +Inf, sum, count
+LOOP_MS = const(24)
+PZEM_RTT_MS = const(36)
+LCD_MS = const(46)
+SAMPLE_JITTER_MS = const(56)
+WIFI_ASSOC_MS = const(68)
+WIFI_OUTAGE_S = const(79)
+_SIZE = const(90)
+
+ROUTES = ("api", "metrics", "settings", "setup", "savesettings", "savewifi", "send", "index", "export", "profile")
+
+LOOP_BOUNDS = (1, 2, 5, 10, 25, 50, 100, 250, 1000)
+PZEM_RTT_BOUNDS = (100, 110, 125, 150, 200, 500, 1000)
+LCD_BOUNDS = (5, 10, 20, 50, 100, 250, 500)
+SAMPLE_JITTER_BOUNDS = (1, 2, 5, 10, 25, 50, 100, 250, 1000)
+WIFI_ASSOC_BOUNDS = (100, 250, 500, 1000, 2000, 5000, 10000, 15000)
+WIFI_OUTAGE_BOUNDS = (1, 5, 10, 30, 60, 300, 900, 3600)
+
+_BOUNDS = {
+    LOOP_MS: LOOP_BOUNDS,
+    PZEM_RTT_MS: PZEM_RTT_BOUNDS,
+    LCD_MS: LCD_BOUNDS,
+    SAMPLE_JITTER_MS: SAMPLE_JITTER_BOUNDS,
+    WIFI_ASSOC_MS: WIFI_ASSOC_BOUNDS,
+    WIFI_OUTAGE_S: WIFI_OUTAGE_BOUNDS,
+}
+
+_COUNTERS = (
+    ("esp32_pzem_reads_total", "Successful PZEM register reads", PZEM_READS),
+    ("esp32_pzem_timeouts_total", "PZEM reads with no or short reply", PZEM_TIMEOUTS),
+    ("esp32_pzem_crc_errors_total", "PZEM replies with bad CRC", PZEM_CRC_ERRORS),
+    ("esp32_pzem_exceptions_total", "PZEM exception replies (0x84)", PZEM_EXCEPTIONS),
+    ("esp32_pzem_restarts_total", "PZEM UART restarts after consecutive failures", PZEM_RESTARTS),
+    ("esp32_webhook_ok_total", "Successful webhook sends", WEBHOOK_OK),
+    ("esp32_webhook_errors_total", "Failed webhook sends", WEBHOOK_ERRORS),
+    ("esp32_sample_overruns_total", "Sample timer fired before the previous sample was taken", SAMPLE_OVERRUNS),
+    ("esp32_sample_dropped_total", "Sample timer callbacks lost to a full schedule queue", SAMPLE_DROPPED),
+    ("esp32_wifi_disconnects_total", "WiFi link drops seen by the supervisor", WIFI_DISCONNECTS),
+)
+
+_GAUGES = (
+    ("esp32_heap_free_bytes", "Free GC heap", HEAP_FREE),
+    ("esp32_heap_alloc_bytes", "Allocated GC heap", HEAP_ALLOC),
+    ("esp32_heap_largest_free_bytes", "Largest free IDF heap block", HEAP_LARGEST),
+    ("esp32_uptime_seconds", "Seconds since boot", UPTIME),
+)
+
+_HISTOGRAMS = (
+    ("esp32_loop_duration_ms", "Main loop iteration time", LOOP_MS),
+    ("esp32_pzem_rtt_ms", "PZEM request to reply time", PZEM_RTT_MS),
+    ("esp32_lcd_update_ms", "LCD update time", LCD_MS),
+    ("esp32_sample_jitter_ms", "PZEM sample start minus its scheduled tick", SAMPLE_JITTER_MS),
+    ("esp32_wifi_assoc_ms", "WiFi connect attempt to link up", WIFI_ASSOC_MS),
+    ("esp32_wifi_outage_seconds", "WiFi link lost to link up again", WIFI_OUTAGE_S),
+)
+
+_m = array('l', [0] * _SIZE)
+_boot = time.ticks_ms()
+
+# ============== Recording ==============
+def inc(slot, n=1):
+    _m[slot] += n
+
+def set_gauge(slot, value):
+    _m[slot] = value
+
+def get(slot):
+    return _m[slot]
+
+def observe(base, value):
+    bounds = _BOUNDS[base]
+    n = len(bounds)
+    i = 0
+    while i < n and value > bounds[i]:
+        i += 1
+    _m[base + i] += 1
+    _m[base + n + 1] += value
+    _m[base + n + 2] += 1
+
+def refresh():
+    """Update heap and uptime gauges (called before rendering)"""
+    _m[HEAP_FREE] = gc.mem_free()
+    _m[HEAP_ALLOC] = gc.mem_alloc()
+    _m[HEAP_LARGEST] = largest_free_block()
+    _m[UPTIME] = time.ticks_diff(time.ticks_ms(), _boot) // 1000
+
+def largest_free_block():
+    if esp32 is None:
+        return 0
+    try:
+        return max(h[2] for h in esp32.idf_heap_info(esp32.HEAP_DATA))
+    except:
+        return 0
+
+# ============== Prometheus Text Format ==============
+def render(write):
+    """Write all metrics through write(str), e.g. client.send"""
+    refresh()
+
+    write("# HELP esp32_http_requests_total HTTP requests by route\n")
+    write("# TYPE esp32_http_requests_total counter\n")
+    for i in range(len(ROUTES)):
+        write('esp32_http_requests_total{route="%s"} %d\n' % (ROUTES[i], _m[HTTP_API + i]))
+
+    for name, doc, slot in _COUNTERS:
+        write("# HELP %s %s\n# TYPE %s counter\n%s %d\n" % (name, doc, name, name, _m[slot]))
+
+    for name, doc, slot in _GAUGES:
+        write("# HELP %s %s\n# TYPE %s gauge\n%s %d\n" % (name, doc, name, name, _m[slot]))
+
+    for name, doc, base in _HISTOGRAMS:
+        bounds = _BOUNDS[base]
+        n = len(bounds)
+        write("# HELP %s %s\n# TYPE %s histogram\n" % (name, doc, name))
+        total = 0
+        for i in range(n):
+            total += _m[base + i]
+            write('%s_bucket{le="%d"} %d\n' % (name, bounds[i], total))
+        total += _m[base + n]
+        write('%s_bucket{le="+Inf"} %d\n' % (name, total))
+        write("%s_sum %d\n%s_count %d\n" % (name, _m[base + n + 1], name, _m[base + n + 2]))
@@ -0,0 +1,187 @@
+"""
+Web page templates for webhook-iot.py
+- Static parts are bytes constants; frozen into the firmware they stay in flash
+- Pages are streamed piece by piece, so no formatted copy is built on the heap
+- Only imported on the first page request (the WiFi setup page is rarely used)
+"""
+
+# ============== WiFi Setup ==============
+SETUP = b'''<!DOCTYPE html>
+<html>
+<head>
+    <title>WiFi Setup</title>
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <style>
+        body{font-family:Arial;margin:20px;background:#1a1a2e;color:#fff;}
+        .card{background:#16213e;padding:20px;border-radius:10px;max-width:400px;margin:auto;}
+        h1{color:#e94560;text-align:center;}
+        input{width:100%;padding:12px;margin:8px 0;border:none;border-radius:5px;box-sizing:border-box;}
+        button{width:100%;padding:12px;background:#e94560;color:#fff;border:none;border-radius:5px;cursor:pointer;font-size:16px;}
+    </style>
+</head>
+<body>
+    <div class="card">
+        <h1>WiFi Setup</h1>
+        <form action="/savewifi" method="GET">
+            <input type="text" name="ssid" placeholder="WiFi SSID" required>
+            <input type="password" name="pass" placeholder="WiFi Password" required>
+            <button type="submit">Connect</button>
+        </form>
+    </div>
+</body>
+</html>'''
+
+def send_setup(send):
+    send(SETUP)
+
+# ============== Settings ==============
+SETTINGS_HEAD = b'''<!DOCTYPE html>
+<html>
+<head>
+    <title>Device Settings</title>
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <style>
+        body{font-family:Arial;margin:20px;background:#1a1a2e;color:#fff;}
+        .card{background:#16213e;padding:20px;border-radius:10px;max-width:400px;margin:auto;}
+        h1{color:#00d4ff;text-align:center;}
+        label{display:block;margin-top:15px;color:#888;}
+        input{width:100%;padding:12px;margin:5px 0;border:none;border-radius:5px;box-sizing:border-box;}
+        button{width:100%;padding:12px;background:#00d4ff;color:#000;border:none;border-radius:5px;cursor:pointer;font-size:16px;margin-top:20px;}
+        .info{background:#0f3460;padding:10px;border-radius:5px;margin-top:15px;font-size:12px;word-break:break-all;}
+        a{color:#e94560;}
+    </style>
+</head>
+<body>
+    <div class="card">
+        <h1>Device Settings</h1>
+        <form action="/savesettings" method="GET">
+            <label>Device ID</label>
+            <input type="text" name="devid" value="'''
+SETTINGS_MCID = b'''" maxlength="32" required>
+            <label>Machine ID</label>
+            <input type="text" name="mcid" value="'''
+SETTINGS_INTERVAL = b'''" maxlength="32" required>
+            <label>Send Interval (seconds)</label>
+            <input type="number" name="interval" value="'''
+SETTINGS_WEBHOOK = b'''" min="10" max="3600" required>
+            <button type="submit">Save Settings</button>
+        </form>
+        <div class="info">
+            <p><b>Webhook:</b> '''
+SETTINGS_STATUS = b'''</p>
+            <p><b>Last Send:</b> '''
+SETTINGS_TAIL = b'''</p>
+        </div>
+        <p style="text-align:center;margin-top:15px;"><a href="/">Back to Dashboard</a></p>
+    </div>
+</body>
+</html>'''
+
+def send_settings(send, dev_id, mc_id, interval, webhook, status):
+    send(SETTINGS_HEAD)
+    send(dev_id)
+    send(SETTINGS_MCID)
+    send(mc_id)
+    send(SETTINGS_INTERVAL)
+    send(str(interval))
+    send(SETTINGS_WEBHOOK)
+    send(webhook)
+    send(SETTINGS_STATUS)
+    send(status)
+    send(SETTINGS_TAIL)
+
+# ============== Dashboard ==============
+INDEX_HEAD = b'''<!DOCTYPE html>
+<html>
+<head>
+    <title>PZEM Monitor</title>
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <style>
+        body{font-family:Arial;margin:0;padding:20px;background:#0f0f23;color:#fff;}
+        h1{text-align:center;color:#00d4ff;}
+        .grid{display:grid;grid-template-columns:repeat(2,1fr);gap:15px;max-width:500px;margin:auto;}
+        .card{background:linear-gradient(135deg,#1a1a3e,#2d2d5a);padding:20px;border-radius:15px;text-align:center;}
+        .value{font-size:32px;font-weight:bold;color:#00ff88;}
+        .label{font-size:14px;color:#888;margin-top:5px;}
+        .volt{color:#ffcc00;}
+        .amp{color:#ff6b6b;}
+        .watt{color:#00d4ff;}
+        .status{text-align:center;color:#666;margin-top:20px;font-size:12px;}
+        .online{color:#00ff88;}
+        .menu{text-align:center;margin-top:20px;}
+        .menu a{color:#e94560;margin:0 10px;}
+        .info{text-align:center;background:#1a1a3e;padding:10px;border-radius:10px;margin-top:15px;max-width:500px;margin-left:auto;margin-right:auto;}
+    </style>
+</head>
+<body>
+    <h1>PZEM Monitor</h1>
+    <div class="grid">
+        <div class="card">
+            <div class="value volt" id="volt">---</div>
+            <div class="label">Voltage (V)</div>
+        </div>
+        <div class="card">
+            <div class="value amp" id="amp">---</div>
+            <div class="label">Current (A)</div>
+        </div>
+        <div class="card">
+            <div class="value watt" id="watt">---</div>
+            <div class="label">Power (W)</div>
+        </div>
+        <div class="card">
+            <div class="value" id="energy">---</div>
+            <div class="label">Energy (kWh)</div>
+        </div>
+        <div class="card">
+            <div class="value" id="freq">---</div>
+            <div class="label">Frequency (Hz)</div>
+        </div>
+        <div class="card">
+            <div class="value" id="pf">---</div>
+            <div class="label">Power Factor</div>
+        </div>
+    </div>
+    <div class="info">
+        <span>Device: <b id="devid">---</b></span> | 
+        <span>Machine: <b id="mcid">---</b></span> | 
+        <span>Send: <b id="interval">---</b>s</span>
+    </div>
+    <p class="status">IP: '''
+INDEX_TAIL = b''' | <span class="online" id="status">Updating...</span></p>
+    <div class="menu">
+        <a href="/settings">Settings</a> | 
+        <a href="/send">Send Now</a> | 
+        <a href="/export">Export CSV</a> | 
+        <a href="/setup">WiFi Setup</a>
+    </div>
+    
+    <script>
+        function updateData() {
+            fetch('/api')
+                .then(response => response.json())
+                .then(data => {
+                    document.getElementById('volt').textContent = (data.voltage !== null) ? data.voltage.toFixed(1) : '---';
+                    document.getElementById('amp').textContent = (data.current !== null) ? data.current.toFixed(3) : '---';
+                    document.getElementById('watt').textContent = (data.power !== null) ? data.power.toFixed(1) : '---';
+                    document.getElementById('energy').textContent = (data.energy !== null) ? data.energy.toFixed(2) : '---';
+                    document.getElementById('freq').textContent = (data.frequency !== null) ? data.frequency.toFixed(1) : '---';
+                    document.getElementById('pf').textContent = (data.pf !== null) ? data.pf.toFixed(2) : '---';
+                    document.getElementById('devid').textContent = data.devid;
+                    document.getElementById('mcid').textContent = data.mcid;
+                    document.getElementById('interval').textContent = data.interval;
+                    document.getElementById('status').textContent = 'Live (5s refresh)';
+                })
+                .catch(err => {
+                    document.getElementById('status').textContent = 'Connection error';
+                });
+        }
+        updateData();
+        setInterval(updateData, 5000);
+    </script>
+</body>
+</html>'''
+
+def send_index(send, ip):
+    send(INDEX_HEAD)
+    send(ip)
+    send(INDEX_TAIL)
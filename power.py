@@ -0,0 +1,131 @@
+"""
+Low-power duty cycling for PZEM sites on battery / UPS
+- SAMPLE -> SLEEP -> SAMPLE ... with the CPU sleeping in between
+- Every upload_every samples: CONNECT (WiFi on) -> UPLOAD -> WiFi off
+- Samples that come due while connecting are still taken on time
+- Awake vs. asleep time gives the duty cycle
+- Clock, sleep and radio are callbacks, so it runs on a simulated clock (power_check.py)
+"""
+
+import time
+
+try:
+    ticks_add = time.ticks_add
+    ticks_diff = time.ticks_diff
+except AttributeError:
+    # CPython, simulated clock: plain integers, no wrap
+    def ticks_add(t, delta):
+        return t + delta
+
+    def ticks_diff(a, b):
+        return a - b
+
+SAMPLE = 0
+SLEEP = 1
+CONNECT = 2
+UPLOAD = 3
+STATE_NAMES = ("sample", "sleep", "connect", "upload")
+
+class PowerManager:
+    def __init__(self, sample_ms, upload_every, sample, upload, radio_on, radio_off, radio_ready,
+                 sleep=None, wait=None, clock=None, connect_timeout=15000):
+        self.sample_ms = sample_ms
+        self.upload_every = upload_every
+        self.sample = sample
+        self.upload = upload
+        self.radio_on = radio_on
+        self.radio_off = radio_off
+        self.radio_ready = radio_ready
+        # Defaults resolved here, so the module imports where time has no ticks_ms
+        self.sleep = sleep or time.sleep_ms
+        self.wait = wait or time.sleep_ms
+        self.clock = clock = clock or time.ticks_ms
+        self.connect_timeout = connect_timeout
+
+        self.state = SAMPLE
+        self.next_sample = clock()
+        self.connect_start = 0
+        self.pending = 0
+        self.uploads = 0
+        self.upload_failures = 0
+        self.awake_ms = 0
+        self.asleep_ms = 0
+
+    def restore(self, pending, awake_ms, asleep_ms, next_in=0):
+        """Resume after a deep sleep: counters come from RTC memory, next sample is next_in ms away"""
+        self.pending = pending
+        self.awake_ms = awake_ms
+        self.asleep_ms = asleep_ms
+        self.next_sample = ticks_add(self.clock(), next_in)
+        self.state = SLEEP if next_in > 0 else SAMPLE
+
+    def until_next_sample(self):
+        return ticks_diff(self.next_sample, self.clock())
+
+    def _take_sample(self):
+        stamp = self.next_sample
+        self.next_sample = ticks_add(self.next_sample, self.sample_ms)
+        # Skip slots that were missed entirely rather than sampling in a burst
+        while ticks_diff(self.next_sample, self.clock()) <= 0:
+            self.next_sample = ticks_add(self.next_sample, self.sample_ms)
+        self.sample(stamp)
+        self.pending += 1
+
+    def step(self):
+        """Advance the state machine by one transition"""
+        start = self.clock()
+        slept = 0
+        state = self.state
+
+        if state == SAMPLE:
+            self._take_sample()
+            if self.pending >= self.upload_every:
+                self.radio_on()
+                self.connect_start = self.clock()
+                self.state = CONNECT
+            else:
+                self.state = SLEEP
+
+        elif state == CONNECT:
+            if self.radio_ready():
+                self.state = UPLOAD
+            elif ticks_diff(self.clock(), self.connect_start) >= self.connect_timeout:
+                # Keep the samples and try again after the next one
+                self.radio_off()
+                self.upload_failures += 1
+                self.state = SLEEP
+            elif self.until_next_sample() <= 0:
+                self._take_sample()
+            else:
+                self.wait(min(100, self.until_next_sample()))
+
+        elif state == UPLOAD:
+            ok = self.upload()
+            self.radio_off()
+            if ok:
+                self.pending = 0
+                self.uploads += 1
+            else:
+                self.upload_failures += 1
+            self.state = SLEEP
+
+        else:
+            ms = self.until_next_sample()
+            if ms > 0:
+                before = self.clock()
+                self.sleep(ms)
+                slept = ticks_diff(self.clock(), before)
+                self.asleep_ms += slept
+            self.state = SAMPLE
+
+        self.awake_ms += ticks_diff(self.clock(), start) - slept
+        return state
+
+    def duty_cycle(self):
+        """Percent of time awake"""
+        total = self.awake_ms + self.asleep_ms
+        return self.awake_ms * 100 / total if total else 100
+
+    def report(self):
+        print("Power: {:.1f}% awake ({} ms awake, {} ms asleep), {} uploads, {} failed, {} pending".format(
+            self.duty_cycle(), self.awake_ms, self.asleep_ms, self.uploads, self.upload_failures, self.pending))
@@ -0,0 +1,231 @@
+"""
+Simulated-clock checks for power.py and the firmware's deep-sleep RTC record
+- Duty cycle: sample / sleep / connect / upload with set costs gives the expected
+  awake share, samples stay on their grid, samples due while connecting are taken
+- Connect timeout keeps the samples and retries; restore() resumes the cadence
+- lp_sleep: light sleep below DEEP_MIN_MS, deep sleep (minus the wake advance) above it
+- rtc_save / rtc_restore round trip around RTC_MAX_RECORDS (63, 64, 65, 200 pending,
+  ring wrapped), record fits the 2 KB of RTC user memory
+- Usage: python power_check.py   (exits non-zero if a check fails)
+"""
+
+import struct
+import sys
+
+import heap_budget
+from heap_budget import FakeTime, load_firmware
+from host_stubs import Machine, RTC
+from power import PowerManager, SAMPLE, CONNECT
+
+SAMPLE_COST = 120     # ms awake per PZEM read
+CONNECT_COST = 1500   # ms from radio on to associated
+UPLOAD_COST = 2000    # ms per batched upload
+RTC_USER_MEM = 2048
+failed = []
+
+
+def check(name, ok):
+    print("  %-56s %s" % (name, "ok" if ok else "FAIL"))
+    if not ok:
+        failed.append(name)
+
+
+class Sim:
+    """Clock plus the callbacks PowerManager drives"""
+    def __init__(self):
+        self.ms = 0
+        self.stamps = []
+        self.sample_times = []
+        self.radio_at = None
+        self.ap_up = True
+        self.upload_ok = True
+        self.upload_cost = UPLOAD_COST
+        self.uploads = []
+
+    def clock(self):
+        return self.ms
+
+    def sleep(self, ms):
+        self.ms += ms
+
+    def sample(self, stamp):
+        self.stamps.append(stamp)
+        self.sample_times.append(self.ms)
+        self.ms += SAMPLE_COST
+
+    def upload(self):
+        self.uploads.append(self.ms)
+        self.ms += self.upload_cost
+        return self.upload_ok
+
+    def radio_on(self):
+        self.radio_at = self.ms
+
+    def radio_off(self):
+        self.radio_at = None
+
+    def radio_ready(self):
+        return self.ap_up and self.radio_at is not None and self.ms - self.radio_at >= CONNECT_COST
+
+    def manager(self, sample_ms, every, **kwargs):
+        return PowerManager(sample_ms, every, self.sample, self.upload, self.radio_on, self.radio_off,
+                            self.radio_ready, sleep=self.sleep, wait=self.sleep, clock=self.clock, **kwargs)
+
+
+def run(pm, sim, ms):
+    end = sim.ms + ms
+    while sim.ms < end:
+        pm.step()
+
+
+def duty_checks():
+    print("Duty cycle (10 s samples, upload every 6):")
+    sim = Sim()
+    pm = sim.manager(10000, 6)
+    run(pm, sim, 3600 * 1000)
+    # Per minute: 6 reads + connect + upload awake, the rest asleep
+    expected = (6 * SAMPLE_COST + CONNECT_COST + UPLOAD_COST) * 100 / 60000
+    check("awake share %.2f%% (expected %.2f%%)" % (pm.duty_cycle(), expected),
+          abs(pm.duty_cycle() - expected) < 0.05)
+    check("awake + asleep == simulated time", pm.awake_ms + pm.asleep_ms == sim.ms)
+    check("samples on the 10 s grid", all(s == i * 10000 for i, s in enumerate(sim.stamps)))
+    check("sampled when due, also while connecting", all(t == s for t, s in zip(sim.sample_times, sim.stamps)))
+    check("one upload per 6 samples", pm.uploads == len(sim.stamps) // 6 and pm.upload_failures == 0)
+
+    print("Connecting overlaps samples (1 s samples, upload every 6, 500 ms upload):")
+    sim = Sim()
+    sim.upload_cost = 500
+    pm = sim.manager(1000, 6)
+    states = []
+    end = 30000
+    while sim.ms < end:
+        states.append(pm.step())
+    check("samples taken during CONNECT", sum(1 for a, b in zip(states, states[1:])
+                                              if a == CONNECT and b == CONNECT) > 0
+          and 6000 in sim.sample_times)
+    check("no sample later than one read", all(t - s <= SAMPLE_COST for t, s in zip(sim.sample_times, sim.stamps)))
+    check("no sample slot skipped", [s // 1000 for s in sim.stamps] == list(range(len(sim.stamps))))
+    check("uploads carry the samples taken while connecting", pm.pending < 6 and pm.uploads >= 4)
+
+    print("Connect timeout:")
+    sim = Sim()
+    sim.ap_up = False
+    pm = sim.manager(5000, 3, connect_timeout=4000)
+    run(pm, sim, 60000)
+    check("upload never attempted, failures counted", not sim.uploads and pm.upload_failures >= 3)
+    check("samples kept and still on the grid", pm.pending == len(sim.stamps)
+          and all(s % 5000 == 0 for s in sim.stamps))
+    sim.ap_up = True
+    run(pm, sim, 20000)
+    check("next attempt after the AP is back uploads them", pm.uploads >= 1 and pm.pending < 3)
+
+    print("Restore after deep sleep:")
+    sim = Sim()
+    sim.ms = 123456
+    pm = sim.manager(5000, 6)
+    pm.restore(4, 900, 40000, next_in=2500)
+    check("counters restored, sleeps until the saved slot", pm.pending == 4 and pm.state != SAMPLE
+          and pm.until_next_sample() == 2500)
+    pm.step()
+    pm.step()
+    check("first sample at the saved slot", sim.stamps == [125956] and sim.ms == 125956 + SAMPLE_COST)
+    pm = sim.manager(5000, 6)
+    pm.restore(4, 900, 40000, next_in=0)
+    check("slot already due: samples at once", pm.state == SAMPLE)
+
+
+def fill(fw, records):
+    for k in range(records):
+        fw["history_record"]([2300 + k % 50, k & 0xFFFF, k >> 16, k, 0, k * 3, 0, 500, k % 100, 0])
+
+
+def clear_history(fw):
+    for i in range(len(fw["hist"])):
+        fw["hist"][i] = 0
+    fw["hist_head"] = fw["hist_count"] = fw["hist_seq"] = fw["upload_seq"] = 0
+
+
+def last_records(fw, n):
+    hist, size, fields = fw["hist"], fw["HIST_SIZE"], fw["HIST_FIELDS"]
+    out = []
+    for k in range(n):
+        i = ((fw["hist_head"] - n + k) % size) * fields
+        out.append(tuple(hist[i:i + fields]))
+    return out
+
+
+def rtc_checks():
+    fw = load_firmware()
+    limit = fw["RTC_MAX_RECORDS"]
+    fields = fw["HIST_FIELDS"]
+    print("lp_sleep:")
+    slept = []
+    Machine.sleep = slept.append
+    fw["POWER_MODE"] = "deep"
+    sim = Sim()
+    fw["power_mgr"] = sim.manager(5000, 6)
+    fw["lp_sleep"](fw["DEEP_MIN_MS"] - 1)
+    check("short sleep is a light sleep", slept == [fw["DEEP_MIN_MS"] - 1])
+    try:
+        fw["lp_sleep"](10000)
+        msg = ""
+    except SystemExit as e:
+        msg = str(e)
+    check("long sleep saves to RTC, deep-sleeps minus the wake advance",
+          msg == "machine.deepsleep(%d)" % (10000 - fw["DEEP_WAKE_ADVANCE_MS"]) and RTC._mem)
+    fw["POWER_MODE"] = "light"
+    del slept[:]
+    fw["lp_sleep"](10000)
+    check("light mode never deep-sleeps", slept == [10000])
+
+    print("RTC record round trip (RTC_MAX_RECORDS = %d):" % limit)
+    for pending, total in ((limit - 1, 300), (limit, 300), (limit + 1, 300), (200, 300),
+                           (limit, fw["HIST_SIZE"] + 10)):
+        clear_history(fw)
+        FakeTime.sleep_ms(1000)
+        fill(fw, total)
+        fw["upload_seq"] = total - pending
+        pm = sim.manager(5000, 6)
+        pm.pending, pm.awake_ms, pm.asleep_ms = 5, 1234, 56789
+        fw["power_mgr"] = pm
+        kept = min(pending, limit)
+        expect = last_records(fw, kept)
+        seq = fw["hist_seq"]
+        fw["rtc_save"](8000)
+        size = len(RTC._mem)
+
+        clear_history(fw)
+        Machine.cause = Machine.DEEPSLEEP_RESET
+        heap_budget._now += 8000 - fw["DEEP_WAKE_ADVANCE_MS"]
+        saved = fw["rtc_restore"]()
+        Machine.cause = Machine.PWRON_RESET
+        label = "%d pending%s" % (pending, ", ring wrapped" if total > fw["HIST_SIZE"] else "")
+        check("%s: last %d records back" % (label, kept),
+              fw["hist_count"] == kept and last_records(fw, kept) == expect)
+        check("%s: seq and upload cursor" % label,
+              fw["hist_seq"] == seq and fw["upload_seq"] == seq - kept)
+        check("%s: counters, next sample in ~%d ms" % (label, fw["DEEP_WAKE_ADVANCE_MS"]),
+              saved is not None and saved[:3] == (5, 1234, 56789 + 8000)
+              and 0 <= saved[3] <= fw["DEEP_WAKE_ADVANCE_MS"] + 1000)
+        check("%s: %d bytes, fits RTC memory" % (label, size),
+              size == struct.calcsize(fw["RTC_HEADER"]) + 8 + kept * fields * 4 and size <= RTC_USER_MEM)
+
+    print("Cold boot:")
+    check("no restore unless woken from deep sleep", fw["rtc_restore"]() is None)
+    RTC._mem = b"\x00" * 64
+    Machine.cause = Machine.DEEPSLEEP_RESET
+    check("bad magic ignored", fw["rtc_restore"]() is None)
+    Machine.cause = Machine.PWRON_RESET
+
+
+def main():
+    duty_checks()
+    rtc_checks()
+    if failed:
+        print("FAIL:", ", ".join(failed))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Per-stage loop profiler for the PZEM firmware
+- Opt-in: start()/stop() return straight away unless enabled is set
+- Per stage: count, min/avg/max/p95 time in us, heap allocated
+- All numbers live in one preallocated array, recording never allocates
+- p95 comes from power-of-two buckets (64 us .. 2 s), so it is an upper bound
+- report() for the serial console, as_dict() for /api/profile
+- Allocation is read from gc.mem_alloc(), which is heap-wide: with the sampling thread
+  running (shared = True) a stage's bytes include whatever the other thread allocated
+  meanwhile, so they are an upper bound; times are per stage either way
+"""
+
+from array import array
+from micropython import const
+import time
+import gc
+
+enabled = False
+# Set when a second thread allocates alongside the profiled stages
+shared = False
+
+# ============== Stages ==============
+WEB = const(0)
+PZEM = const(1)
+LCD = const(2)
+SEND = const(3)
+GC = const(4)
+STAGES = ("web", "pzem", "lcd", "send", "gc")
+
+# ============== Layout ==============
+# Per stage: count, total us, min us, max us, alloc bytes, max alloc, then the buckets
+_COUNT = const(0)
+_TOTAL = const(1)
+_MIN = const(2)
+_MAX = const(3)
+_ALLOC = const(4)
+_ALLOC_MAX = const(5)
+_HIST = const(6)
+_BUCKET_SHIFT = const(6)    # first bucket is <= 64 us
+_BUCKETS = const(17)        # 16 power-of-two bounds up to ~2 s, then overflow
+_STRIDE = const(23)         # _HIST + _BUCKETS
+
+_p = array('l', [0] * (_STRIDE * len(STAGES)))
+_t0 = array('l', [0] * len(STAGES))
+_a0 = array('l', [0] * len(STAGES))
+
+# ============== Recording ==============
+def start(stage):
+    if not enabled:
+        return
+    _a0[stage] = gc.mem_alloc()
+    _t0[stage] = time.ticks_us()
+
+def stop(stage):
+    if not enabled:
+        return
+    us = time.ticks_diff(time.ticks_us(), _t0[stage])
+    # A collection inside the stage makes the delta negative; count it as no allocation
+    alloc = max(0, gc.mem_alloc() - _a0[stage])
+    base = stage * _STRIDE
+    n = _p[base + _COUNT]
+    _p[base + _COUNT] = n + 1
+    _p[base + _TOTAL] += us
+    if n == 0 or us < _p[base + _MIN]:
+        _p[base + _MIN] = us
+    if us > _p[base + _MAX]:
+        _p[base + _MAX] = us
+    _p[base + _ALLOC] += alloc
+    if alloc > _p[base + _ALLOC_MAX]:
+        _p[base + _ALLOC_MAX] = alloc
+    i = 0
+    bound = 1 << _BUCKET_SHIFT
+    while i < _BUCKETS - 1 and us > bound:
+        i += 1
+        bound <<= 1
+    _p[base + _HIST + i] += 1
+
+def reset():
+    for i in range(len(_p)):
+        _p[i] = 0
+
+# ============== Reporting ==============
+def p95(stage):
+    """Upper bound of the bucket holding the 95th percentile (capped at max), in us; -1 if beyond 2 s"""
+    base = stage * _STRIDE
+    n = _p[base + _COUNT]
+    if not n:
+        return 0
+    need = (n * 95 + 99) // 100
+    total = 0
+    for i in range(_BUCKETS):
+        total += _p[base + _HIST + i]
+        if total >= need:
+            if i == _BUCKETS - 1:
+                return -1
+            return min(1 << (_BUCKET_SHIFT + i), _p[base + _MAX])
+    return -1
+
+def stats(stage):
+    """(count, min, avg, max, p95) in us and (alloc total, alloc avg, alloc max) in bytes"""
+    base = stage * _STRIDE
+    n = _p[base + _COUNT]
+    if not n:
+        return (0, 0, 0, 0, 0, 0, 0, 0)
+    return (n, _p[base + _MIN], _p[base + _TOTAL] // n, _p[base + _MAX], p95(stage),
+            _p[base + _ALLOC], _p[base + _ALLOC] // n, _p[base + _ALLOC_MAX])
+
+def as_dict():
+    out = {"enabled": enabled, "alloc_scope": "heap" if shared else "stage"}
+    for stage in range(len(STAGES)):
+        n, lo, avg, hi, p, alloc, alloc_avg, alloc_max = stats(stage)
+        out[STAGES[stage]] = {"count": n, "min_us": lo, "avg_us": avg, "max_us": hi, "p95_us": p,
+                              "alloc_bytes": alloc, "alloc_avg": alloc_avg, "alloc_max": alloc_max}
+    return out
+
+def report(write=None):
+    """Print a table of all stages (or send it through write(str))"""
+    if write is None:
+        write = lambda s: print(s, end="")
+    write("Profile ({}):\n".format("on" if enabled else "off"))
+    write("  {:<6} {:>7} {:>8} {:>8} {:>8} {:>8} {:>9} {:>8}\n".format(
+        "stage", "count", "min us", "avg us", "p95 us", "max us", "avg B", "max B"))
+    for stage in range(len(STAGES)):
+        n, lo, avg, hi, p, alloc, alloc_avg, alloc_max = stats(stage)
+        write("  {:<6} {:>7} {:>8} {:>8} {:>8} {:>8} {:>9} {:>8}\n".format(
+            STAGES[stage], n, lo, avg, p if p >= 0 else ">2s", hi, alloc_avg, alloc_max))
+    if shared:
+        write("  (B columns include allocations of the sampling thread)\n")
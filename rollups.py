@@ -0,0 +1,387 @@
+"""
+Continuous rollups of the electric table: 1m, 5m, 15m, 1h, 6h and 1d buckets
+- Per device, meter (mcid) and bucket: count, min/max/sum of volt, amp, pf and power (volt * amp, as
+  getData.php charts it) plus the first and last energy reading with their times
+- Maintained as rows arrive: each group commit folds its batch into every level,
+  one upsert per touched bucket, inside the same transaction as the raw rows
+- Tables from an older layout (electric_rollup_layout) are dropped and rebuilt on open
+- Counts and sums rather than averages, so late rows (backlog uploads with ts) merge exactly
+- Buckets are local-time DATETIME text like the timestamp column, so days end at local midnight
+- Energy per bucket = its last reading minus the previous bucket's last (after a counter
+  reset, the reading itself)
+- pick_level() gives the finest level with no more buckets in the window than the
+  chart has points (fewer rows than raw at every range); chart_query.py uses it
+- Usage: python rollups.py --rebuild [--db sqlite:electric.db]   (backfill from electric)
+         python rollups.py --bench [--rows 10000000] [--devices 20]
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from electric_db import ElectricDB, format_time
+
+# name, seconds, timestamp prefix kept, step of its last field (minutes or hours);
+# each level nests in the one before, so it is folded from it
+LEVELS = (
+    ("1m", 60, 16, 1),
+    ("5m", 300, 16, 5),
+    ("15m", 900, 16, 15),
+    ("1h", 3600, 13, 1),
+    ("6h", 21600, 13, 6),
+    ("1d", 86400, 10, 1),
+)
+# Padding back to a full DATETIME after a prefix
+PAD = {16: ":00", 13: ":00:00", 10: " 00:00:00"}
+# Bumped when the tables change shape; older ones are rebuilt on open
+LAYOUT = 2
+SERIES = ("volt", "amp", "pf", "power")
+# Aggregate layout, after (devid, mcid, bucket)
+AGG = ("n",) + tuple(s + k for s in SERIES for k in ("_min", "_max", "_sum")) + (
+    "t_first", "energy_first", "t_last", "energy_last")
+
+
+def bucket_of(ts, width, step):
+    """Start of the bucket holding DATETIME text ts"""
+    if step > 1:
+        v = int(ts[width - 2:width])
+        return "%s%02d%s" % (ts[:width - 2], v - v % step, PAD[width])
+    return ts[:width] + PAD[width]
+
+
+def pick_level(span_s, points, sample_s=60):
+    """Finest rollup with at most `points` buckets in span_s, or None for raw rows.
+    sample_s is the devices' upload interval (the firmware's default send_interval):
+    raw rows are read while the window holds no more of them than points, and a level
+    with more buckets than points reads more rows than the chart needs."""
+    if span_s / sample_s <= points:
+        return None
+    for name, seconds, _, _ in LEVELS:
+        if seconds > sample_s and span_s / seconds <= points:
+            return name
+    return LEVELS[-1][0]
+
+
+# ============== Aggregation ==============
+def aggregate(rows):
+    """Electric rows (devid, mcid, amp, volt, pf, energy, timestamp) -> {(devid, mcid, 1m bucket): AGG list}"""
+    out = {}
+    for devid, mcid, amp, volt, pf, energy, ts in rows:
+        ts = str(ts)
+        key = (devid, mcid, ts[:16] + ":00")
+        power = volt * amp
+        a = out.get(key)
+        if a is None:
+            out[key] = [1, volt, volt, volt, amp, amp, amp, pf, pf, pf,
+                        power, power, power, ts, energy, ts, energy]
+            continue
+        a[0] += 1
+        for i, v in ((1, volt), (4, amp), (7, pf), (10, power)):
+            if v < a[i]:
+                a[i] = v
+            if v > a[i + 1]:
+                a[i + 1] = v
+            a[i + 2] += v
+        if ts < a[13]:
+            a[13] = ts
+            a[14] = energy
+        if ts >= a[15]:
+            a[15] = ts
+            a[16] = energy
+    return out
+
+
+def fold(aggs, width, step):
+    """Merge finer buckets into the coarser ones holding them (see bucket_of)"""
+    out = {}
+    for (devid, mcid, bucket), b in aggs.items():
+        key = (devid, mcid, bucket_of(bucket, width, step))
+        a = out.get(key)
+        if a is None:
+            out[key] = list(b)
+            continue
+        a[0] += b[0]
+        for i in (1, 4, 7, 10):
+            if b[i] < a[i]:
+                a[i] = b[i]
+            if b[i + 1] > a[i + 1]:
+                a[i + 1] = b[i + 1]
+            a[i + 2] += b[i + 2]
+        if b[13] < a[13]:
+            a[13] = b[13]
+            a[14] = b[14]
+        if b[15] >= a[15]:
+            a[15] = b[15]
+            a[16] = b[16]
+    return out
+
+
+# ============== Extension ==============
+class Rollups:
+    """ElectricDB extension: db.extend("rollups", Rollups(db))"""
+    def __init__(self, db):
+        self.db = db
+        self.upsert_sql = {}
+        self.buckets = 0
+
+    def schema(self, kind):
+        return ["CREATE TABLE IF NOT EXISTS electric_rollup_layout (version INTEGER NOT NULL)"] + [
+            self._table(kind, name) for name, _, _, _ in LEVELS]
+
+    def _table(self, kind, name):
+        real = "REAL" if kind == "sqlite" else "DOUBLE"
+        cols = ",\n    ".join("{} {}".format(c, "INTEGER" if c == "n" else "DATETIME" if c.startswith("t_")
+                                            else real) for c in AGG)
+        # Clustered on (devid, bucket): a chart range is one contiguous read. mcid is
+        # last: a device's meters have separate energy counters, so separate buckets
+        tail = " WITHOUT ROWID" if kind == "sqlite" else ""
+        return ("CREATE TABLE IF NOT EXISTS electric_{} (\n    devid VARCHAR(50) NOT NULL,\n"
+                "    mcid VARCHAR(50) NOT NULL,\n    bucket DATETIME NOT NULL,\n    {},\n"
+                "    PRIMARY KEY (devid, bucket, mcid)\n){}".format(name, cols, tail))
+
+    def on_open(self, conn):
+        """Rebuild the tables if they were made by an older layout (or rollups are new to this db)"""
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT MAX(version) FROM electric_rollup_layout")
+            version = cur.fetchone()[0]
+            if version == LAYOUT:
+                return
+            print("Rollup layout {} -> {}: rebuilding".format(version, LAYOUT))
+            for name, _, _, _ in LEVELS:
+                cur.execute("DROP TABLE IF EXISTS electric_" + name)
+                cur.execute(self._table(self.db.kind, name))
+            cur.execute("DELETE FROM electric_rollup_layout")
+            cur.execute("INSERT INTO electric_rollup_layout (version) VALUES ({})".format(self.db.mark), (LAYOUT,))
+            conn.commit()
+        finally:
+            cur.close()
+        self._rebuild(conn)
+
+    def _upsert(self, name):
+        sql = self.upsert_sql.get(name)
+        if sql:
+            return sql
+        db = self.db
+        cols = ("devid", "mcid", "bucket") + AGG
+        if db.kind == "sqlite":
+            new = "excluded.{}".format
+            lo, hi, head = "MIN", "MAX", "ON CONFLICT(devid, bucket, mcid) DO UPDATE SET"
+        else:
+            new = "VALUES({})".format
+            lo, hi, head = "LEAST", "GREATEST", "ON DUPLICATE KEY UPDATE"
+        # MySQL assigns left to right, so everything reading t_first/t_last comes first
+        sets = [
+            "energy_first = CASE WHEN {} < t_first THEN {} ELSE energy_first END".format(new("t_first"), new("energy_first")),
+            "energy_last = CASE WHEN {} >= t_last THEN {} ELSE energy_last END".format(new("t_last"), new("energy_last")),
+            "t_first = {}(t_first, {})".format(lo, new("t_first")),
+            "t_last = {}(t_last, {})".format(hi, new("t_last")),
+            "n = n + {}".format(new("n")),
+        ]
+        for s in SERIES:
+            sets.append("{0}_min = {1}({0}_min, {2})".format(s, lo, new(s + "_min")))
+            sets.append("{0}_max = {1}({0}_max, {2})".format(s, hi, new(s + "_max")))
+            sets.append("{0}_sum = {0}_sum + {1}".format(s, new(s + "_sum")))
+        sql = "INSERT INTO electric_{} ({}) VALUES ({}) {} {}".format(
+            name, ", ".join(cols), ", ".join([db.mark] * len(cols)), head, ", ".join(sets))
+        self.upsert_sql[name] = sql
+        return sql
+
+    def on_insert(self, cur, rows):
+        aggs = aggregate(rows)
+        for name, _, width, step in LEVELS:
+            if name != "1m":
+                aggs = fold(aggs, width, step)
+            cur.executemany(self._upsert(name), [key + tuple(a) for key, a in aggs.items()])
+            self.buckets += len(aggs)
+
+    # ============== Backfill ==============
+    def _rebuild(self, conn, chunk=100000):
+        cur = conn.cursor()
+        try:
+            for name, _, _, _ in LEVELS:
+                cur.execute("DELETE FROM electric_" + name)
+            last = 0
+            total = 0
+            sql = ("SELECT id, devid, mcid, amp, volt, pf, energy, timestamp FROM electric "
+                   "WHERE id > {0} ORDER BY id LIMIT {0}").format(self.db.mark)
+            while True:
+                cur.execute(sql, (last, chunk))
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                last = rows[-1][0]
+                total += len(rows)
+                self.on_insert(cur, [r[1:] for r in rows])
+            conn.commit()
+            return total
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+    async def rebuild(self):
+        """Recompute every level from electric (run with ingest stopped)"""
+        return await self.db.run(self._rebuild)
+
+    # ============== Query ==============
+    def _select(self, conn, name, devid, since):
+        width, step = [(w, s) for n, _, w, s in LEVELS if n == name][0]
+        mark = self.db.mark
+        sql = ("SELECT devid, mcid, bucket, n, " + ", ".join(s + k for s in SERIES for k in ("_min", "_max", "_sum"))
+               + ", energy_first, energy_last FROM electric_" + name + " WHERE bucket >= " + mark)
+        # The bucket holding since starts before it
+        args = [bucket_of(since, width, step)]
+        if devid:
+            sql += " AND devid = " + mark
+            args.append(devid)
+        cur = conn.cursor()
+        try:
+            cur.execute(sql + " ORDER BY devid, mcid, bucket", args)
+            return cur.fetchall()
+        finally:
+            cur.close()
+
+    async def select(self, name, devid, since):
+        return await self.db.run(self._select, name, devid, since)
+
+
+def columns(rows):
+    """Rollup rows -> chart columns (averages, min/max, energy and energy_delta), one entry per bucket;
+    with several devices (or meters), buckets are combined across them"""
+    n = len(rows)
+    if not n:
+        empty = np.empty(0)
+        cols = {"t": np.empty(0, dtype="datetime64[s]"), "energy_delta": empty, "min": {}, "max": {}}
+        for k in ("voltage", "current", "pf", "energy", "power"):
+            cols[k] = empty
+        return cols
+    devs = np.array([r[0] + "\0" + r[1] for r in rows], dtype=object)
+    t = np.array([r[2] for r in rows]).astype("datetime64[s]")
+    v = np.array([r[3:] for r in rows], dtype=np.float64)
+    count = v[:, 0]
+    first = v[:, -2]
+    last = v[:, -1]
+
+    # Rows are ordered by device, meter, bucket: delta against the previous bucket of the same meter
+    prev = np.empty(n)
+    prev[1:] = last[:-1]
+    start = np.ones(n, dtype=bool)
+    start[1:] = devs[1:] != devs[:-1]
+    prev[start] = first[start]
+    delta = last - prev
+    delta[delta < 0] = last[delta < 0]
+
+    if start.sum() > 1:
+        # Fleet: one entry per bucket over all devices
+        t, inv = np.unique(t, return_inverse=True)
+        m = len(t)
+        cnt = np.bincount(inv, count, m)
+        out = {"t": t, "energy": np.bincount(inv, last, m), "energy_delta": np.bincount(inv, delta, m),
+               "min": {}, "max": {}}
+        for j, (s, name) in enumerate(zip(SERIES, ("voltage", "current", "pf", "power"))):
+            lo = np.full(m, np.inf)
+            hi = np.full(m, -np.inf)
+            np.minimum.at(lo, inv, v[:, 1 + 3 * j])
+            np.maximum.at(hi, inv, v[:, 2 + 3 * j])
+            out[name] = np.bincount(inv, v[:, 3 + 3 * j], m) / cnt
+            out["min"][name] = lo
+            out["max"][name] = hi
+        return out
+
+    out = {"t": t, "energy": last, "energy_delta": delta, "min": {}, "max": {}}
+    for j, name in enumerate(("voltage", "current", "pf", "power")):
+        out[name] = v[:, 3 + 3 * j] / count
+        out["min"][name] = v[:, 1 + 3 * j]
+        out["max"][name] = v[:, 2 + 3 * j]
+    return out
+
+
+# ============== Benchmark ==============
+def synthetic_rows(start, count, devices, step=60):
+    """count rows for `devices` devices sampling every step s from start, in time order"""
+    rng = np.random.default_rng(start)
+    dev = np.arange(count) % devices
+    t = start + (np.arange(count) // devices) * step
+    amp = np.clip(rng.uniform(0.2, 12) + rng.normal(0, 0.5, count), 0, None)
+    volt = 230 + rng.normal(0, 2, count)
+    pf = np.clip(0.9 + rng.normal(0, 0.03, count), 0, 1)
+    energy = t / 3600.0 * (1 + dev)
+    offset = time.localtime(start).tm_gmtoff
+    stamps = np.char.replace(np.datetime_as_string((t + offset).astype("datetime64[s]")), "T", " ")
+    names = ["e%03d" % d for d in range(devices)]
+    return list(zip([names[d] for d in dev.tolist()], ["m-001"] * count, amp.tolist(), volt.tolist(),
+                    pf.tolist(), energy.tolist(), stamps.tolist()))
+
+
+async def bench(rows, devices, chunk=50000):
+    import chart_query
+    with tempfile.TemporaryDirectory() as tmp:
+        db = ElectricDB("sqlite:" + os.path.join(tmp, "bench.db"))
+        ext = db.extend("rollups", Rollups(db))
+        await db.open()
+        span = rows // devices * 60
+        start = int(time.time()) - span
+        insert_s = 0.0
+        for i in range(0, rows, chunk):
+            batch = synthetic_rows(start + (i // devices) * 60, min(chunk, rows - i), devices)
+            t1 = time.perf_counter()
+            await db.insert_many(batch)
+            insert_s += time.perf_counter() - t1
+        print("ingest %d rows (%d devices) with rollups: %.0f rows/s, %d bucket upserts" % (
+            rows, devices, rows / insert_s, ext.buckets))
+        for name, _, _, _ in LEVELS:
+            print("  electric_%s: %d rows" % (name, (await db.run(
+                lambda c: c.execute("SELECT COUNT(*) FROM electric_" + name).fetchone()))[0]))
+
+        print("%-10s %12s %12s %8s  %s" % ("range", "raw ms", "rollup ms", "level", "points"))
+        for hours in (24, 24 * 7, 24 * 30, 24 * 365):
+            if hours * 3600 > span:
+                continue
+            since = format_time(time.time() - hours * 3600)
+            t1 = time.perf_counter()
+            got = await db.window("e001", since)
+            raw = chart_query.build(got, 500)
+            raw_ms = (time.perf_counter() - t1) * 1000
+            level = pick_level(hours * 3600, 500)
+            t1 = time.perf_counter()
+            data = await chart_query.get_data(db, {"hours": str(hours), "devid": "e001"})
+            roll_ms = (time.perf_counter() - t1) * 1000
+            print("%-10s %12.1f %12.1f %8s  %d raw rows -> %d" % (
+                "%dh" % hours, raw_ms, roll_ms, level or "raw", raw["total"], data["count"]))
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rollup tables for the electric series")
+    parser.add_argument('--db', default="sqlite:electric.db")
+    parser.add_argument('--rebuild', action='store_true', help="backfill all levels from electric")
+    parser.add_argument('--bench', action='store_true')
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--devices', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.bench:
+        asyncio.run(bench(args.rows, args.devices))
+    elif args.rebuild:
+        async def run():
+            db = ElectricDB(args.db, 1)
+            ext = db.extend("rollups", Rollups(db))
+            await db.open()
+            t0 = time.perf_counter()
+            n = await ext.rebuild()
+            print("Rebuilt rollups from %d rows in %.1f s (%d bucket upserts)" % (
+                n, time.perf_counter() - t0, ext.buckets))
+            db.close()
+        asyncio.run(run())
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Timer-driven sampling checks for webhook-iot.py on a virtual clock
+- Loads the firmware with heap_budget.py's fakes and starts sampling with
+  sample_timer_start(): fake Timer -> sample_isr -> micropython.schedule -> sample_trigger
+- Idle web loop: every timer tick gives one sample, stamped with its scheduled tick
+- Busy web loop: requests that take 1.2 s run while the timer keeps firing;
+  the callbacks run in the middle of the request, ticks that land in it are
+  coalesced into one late sample and counted, sampling stays on the tick grid
+- Hostile interleaving: timer callbacks also run inside the scheduler's heap
+  comparisons (mid sift / push / pop); the heap stays valid and no task is lost
+- Usage: python sample_timer_check.py   (exits non-zero if a check fails)
+"""
+
+import random
+import sys
+import time
+
+import heap_budget
+from heap_budget import FakeTime, load_firmware, setup
+import host_stubs
+import metrics
+from scheduler import PERIODIC, ONESHOT
+
+BUSY_MS = 1200
+TICK_MS = 500
+failed = []
+
+
+def check(name, ok):
+    print("  %-56s %s" % (name, "ok" if ok else "FAIL"))
+    if not ok:
+        failed.append(name)
+
+
+class BusyPoller:
+    """A web client is waiting whenever the loop looks"""
+    def ipoll(self, ms):
+        FakeTime.sleep_ms(1)
+        return (1,)
+
+
+def slow_handler(handle):
+    """handle_web_client() that takes BUSY_MS; timer callbacks run during it"""
+    def run():
+        handle()
+        for _ in range(BUSY_MS // 10):
+            FakeTime.sleep_ms(10)
+    return run
+
+
+def heap_ok(sched):
+    heap = sched.heap
+    for i in range(1, len(heap)):
+        if time.ticks_diff(heap[i].due, heap[(i - 1) // 2].due) < 0:
+            return False
+    return True
+
+
+def sampled(fw, stamps):
+    """Wrap the firmware's task_sample to record the tick each reading is stamped with"""
+    inner = fw["task_sample"]
+
+    def run():
+        inner()
+        stamps.append(fw["pzem_stamp"])
+    fw["task_sample"] = run
+
+
+def main():
+    fw = load_firmware()
+    stamps = []
+    sampled(fw, stamps)
+    # Fast ticks (a PZEM read itself takes 100 ms) so one request spans several of them
+    fw["pzem_read_interval"] = TICK_MS
+    sched = setup(fw)
+    timer = fw["sample_timer"]
+    interval = fw["pzem_read_interval"]
+    task = fw["sample_task"]
+
+    print("Idle web loop:")
+    for _ in range(400):
+        sched.run_once()
+    fired = timer.fired
+    check("timer is what drives sampling", task.kind == ONESHOT and fired > 50)
+    check("one sample per timer tick", len(stamps) in (fired, fired + 1))
+    check("stamps are consecutive ticks", all(time.ticks_diff(b, a) == interval
+                                              for a, b in zip(stamps, stamps[1:])))
+    check("sample jitter within 1 ms", task.max_jitter <= 1)
+
+    print("Busy web loop (%d ms per request, %d ms ticks):" % (BUSY_MS, interval))
+    fw["poller"] = BusyPoller()
+    fw["handle_web_client"] = slow_handler(fw["handle_web_client"])
+    del stamps[:]
+    fired0 = timer.fired
+    missed0 = task.missed
+    overruns0 = metrics._m[metrics.SAMPLE_OVERRUNS]
+    for _ in range(300):
+        sched.run_once()
+    fired = timer.fired - fired0
+    missed = task.missed - missed0
+    check("timer kept firing during requests", fired * interval >= 50 * BUSY_MS)
+    check("every tick sampled or counted as coalesced", len(stamps) + missed in (fired, fired + 1))
+    print("    fired %d, sampled %d, coalesced %d, overrun metric +%d" % (
+        fired, len(stamps), missed, metrics._m[metrics.SAMPLE_OVERRUNS] - overruns0))
+    check("coalesced ticks show in the overrun metric",
+          metrics._m[metrics.SAMPLE_OVERRUNS] - overruns0 == missed and missed > 0)
+    check("samples stamped on the tick grid", all(time.ticks_diff(b, a) % interval == 0
+                                                  for a, b in zip(stamps, stamps[1:])))
+    check("sample never later than one request", task.max_jitter <= BUSY_MS + interval)
+    check("heap intact, sample task queued at most once", heap_ok(sched) and sched.heap.count(task) <= 1)
+
+    print("Timer callbacks inside heap operations:")
+    fw["poller"] = heap_budget.FakePoller()
+    rng = random.Random(7)
+    before = sched._before
+
+    def hostile(a, b):
+        # Now and then time passes mid-comparison and due timer callbacks run right here
+        if rng.random() < 0.05:
+            heap_budget._now = time.ticks_add(heap_budget._now, rng.randint(0, interval // 10))
+            host_stubs.fire_timers(heap_budget._now)
+            host_stubs.run_scheduled()
+        return before(a, b)
+    sched._before = hostile
+    for i in range(60):
+        sched.every(rng.randint(2000, 20000), lambda: None, "t%d" % i, rng.randint(0, 5000))
+    del stamps[:]
+    fired0 = timer.fired
+    missed0 = task.missed
+    bad = 0
+    for _ in range(3000):
+        sched.run_once()
+        if not heap_ok(sched) or sched.heap.count(task) > 1:
+            bad += 1
+    fired = timer.fired - fired0
+    missed = task.missed - missed0
+    check("heap valid after every run_once", bad == 0)
+    queued = 1 if task.active else 0
+    print("    fired %d, sampled %d, coalesced %d, queued %d" % (fired, len(stamps), missed, queued))
+    check("no tick lost: samples + coalesced + queued == fired",
+          abs(len(stamps) + missed + queued - fired) <= 1)
+    check("most ticks still sampled", len(stamps) * 2 > fired)
+    periodic = [t for t in sched.tasks if t.kind == PERIODIC]
+    check("every periodic task still in the heap once", all(sched.heap.count(t) == 1 for t in periodic))
+
+    if failed:
+        print("FAIL:", ", ".join(failed))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Sampling thread for the second ESP32 core (opt-in, _thread)
+- Sampler owns the PZEM UART: only its thread calls read()
+- Readings go to the main thread through SampleRing, a lock-free single-producer
+  single-consumer ring in a preallocated array
+- The producer writes a record before publishing head, the consumer reads it
+  before advancing tail, so a record is never seen half written
+- A full ring drops the new reading and counts it; unread records are never overwritten
+- Runs unchanged on CPython threads (see stress_sampler.py)
+"""
+
+from array import array
+import _thread
+import time
+
+try:
+    ticks_ms = time.ticks_ms
+    ticks_add = time.ticks_add
+    ticks_diff = time.ticks_diff
+    sleep_ms = time.sleep_ms
+except AttributeError:
+    # CPython, for the stress test
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_add(t, delta):
+        return t + delta
+
+    def ticks_diff(a, b):
+        return a - b
+
+    def sleep_ms(ms):
+        time.sleep(ms / 1000)
+
+# ============== SPSC Ring ==============
+class SampleRing:
+    """Record = stamp followed by fields - 1 values, all uint32"""
+    def __init__(self, size, fields):
+        self.size = size
+        self.fields = fields
+        self.buf = array('I', [0] * (size * fields))
+        self.mv = memoryview(self.buf)
+        self.head = 0       # written only by the producer
+        self.tail = 0       # written only by the consumer
+        self.dropped = 0
+
+    def __len__(self):
+        return self.head - self.tail
+
+    # Producer side
+    def push(self, stamp, values):
+        h = self.head
+        if h - self.tail >= self.size:
+            self.dropped += 1
+            return False
+        buf = self.buf
+        i = (h % self.size) * self.fields
+        buf[i] = stamp
+        for k in range(self.fields - 1):
+            buf[i + 1 + k] = values[k]
+        # Publish only after the whole record is in place
+        self.head = h + 1
+        return True
+
+    # Consumer side
+    def peek(self):
+        """Index into buf of the oldest unread record, or -1 if empty"""
+        t = self.tail
+        if t == self.head:
+            return -1
+        return (t % self.size) * self.fields
+
+    def pop(self):
+        self.tail += 1
+
+# ============== Sampling Thread ==============
+class Sampler:
+    def __init__(self, read, ring, period, clock=ticks_ms, sleep=sleep_ms):
+        """read(stamp) runs on the sampler thread and returns the values or None"""
+        self.read = read
+        self.ring = ring
+        self.period = period
+        self.clock = clock
+        self.sleep = sleep
+        self.running = False
+        self._stop = False
+        self.samples = 0
+        self.failed = 0
+        self.overruns = 0
+
+    def start(self, stack=8192):
+        self._stop = False
+        self.running = True
+        try:
+            _thread.stack_size(stack)
+        except:
+            pass
+        _thread.start_new_thread(self._run, ())
+
+    def stop(self, timeout=5000):
+        """Ask the thread to finish its current sample and exit; True once it has"""
+        self._stop = True
+        start = self.clock()
+        while self.running and ticks_diff(self.clock(), start) < timeout:
+            self.sleep(10)
+        return not self.running
+
+    def _run(self):
+        due = self.clock()
+        try:
+            while not self._stop:
+                values = self.read(due)
+                if values is None:
+                    self.failed += 1
+                else:
+                    self.ring.push(due, values)
+                    self.samples += 1
+                due = ticks_add(due, self.period)
+                wait = ticks_diff(due, self.clock())
+                if wait > 0:
+                    self.sleep(wait)
+                elif wait < 0:
+                    # Fell a whole period behind: restart the cadence instead of bursting
+                    if self.period:
+                        self.overruns += 1
+                    due = self.clock()
+        finally:
+            self.running = False
+
+    def report(self):
+        print("Sampler: {} samples, {} failed, {} overruns, {} dropped, {} queued".format(
+            self.samples, self.failed, self.overruns, self.ring.dropped, len(self.ring)))
@@ -0,0 +1,245 @@
+"""
+Deterministic task scheduler for the PZEM firmware
+- Periodic, one-shot and deadline tasks in a min-heap ordered by due tick
+- On-demand tasks triggered from callbacks (e.g. a machine.Timer via micropython.schedule):
+  trigger() only sets fields, run_once() queues the task, so a callback that lands
+  in the middle of a heap operation cannot corrupt the heap
+- Sleeps (or waits on sockets) exactly until the next task is due
+- Per-task jitter, run time, overrun and miss counters
+- Clock and wait functions are injectable, so it runs on a virtual clock
+- Idle time is the time spent sleeping; a wait hook that also does work (e.g. serves
+  a web client) returns the ms it really slept and the rest counts as busy
+"""
+
+import time
+
+PERIODIC = 0
+ONESHOT = 1
+DEADLINE = 2
+
+class Task:
+    def __init__(self, name, fn, kind, due, period=0, deadline=0):
+        self.name = name
+        self.fn = fn
+        self.kind = kind
+        self.due = due
+        self.period = period
+        self.deadline = deadline
+        self.active = True
+        self.runs = 0
+        self.overruns = 0
+        self.missed = 0
+        self.jitter = 0
+        self.max_jitter = 0
+        self.last_run = 0
+        self.max_run = 0
+        # Written by trigger() (callback side) / _take_triggers() (main loop) only
+        self.triggered = 0
+        self.trigger_due = 0
+        self.consumed = 0
+
+class Scheduler:
+    def __init__(self, clock=time.ticks_ms, wait=time.sleep_ms):
+        self.clock = clock
+        self.wait = wait
+        self.heap = []
+        self.tasks = []
+        self.idle_ms = 0
+        self.busy_ms = 0
+        self.pending = False
+
+    # ============== Adding Tasks ==============
+    def every(self, period, fn, name, delay=0):
+        """Run fn every period ms at a fixed rate, first after delay ms"""
+        return self._add(Task(name, fn, PERIODIC, time.ticks_add(self.clock(), delay), period))
+
+    def after(self, delay, fn, name):
+        """Run fn once, delay ms from now"""
+        return self._add(Task(name, fn, ONESHOT, time.ticks_add(self.clock(), delay)))
+
+    def deadline(self, delay, within, fn, name):
+        """Run fn once after delay ms; drop it if it cannot start within `within` ms of that"""
+        return self._add(Task(name, fn, DEADLINE, time.ticks_add(self.clock(), delay), 0, within))
+
+    def on_demand(self, fn, name):
+        """Task that only runs when trigger() is called, e.g. from a timer callback"""
+        task = Task(name, fn, ONESHOT, self.clock())
+        task.active = False
+        self.tasks.append(task)
+        return task
+
+    def trigger(self, task, due=None):
+        """Make an on-demand task due at tick `due` (default now); jitter is measured from it.
+        Safe to call from a scheduled callback: the heap is left alone until run_once().
+        Returns False if the task was still waiting to run (the triggers are coalesced)."""
+        waiting = task.active or task.triggered != task.consumed
+        task.trigger_due = self.clock() if due is None else due
+        task.triggered += 1
+        self.pending = True
+        return not waiting
+
+    def cancel(self, task):
+        task.active = False
+
+    def reschedule(self, task, delay=0):
+        """Move a task's next run to delay ms from now (e.g. after its period changed)"""
+        if task in self.heap:
+            self.heap.remove(task)
+            self._heapify()
+        task.due = time.ticks_add(self.clock(), delay)
+        task.active = True
+        self._push(task)
+
+    def _take_triggers(self):
+        """Queue the tasks triggered since the last call (main loop only)"""
+        # Cleared first: a trigger landing during the scan sets it again for the next call
+        self.pending = False
+        for task in self.tasks:
+            n = task.triggered
+            if n == task.consumed:
+                continue
+            due = task.trigger_due
+            while n != task.triggered:
+                # Triggered again between the two reads: take the newer pair
+                n = task.triggered
+                due = task.trigger_due
+            coalesced = n - task.consumed - 1
+            task.consumed = n
+            task.due = due
+            if task.active:
+                # Still queued from an earlier trigger: that run takes the new due tick
+                coalesced += 1
+                self._heapify()
+            else:
+                task.active = True
+                self._push(task)
+            task.missed += coalesced
+
+    def _add(self, task):
+        if task.kind == PERIODIC:
+            if task.period <= 0:
+                raise ValueError("period must be > 0")
+            self.tasks.append(task)
+        self._push(task)
+        return task
+
+    # ============== Min-Heap (ticks_diff ordered, wrap safe) ==============
+    def _before(self, a, b):
+        return time.ticks_diff(a.due, b.due) < 0
+
+    def _push(self, task):
+        heap = self.heap
+        heap.append(task)
+        i = len(heap) - 1
+        while i:
+            parent = (i - 1) >> 1
+            if not self._before(heap[i], heap[parent]):
+                break
+            heap[i], heap[parent] = heap[parent], heap[i]
+            i = parent
+
+    def _pop(self):
+        heap = self.heap
+        top = heap[0]
+        last = heap.pop()
+        if heap:
+            heap[0] = last
+            self._sift_down(0)
+        return top
+
+    def _sift_down(self, i):
+        heap = self.heap
+        n = len(heap)
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and self._before(heap[child + 1], heap[child]):
+                child += 1
+            if not self._before(heap[child], heap[i]):
+                break
+            heap[i], heap[child] = heap[child], heap[i]
+            i = child
+
+    def _heapify(self):
+        for i in range(len(self.heap) // 2 - 1, -1, -1):
+            self._sift_down(i)
+
+    # ============== Running ==============
+    def next_delay(self):
+        """ms until the next task is due (0 if overdue, -1 if nothing is scheduled)"""
+        if self.pending:
+            return 0
+        if not self.heap:
+            return -1
+        return max(0, time.ticks_diff(self.heap[0].due, self.clock()))
+
+    def run_once(self):
+        """Run the next due task, or wait until it is due.
+        Returns the task's run time in ms, or -1 if this call only waited."""
+        if self.pending:
+            self._take_triggers()
+        delay = self.next_delay()
+        if delay != 0:
+            if delay < 0:
+                delay = 1000
+            start = self.clock()
+            slept = self.wait(delay)
+            elapsed = time.ticks_diff(self.clock(), start)
+            if slept is None or slept > elapsed:
+                slept = elapsed
+            self.idle_ms += slept
+            self.busy_ms += elapsed - slept
+            return -1
+
+        task = self._pop()
+        if not task.active:
+            return -1
+
+        start = self.clock()
+        late = time.ticks_diff(start, task.due)
+        if task.kind == DEADLINE and late > task.deadline:
+            task.missed += 1
+            return -1
+
+        task.jitter = late
+        if late > task.max_jitter:
+            task.max_jitter = late
+        if task.kind != PERIODIC:
+            task.active = False
+        task.fn()
+        end = self.clock()
+        run = time.ticks_diff(end, start)
+        task.runs += 1
+        task.last_run = run
+        if run > task.max_run:
+            task.max_run = run
+        self.busy_ms += run
+
+        if task.kind == PERIODIC and task.active:
+            task.due = time.ticks_add(task.due, task.period)
+            behind = time.ticks_diff(end, task.due)
+            if behind > 0:
+                # Ran past its next slot; slots passed entirely are skipped, not burst
+                task.overruns += 1
+                skipped = behind // task.period
+                if skipped:
+                    task.missed += skipped
+                    task.due = time.ticks_add(task.due, skipped * task.period)
+            self._push(task)
+        return run
+
+    def run(self):
+        while True:
+            self.run_once()
+
+    def idle_percent(self):
+        total = self.idle_ms + self.busy_ms
+        return self.idle_ms * 100 // total if total else 0
+
+    def report(self):
+        print("Scheduler: idle {}% (idle {} ms, busy {} ms)".format(
+            self.idle_percent(), self.idle_ms, self.busy_ms))
+        for t in self.tasks:
+            print("  {:<10} runs={} jitter={}/{}ms run={}/{}ms overruns={} missed={}".format(
+                t.name, t.runs, t.jitter, t.max_jitter, t.last_run, t.max_run, t.overruns, t.missed))
@@ -0,0 +1,147 @@
+"""
+Virtual-clock checks for scheduler.py
+- Run order by due tick, periodic catch-up without bursts, on-time tasks not counted
+  as overruns, jitter, deadline drops, idle vs busy accounting, bad periods rejected
+- Clock and wait are injected; tasks advance the clock to simulate their run time
+- Runs on CPython (via host_stubs) or the MicroPython unix port
+- Usage: python scheduler_check.py   (exits non-zero if a check fails)
+"""
+
+import sys
+
+import host_stubs
+host_stubs.install()
+
+from scheduler import Scheduler
+
+
+class Clock:
+    def __init__(self, ms=0):
+        self.ms = ms
+
+    def __call__(self):
+        return self.ms
+
+    def sleep(self, ms):
+        self.ms += ms
+
+
+failed = []
+
+
+def check(name, ok):
+    print("  %-52s %s" % (name, "ok" if ok else "FAIL"))
+    if not ok:
+        failed.append(name)
+
+
+def run_until(sched, clock, end):
+    while clock.ms < end:
+        sched.run_once()
+
+
+def main():
+    print("Order:")
+    clock = Clock()
+    sched = Scheduler(clock=clock, wait=clock.sleep)
+    log = []
+    sched.every(300, lambda: log.append(("c", clock.ms)), "c")
+    sched.every(100, lambda: log.append(("a", clock.ms)), "a", 50)
+    sched.after(250, lambda: log.append(("once", clock.ms)), "once")
+    sched.every(200, lambda: log.append(("b", clock.ms)), "b", 120)
+    run_until(sched, clock, 650)
+    check("runs in due-tick order", log == sorted(log, key=lambda e: e[1]) and log[0] == ("c", 0))
+    check("periods kept on the grid", [t for n, t in log if n == "a"] == [50, 150, 250, 350, 450, 550]
+          and [t for n, t in log if n == "b"] == [120, 320, 520])
+    check("one-shot runs once", [t for n, t in log if n == "once"] == [250])
+    check("no jitter when nothing overlaps", all(t.max_jitter == 0 for t in sched.tasks))
+
+    print("Catch-up:")
+    clock = Clock()
+    sched = Scheduler(clock=clock, wait=clock.sleep)
+    runs = []
+    slow = [0]
+
+    def work():
+        runs.append(clock.ms)
+        clock.ms += slow[0]
+    task = sched.every(100, work, "work")
+    run_until(sched, clock, 300)
+    slow[0] = 250
+    sched.run_once()
+    slow[0] = 0
+    run_until(sched, clock, 800)
+    # 300 + 250 ms: the 400 slot passed entirely, the 500 slot runs late, then back on the grid
+    check("slow run skips the slots it covered, no burst", runs == [0, 100, 200, 300, 550, 600, 700])
+    check("1 slot missed, 1 overrun", task.missed == 1 and task.overruns == 1)
+
+    clock = Clock()
+    sched = Scheduler(clock=clock, wait=clock.sleep)
+    extra = [130]
+
+    def work_late():
+        clock.ms += extra.pop() if extra else 0
+    task = sched.every(100, work_late, "late")
+    sched.run_once()
+    sched.run_once()
+    check("30 ms past the next slot: runs late, nothing skipped", task.missed == 0
+          and task.overruns == 1 and task.jitter == 30)
+
+    clock = Clock()
+    sched = Scheduler(clock=clock, wait=clock.sleep)
+
+    def exact():
+        clock.ms += 100
+    task = sched.every(100, exact, "exact")
+    for _ in range(5):
+        sched.run_once()
+    check("task ending exactly on its next slot is on time", task.runs == 5 and task.missed == 0
+          and task.overruns == 0 and task.max_jitter == 0)
+
+    print("Jitter and deadlines:")
+    clock = Clock()
+    sched = Scheduler(clock=clock, wait=clock.sleep)
+    fast = sched.every(50, lambda: None, "fast")
+    block = sched.after(40, lambda: clock.sleep(35), "block")
+    dl = []
+    sched.deadline(45, 10, lambda: dl.append(clock.ms), "deadline")
+    sched.deadline(45, 60, lambda: dl.append(clock.ms), "deadline2")
+    run_until(sched, clock, 200)
+    check("blocked task runs late, jitter recorded", fast.max_jitter == 25 and fast.runs == 4)
+    check("deadline missed by > within is dropped", dl == [75])
+    check("block ran once", block.runs == 1 and not block.active)
+
+    print("Idle accounting:")
+    clock = Clock()
+
+    def busy_wait(ms):
+        # Sleeps 30 ms, then spends the rest serving a client
+        clock.ms += ms
+        return min(ms, 30)
+    sched = Scheduler(clock=clock, wait=busy_wait)
+    sched.every(100, lambda: clock.sleep(10), "work")
+    run_until(sched, clock, 1000)
+    check("wait hook's own work is busy, not idle", sched.idle_ms == 300 and sched.busy_ms == 700)
+    clock = Clock()
+    sched = Scheduler(clock=clock, wait=clock.sleep)
+    sched.every(100, lambda: clock.sleep(10), "work")
+    run_until(sched, clock, 1000)
+    check("plain sleep: 90% idle", sched.idle_percent() == 90)
+
+    print("Bad periods:")
+    for period in (0, -5):
+        try:
+            sched.every(period, lambda: None, "bad")
+            ok = False
+        except ValueError:
+            ok = True
+        check("period %d rejected" % period, ok)
+
+    if failed:
+        print("FAIL:", ", ".join(failed))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
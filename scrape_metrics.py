@@ -0,0 +1,150 @@
+"""
+Scrape /metrics from the ESP32 like Prometheus would and check the format
+- Usage: python scrape_metrics.py 192.168.1.50 [--interval 15] [--count 4]
+-        python scrape_metrics.py --file metrics.txt
+- Exits non-zero on any exposition format error
+"""
+
+import argparse
+import re
+import sys
+import time
+import urllib.request
+
+NAME_RE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*$')
+SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})?\s+(\S+)$')
+LABEL_RE = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="([^"]*)"')
+
+
+def parse(text):
+    """Parse exposition text into {family: {"type", "help", "samples"}} and a list of errors"""
+    families = {}
+    errors = []
+
+    for n, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        if line.startswith('# HELP ') or line.startswith('# TYPE '):
+            parts = line.split(' ', 3)
+            if len(parts) < 4 or not NAME_RE.match(parts[2]):
+                errors.append("line %d: malformed %s" % (n, parts[1]))
+                continue
+            fam = families.setdefault(parts[2], {"type": None, "help": None, "samples": []})
+            if parts[1] == 'TYPE':
+                if parts[3] not in ('counter', 'gauge', 'histogram', 'summary', 'untyped'):
+                    errors.append("line %d: unknown type %s" % (n, parts[3]))
+                fam["type"] = parts[3]
+            else:
+                fam["help"] = parts[3]
+            continue
+        if line.startswith('#'):
+            continue
+
+        m = SAMPLE_RE.match(line)
+        if not m:
+            errors.append("line %d: malformed sample: %s" % (n, line))
+            continue
+        name, labels, value = m.groups()
+        try:
+            value = float(value)
+        except ValueError:
+            errors.append("line %d: bad value %s" % (n, value))
+            continue
+        labels = dict(LABEL_RE.findall(labels or ''))
+
+        family = name
+        for suffix in ('_bucket', '_sum', '_count'):
+            base = name[:-len(suffix)]
+            if name.endswith(suffix) and families.get(base, {}).get("type") == 'histogram':
+                family = base
+                break
+        if family not in families or families[family]["type"] is None:
+            errors.append("line %d: sample %s has no TYPE" % (n, name))
+            continue
+        families[family]["samples"].append((name, labels, value))
+
+    for family, fam in families.items():
+        if fam["type"] == 'counter':
+            for name, labels, value in fam["samples"]:
+                if value < 0:
+                    errors.append("%s: negative counter" % family)
+        if fam["type"] == 'histogram':
+            errors.extend(check_histogram(family, fam["samples"]))
+
+    return families, errors
+
+
+def check_histogram(family, samples):
+    errors = []
+    buckets = [(s[1].get("le"), s[2]) for s in samples if s[0] == family + '_bucket']
+    count = [s[2] for s in samples if s[0] == family + '_count']
+    if not buckets or buckets[-1][0] != '+Inf':
+        errors.append("%s: missing +Inf bucket" % family)
+        return errors
+    last = 0
+    for le, value in buckets:
+        if value < last:
+            errors.append("%s: bucket le=%s not cumulative" % (family, le))
+        last = value
+    if not count or count[0] != buckets[-1][1]:
+        errors.append("%s: _count does not match +Inf bucket" % family)
+    return errors
+
+
+def fetch(host, timeout=5):
+    url = host if host.startswith('http') else 'http://%s/metrics' % host
+    start = time.time()
+    with urllib.request.urlopen(url, timeout=timeout) as resp:
+        body = resp.read().decode('utf-8')
+    return body, (time.time() - start) * 1000
+
+
+def report(families):
+    for family in sorted(families):
+        fam = families[family]
+        if fam["type"] == 'histogram':
+            count = [s[2] for s in fam["samples"] if s[0] == family + '_count']
+            total = [s[2] for s in fam["samples"] if s[0] == family + '_sum']
+            if count and count[0]:
+                print("  %-48s n=%d avg=%.1f" % (family, count[0], total[0] / count[0]))
+            else:
+                print("  %-48s n=0" % family)
+        else:
+            for name, labels, value in fam["samples"]:
+                label = ','.join('%s=%s' % kv for kv in labels.items())
+                print("  %-48s %s" % (name + ('{%s}' % label if label else ''), int(value)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape and validate ESP32 /metrics")
+    parser.add_argument('host', nargs='?', help="device IP or full /metrics URL")
+    parser.add_argument('--file', help="validate a saved scrape instead of fetching")
+    parser.add_argument('--interval', type=float, default=15, help="seconds between scrapes")
+    parser.add_argument('--count', type=int, default=1, help="number of scrapes")
+    args = parser.parse_args()
+
+    if not args.host and not args.file:
+        parser.error("host or --file is required")
+
+    failed = False
+    for i in range(args.count if args.host else 1):
+        if i:
+            time.sleep(args.interval)
+        if args.file:
+            with open(args.file) as f:
+                body, ms = f.read(), 0
+        else:
+            body, ms = fetch(args.host)
+
+        families, errors = parse(body)
+        print("Scrape %d: %d families, %d bytes, %.0f ms" % (i + 1, len(families), len(body), ms))
+        report(families)
+        for e in errors:
+            print("FORMAT ERROR:", e)
+        failed = failed or bool(errors)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Linux stress test for sampler.py on CPython threads
+- A Sampler thread produces records whose fields are all derived from a sequence number
+- The main thread drains the ring with random stalls, like the network/UI loop does
+- Every record is checked for tearing (fields not matching each other)
+- Checks that received + dropped == produced and the sequence has no gaps or repeats
+- Cadence run: the firmware's ratios (5 s samples, 16-record ring, drained every 200 ms,
+  web requests stalling the loop) on a clock sped up --speed times; nothing may be dropped
+  and the sampler must keep its period
+- Overflow run (separate): flat-out producer into a 4-record ring with a slow consumer;
+  drops are expected and must all be accounted for, records still never torn
+- Usage: python stress_sampler.py [--seconds 10] [--speed 100] [--stall-ms 1200]
+- Exits non-zero on any lost, torn or out-of-order record, or a drop in the cadence run
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from sampler import Sampler, SampleRing
+
+FIELDS = 11     # stamp + 10 PZEM registers, as in webhook-iot.py
+# Firmware settings (webhook-iot.py)
+PERIOD_MS = 5000
+RING = 16
+DRAIN_MS = 200
+READ_MS = 100
+
+
+def record_values(seq):
+    return [(seq * (k + 1) + k) & 0xFFFFFFFF for k in range(FIELDS - 1)]
+
+
+def run(seconds, ring_size, period, drain_ms, stall_ms, stall_p, read_ms):
+    """One producer/consumer run; returns (produced, received, dropped, lost, torn, gaps, sampler)"""
+    # Checked by the consumer; only the producer thread writes it
+    produced = [0]
+
+    def read(stamp):
+        if read_ms:
+            time.sleep(read_ms / 1000)
+        seq = produced[0]
+        produced[0] = seq + 1
+        return [seq] + record_values(seq)[1:]
+
+    ring = SampleRing(ring_size, FIELDS)
+    sampler = Sampler(read, ring, period)
+    sampler.start()
+
+    received = 0
+    torn = 0
+    gaps = 0
+    expect = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end or len(ring):
+        if time.monotonic() >= end and sampler.running:
+            sampler.stop()
+        i = ring.peek()
+        if i < 0:
+            time.sleep(drain_ms / 1000 if drain_ms else random.random() * stall_ms / 1000)
+            continue
+        values = ring.buf[i + 1:i + FIELDS]
+        seq = values[0]
+        if list(values[1:]) != record_values(seq)[1:]:
+            torn += 1
+        if seq != expect:
+            # Anything skipped must have been dropped by a full ring
+            gaps += seq - expect
+        expect = seq + 1
+        received += 1
+        ring.pop()
+        if random.random() < stall_p:
+            time.sleep(random.random() * stall_ms / 1000)
+
+    sampler.stop()
+    total = produced[0]
+    lost = total - received - ring.dropped
+    # Drops after the last record the consumer saw do not show up as gaps
+    gaps -= ring.dropped - (total - expect)
+    print("  produced {}  received {}  dropped {}  lost {}  torn {}  unexplained gaps {}".format(
+        total, received, ring.dropped, lost, torn, gaps))
+    print("  ", end="")
+    sampler.report()
+    return total, received, ring.dropped, lost, torn, gaps, sampler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress the sampler ring on CPython threads")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--speed', type=float, default=100,
+                        help="clock speed-up for the cadence run (1 = real time)")
+    parser.add_argument('--stall-ms', type=float, default=1200,
+                        help="longest main-loop stall (a slow web request), in firmware ms")
+    args = parser.parse_args()
+
+    # Switch threads as often as possible so a missing publish barrier would show up
+    sys.setswitchinterval(1e-6)
+    failed = []
+
+    period = max(1, int(PERIOD_MS / args.speed))
+    print("Cadence run: %d ms period, %d-record ring, drain every %.1f ms, stalls up to %.1f ms" % (
+        period, RING, DRAIN_MS / args.speed, args.stall_ms / args.speed))
+    total, received, dropped, lost, torn, gaps, sampler = run(
+        args.seconds, RING, period, DRAIN_MS / args.speed, args.stall_ms / args.speed, 0.2,
+        READ_MS / args.speed)
+    expected = args.seconds * 1000 / period
+    if dropped or lost or torn or gaps:
+        failed.append("cadence: dropped/lost/torn/gaps")
+    # Sleep granularity makes each period a little long; a stalled or bursting sampler is far off
+    if not 0.8 * expected <= total <= expected + 1:
+        failed.append("cadence: %d samples, expected ~%d" % (total, expected))
+
+    print("Overflow run: flat-out producer, 4-record ring, slow consumer")
+    total, received, dropped, lost, torn, gaps, sampler = run(
+        min(args.seconds, 3), 4, 0, 0, 5, 0.01, 0)
+    if lost or torn or gaps:
+        failed.append("overflow: lost/torn/gaps")
+    if not dropped or received + dropped != total:
+        failed.append("overflow: drops not seen or not accounted for")
+
+    if failed:
+        print("FAIL:", ", ".join(failed))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
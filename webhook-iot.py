@@ -5,15 +5,36 @@ ESP32 PZEM Monitor with WiFi, Web Server & n8n Webhook
 - Send data to n8n webhook every X seconds
 - Configurable devid, mcid, send interval via web
 - LCD: Line1=IP, Line2=Amp & Volt
+- Prometheus-style /metrics endpoint
+- Sample history with chunked CSV/binary /export
+- One allocation-free JSON serializer for /api and the webhook
+- Scheduler-driven main loop that sleeps until the next task or web client
+- Sampling starts at boot; WiFi, web server and AP fallback come up in the background
+- Optional sampling thread on the second core (THREAD_SAMPLING), readings passed through a ring
+- Settings in one checksummed config record, cached in RAM, writes coalesced
+- WiFi link supervisor: reconnects with backoff via cached BSSID/lease, offline readings uploaded after
+- PZEM sampling paced by a hardware timer, readings stamped with their scheduled tick
+- Optional low-power mode: light/deep sleep between samples, WiFi only for batched uploads
+- Opt-in per-stage profiler (PROFILE = True), report on serial and /api/profile
+- Page templates, webhook client and low-power code load on first use; see build.py for .mpy / frozen builds
 """
 
-from machine import Pin, I2C, UART
+from machine import Pin, I2C, UART, Timer
+from array import array
+import machine
+import struct
 import network
 import socket
-import urequests
-import ujson
+import select
 import time
 import gc
+import micropython
+from lcd_i2c import I2cLcd, I2C_FREQ
+from scheduler import Scheduler
+from config_store import ConfigStore
+from wifi_link import WifiLink
+import metrics
+import profiler
 
 print("\n" + "="*40)
 print("ESP32 PZEM + WiFi + n8n Webhook")
@@ -21,6 +42,7 @@ print("="*40 + "\n")
 
 gc.enable()
 gc.collect()
+print("Boot: imports done at {} ms, {} bytes free".format(time.ticks_ms(), gc.mem_free()))
 
 # WiFi credentials
 DEFAULT_SSID = "TP-Link_5B9A"
@@ -34,17 +56,67 @@ dev_id = "e089"
 mc_id = "m-001"
 send_interval = 60  # seconds
 
+# Sample PZEM on its own _thread; the main thread only drains the ring
+THREAD_SAMPLING = False
+SAMPLE_RING_SIZE = 16
+DRAIN_MS = 200
+
+# Per-stage timing/allocation profiler (small overhead per stage when on)
+PROFILE = False
+PROFILE_REPORT_MS = 300000
+
+# Power mode: "normal" (always on, web server), "light" (light-sleep between samples,
+# WiFi only for batched uploads), "deep" (deep-sleep, pending samples kept in RTC memory)
+POWER_MODE = "normal"
+DEEP_MIN_MS = 3000         # shorter sleeps use light sleep
+DEEP_WAKE_ADVANCE_MS = 1500  # wake early to absorb boot time
+RTC_MAGIC = 0x505A3031
+RTC_HEADER = "<IIIIIII"    # magic, hist_seq, upload_seq, pending, awake_ms, asleep_ms, n records
+RTC_MAX_RECORDS = 64
+config = ConfigStore({
+    "devid": dev_id, "mcid": mc_id, "interval": send_interval,
+    "ssid": DEFAULT_SSID, "password": DEFAULT_PASSWORD,
+    "wifi_cache": None,
+})
+dev_id_b = b"e089"
+mc_id_b = b"m-001"
+MAX_ID_LEN = 32
+
 # Global variables
 i2c = None
-lcd_addr = None
+lcd = None
 wlan = None
 ap = None
 server = None
+poller = None
 ip_address = "0.0.0.0"
-last_send = 0
 last_send_status = "Never"
+sched = None
+send_task = None
+net_task = None
+net_start = 0
+link = None
+web_started = False
+NET_TIMEOUT_MS = 15000     # no link this long after boot -> AP mode for setup
+NET_POLL_MS = 500
+STATIC_IP = None           # or ("192.168.1.60", "255.255.255.0", "192.168.1.1", "8.8.8.8")
+backlog_end = 0            # readings taken while offline (boot or outage), seq end
+BACKLOG_MS = 2000
+BACKLOG_BATCH = 5
+
+# Sampling timer
+SAMPLE_TIMER_ID = 0
+sample_timer = None
+sample_task = None
+sample_sched = 0
+pzem_stamp = 0
+power_mgr = None
+sample_thread = None
+sample_ring = None
 
 # PZEM variables
+# With THREAD_SAMPLING, uart_pzem, pzem_enabled and pzem_fail_count belong to the
+# sampler thread (thread_read); the main thread must not touch them once it started
 uart_pzem = None
 pzem_enabled = False
 pzem_voltage = None
@@ -55,81 +127,116 @@ pzem_frequency = None
 pzem_power_factor = None
 pzem_device_id = 0x01
 pzem_read_interval = 5000
+pzem_fail_count = 0
+max_pzem_failures = 3
+boot_reported = False
+
+# Sample history: ring buffer of raw PZEM registers
+# Record = ts (device epoch s), volt (0.1V), amp (mA), power (0.1W), energy (Wh), freq (0.1Hz), pf (0.01)
+HIST_SIZE = 720
+HIST_FIELDS = 7
+EXPORT_CHUNK = 512
+# Longest CSV row: 7 uint32 fields of up to 10 digits plus a decimal point, 6 commas, newline
+CSV_ROW_MAX = 7 * 11 + 7
+EPOCH_OFFSET = 946684800 if time.gmtime(0)[0] == 2000 else 0
+# Unix time below which the RTC was never set (ingest_server.py TS_FLOOR rejects it too)
+CLOCK_FLOOR = 1704067200
+clock_synced = False
+hist = array('I', (0 for _ in range(HIST_SIZE * HIST_FIELDS)))
+hist_head = 0
+hist_count = 0
+hist_seq = 0      # records ever written
+upload_seq = 0    # next record seq the backlog upload will send
+export_buf = bytearray(EXPORT_CHUNK)
+json_buf = bytearray(320)
+json_mv = memoryview(json_buf)
 
 # ============== Config Save/Load ==============
 def save_device_config():
-    try:
-        with open('device_config.txt', 'w') as f:
-            f.write(dev_id + '\n')
-            f.write(mc_id + '\n')
-            f.write(str(send_interval) + '\n')
-        print("Config saved")
-        return True
-    except:
-        return False
+    # Only marks the cached record dirty; task_config writes it
+    config.update({"devid": dev_id, "mcid": mc_id, "interval": send_interval})
+    return True
 
 def load_device_config():
     global dev_id, mc_id, send_interval
-    try:
-        with open('device_config.txt', 'r') as f:
-            dev_id = f.readline().strip() or "e089"
-            mc_id = f.readline().strip() or "m-001"
-            send_interval = int(f.readline().strip() or "60")
-        print("Config loaded: devid={}, mcid={}, interval={}s".format(dev_id, mc_id, send_interval))
-        return True
-    except:
-        dev_id = "e089"
-        mc_id = "m-001"
-        send_interval = 60
-        return False
+    source = config.load()
+    dev_id = config.get("devid")
+    mc_id = config.get("mcid")
+    send_interval = config.get("interval")
+    print("Config loaded ({}): devid={}, mcid={}, interval={}s".format(source, dev_id, mc_id, send_interval))
+    cache_ids()
+    return source != "defaults"
+
+def cache_ids():
+    # Encoded once here so the JSON serializer never has to
+    global dev_id_b, mc_id_b
+    dev_id_b = dev_id.encode()[:MAX_ID_LEN]
+    mc_id_b = mc_id.encode()[:MAX_ID_LEN]
 
 def save_wifi_config(ssid, password):
-    try:
-        with open('wifi_config.txt', 'w') as f:
-            f.write(ssid + '\n')
-            f.write(password + '\n')
-        return True
-    except:
-        return False
+    # Written straight away, a reset follows
+    config.update({"ssid": ssid, "password": password})
+    config.flush()
+    return not config.dirty
 
 def load_wifi_config():
-    try:
-        with open('wifi_config.txt', 'r') as f:
-            ssid = f.readline().strip()
-            password = f.readline().strip()
-            if ssid:
-                return ssid, password
-    except:
-        pass
-    return DEFAULT_SSID, DEFAULT_PASSWORD
+    return config.get("ssid"), config.get("password")
+
+def task_config():
+    if config.poll():
+        print("Config saved")
 
 # ============== Send to n8n Webhook ==============
 def send_to_remote():
     global last_send_status
     
-    if pzem_voltage is None or pzem_current is None:
+    if not hist_count:
         last_send_status = "No data"
         return False
-    
+    return post_json(reading_json()) == 200
+
+def clock_valid():
+    """History timestamps are real: NTP synced, or the RTC kept its time (deep sleep)"""
+    return clock_synced or time.time() + EPOCH_OFFSET >= CLOCK_FLOOR
+
+def upload_pending(end=None, limit=0):
+    """POST history records not yet uploaded (up to seq end, at most limit if given),
+    oldest first, with their timestamps. Nothing goes out before the clock is set:
+    sync_time() re-stamps the records taken before, so they wait for it."""
+    global upload_seq
+    if not clock_valid():
+        sync_time()
+        if not clock_valid():
+            print("Clock not set, backlog kept")
+            return False
+    if end is None:
+        end = hist_seq
+    if hist_seq - upload_seq > hist_count:
+        # The ring already overwrote the oldest ones
+        upload_seq = hist_seq - hist_count
+    if limit:
+        end = min(end, upload_seq + limit)
+    while upload_seq < end:
+        idx = (hist_head - (hist_seq - upload_seq)) % HIST_SIZE
+        status = post_json(reading_json(idx, True))
+        if status == 400:
+            # Rejected for good (e.g. timestamp before the server's floor): retrying
+            # would hold up the rest of the backlog forever
+            print("Backlog record", upload_seq, "rejected, skipped")
+        elif status != 200:
+            return False
+        upload_seq += 1
+    return True
+
+def post_json(json_data):
+    """POST to the webhook; returns the HTTP status, 0 if the request failed"""
+    global last_send_status
     try:
-        # Build JSON payload
-        payload = {
-            "devid": dev_id,
-            "mcid": mc_id,
-            "voltage": round(pzem_voltage, 1) if pzem_voltage is not None else 0,
-            "current": round(pzem_current, 3) if pzem_current is not None else 0,
-            "power": round(pzem_power, 1) if pzem_power is not None else 0,
-            "energy": round(pzem_energy, 2) if pzem_energy is not None else 0,
-            "frequency": round(pzem_frequency, 1) if pzem_frequency is not None else 0,
-            "pf": round(pzem_power_factor, 2) if pzem_power_factor is not None else 0
-        }
-        
-        json_data = ujson.dumps(payload)
-        
         print("Sending to n8n:", WEBHOOK_URL)
-        print("Payload:", json_data)
+        print("Payload:", bytes(json_data))
         
         # POST request with JSON body
+        import urequests
         headers = {"Content-Type": "application/json"}
         response = urequests.post(WEBHOOK_URL, data=json_data, headers=headers, timeout=10)
         status_code = response.status_code
@@ -137,45 +244,76 @@ def send_to_remote():
         
         if status_code == 200:
             last_send_status = "OK"
+            metrics.inc(metrics.WEBHOOK_OK)
             print("Send success!")
-            return True
         else:
             last_send_status = "Err:" + str(status_code)
+            metrics.inc(metrics.WEBHOOK_ERRORS)
             print("Send failed:", status_code)
-            return False
+        return status_code
             
     except Exception as e:
         last_send_status = "Err:" + str(e)[:10]
+        metrics.inc(metrics.WEBHOOK_ERRORS)
         print("Send error:", str(e))
-        return False
+        return 0
 
 # ============== WiFi Manager ==============
 def connect_wifi():
-    global wlan, ip_address
+    """Start the link supervisor and return at once; task_net steps it"""
+    global wlan, link, net_start
     
     ssid, password = load_wifi_config()
     print("Connecting to:", ssid)
     
     wlan = network.WLAN(network.STA_IF)
-    wlan.active(True)
-    
-    if wlan.isconnected():
-        ip_address = wlan.ifconfig()[0]
-        print("Already connected:", ip_address)
-        return True
-    
-    wlan.connect(ssid, password)
-    
-    for i in range(15):
-        if wlan.isconnected():
-            ip_address = wlan.ifconfig()[0]
-            print("Connected! IP:", ip_address)
-            return True
-        print("Waiting... ({}/15)".format(i+1))
-        time.sleep(1)
-    
-    print("WiFi connection failed")
-    return False
+    net_start = time.ticks_ms()
+    link = WifiLink(wlan, ssid, password, cache=config.get("wifi_cache"), save=wifi_cache_save,
+                    static=STATIC_IP, on_up=wifi_up, on_down=wifi_down)
+    link.start()
+
+def wifi_cache_save(cache):
+    # BSSID, channel and lease for the next (re)connect; coalesced by the config store
+    config.set("wifi_cache", cache)
+
+def wifi_up():
+    global ip_address, send_task, backlog_end
+    ip_address = wlan.ifconfig()[0]
+    metrics.observe(metrics.WIFI_ASSOC_MS, link.assoc_ms)
+    if link.connects > 1:
+        metrics.observe(metrics.WIFI_OUTAGE_S, link.outage_ms // 1000)
+    print("Connected! IP:", ip_address)
+    sync_time()
+    if not web_started:
+        net_up()
+    # Readings taken while offline go out in batches from task_backlog
+    backlog_end = hist_seq
+    if not send_task:
+        send_task = sched.every(send_interval * 1000, task_send, "send", send_interval * 1000)
+        sched.every(BACKLOG_MS, task_backlog, "backlog")
+    update_lcd()
+
+def wifi_down():
+    global upload_seq
+    metrics.inc(metrics.WIFI_DISCONNECTS)
+    # Everything up to now went out live; keep an unfinished backlog as it is
+    if upload_seq >= backlog_end:
+        upload_seq = hist_seq
+    update_lcd()
+
+def sync_time():
+    # History timestamps come from the RTC, so set it once we are online
+    global clock_synced
+    try:
+        import ntptime
+        before = time.time()
+        ntptime.settime()
+        # Readings taken before the sync were stamped with the unset clock
+        history_shift(time.time() - before)
+        clock_synced = True
+        print("Time synced:", time.time() + EPOCH_OFFSET)
+    except Exception as e:
+        print("NTP error:", str(e))
 
 def start_ap_mode():
     global ap, ip_address
@@ -191,194 +329,114 @@ def start_ap_mode():
     return True
 
 # ============== Web Pages ==============
-def wifi_manager_page():
-    html = """<!DOCTYPE html>
-<html>
-<head>
-    <title>WiFi Setup</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <style>
-        body{font-family:Arial;margin:20px;background:#1a1a2e;color:#fff;}
-        .card{background:#16213e;padding:20px;border-radius:10px;max-width:400px;margin:auto;}
-        h1{color:#e94560;text-align:center;}
-        input{width:100%;padding:12px;margin:8px 0;border:none;border-radius:5px;box-sizing:border-box;}
-        button{width:100%;padding:12px;background:#e94560;color:#fff;border:none;border-radius:5px;cursor:pointer;font-size:16px;}
-    </style>
-</head>
-<body>
-    <div class="card">
-        <h1>WiFi Setup</h1>
-        <form action="/savewifi" method="GET">
-            <input type="text" name="ssid" placeholder="WiFi SSID" required>
-            <input type="password" name="pass" placeholder="WiFi Password" required>
-            <button type="submit">Connect</button>
-        </form>
-    </div>
-</body>
-</html>"""
-    return html
-
-def settings_page():
-    html = """<!DOCTYPE html>
-<html>
-<head>
-    <title>Device Settings</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <style>
-        body{font-family:Arial;margin:20px;background:#1a1a2e;color:#fff;}
-        .card{background:#16213e;padding:20px;border-radius:10px;max-width:400px;margin:auto;}
-        h1{color:#00d4ff;text-align:center;}
-        label{display:block;margin-top:15px;color:#888;}
-        input{width:100%%;padding:12px;margin:5px 0;border:none;border-radius:5px;box-sizing:border-box;}
-        button{width:100%%;padding:12px;background:#00d4ff;color:#000;border:none;border-radius:5px;cursor:pointer;font-size:16px;margin-top:20px;}
-        .info{background:#0f3460;padding:10px;border-radius:5px;margin-top:15px;font-size:12px;word-break:break-all;}
-        a{color:#e94560;}
-    </style>
-</head>
-<body>
-    <div class="card">
-        <h1>Device Settings</h1>
-        <form action="/savesettings" method="GET">
-            <label>Device ID</label>
-            <input type="text" name="devid" value="%s" required>
-            <label>Machine ID</label>
-            <input type="text" name="mcid" value="%s" required>
-            <label>Send Interval (seconds)</label>
-            <input type="number" name="interval" value="%d" min="10" max="3600" required>
-            <button type="submit">Save Settings</button>
-        </form>
-        <div class="info">
-            <p><b>Webhook:</b> %s</p>
-            <p><b>Last Send:</b> %s</p>
-        </div>
-        <p style="text-align:center;margin-top:15px;"><a href="/">Back to Dashboard</a></p>
-    </div>
-</body>
-</html>""" % (dev_id, mc_id, send_interval, WEBHOOK_URL, last_send_status)
-    return html
-
 def api_json():
-    def fmt(val):
-        return 'null' if val is None else str(val)
-    
-    json_str = '{"voltage":%s,"current":%s,"power":%s,"energy":%s,"frequency":%s,"pf":%s,"devid":"%s","mcid":"%s","interval":%d}' % (
-        fmt(pzem_voltage),
-        fmt(pzem_current),
-        fmt(pzem_power),
-        fmt(pzem_energy),
-        fmt(pzem_frequency),
-        fmt(pzem_power_factor),
-        dev_id,
-        mc_id,
-        send_interval
-    )
-    return json_str
-
-def pzem_web_page():
-    html = """<!DOCTYPE html>
-<html>
-<head>
-    <title>PZEM Monitor</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <style>
-        body{font-family:Arial;margin:0;padding:20px;background:#0f0f23;color:#fff;}
-        h1{text-align:center;color:#00d4ff;}
-        .grid{display:grid;grid-template-columns:repeat(2,1fr);gap:15px;max-width:500px;margin:auto;}
-        .card{background:linear-gradient(135deg,#1a1a3e,#2d2d5a);padding:20px;border-radius:15px;text-align:center;}
-        .value{font-size:32px;font-weight:bold;color:#00ff88;}
-        .label{font-size:14px;color:#888;margin-top:5px;}
-        .volt{color:#ffcc00;}
-        .amp{color:#ff6b6b;}
-        .watt{color:#00d4ff;}
-        .status{text-align:center;color:#666;margin-top:20px;font-size:12px;}
-        .online{color:#00ff88;}
-        .menu{text-align:center;margin-top:20px;}
-        .menu a{color:#e94560;margin:0 10px;}
-        .info{text-align:center;background:#1a1a3e;padding:10px;border-radius:10px;margin-top:15px;max-width:500px;margin-left:auto;margin-right:auto;}
-    </style>
-</head>
-<body>
-    <h1>PZEM Monitor</h1>
-    <div class="grid">
-        <div class="card">
-            <div class="value volt" id="volt">---</div>
-            <div class="label">Voltage (V)</div>
-        </div>
-        <div class="card">
-            <div class="value amp" id="amp">---</div>
-            <div class="label">Current (A)</div>
-        </div>
-        <div class="card">
-            <div class="value watt" id="watt">---</div>
-            <div class="label">Power (W)</div>
-        </div>
-        <div class="card">
-            <div class="value" id="energy">---</div>
-            <div class="label">Energy (kWh)</div>
-        </div>
-        <div class="card">
-            <div class="value" id="freq">---</div>
-            <div class="label">Frequency (Hz)</div>
-        </div>
-        <div class="card">
-            <div class="value" id="pf">---</div>
-            <div class="label">Power Factor</div>
-        </div>
-    </div>
-    <div class="info">
-        <span>Device: <b id="devid">---</b></span> | 
-        <span>Machine: <b id="mcid">---</b></span> | 
-        <span>Send: <b id="interval">---</b>s</span>
-    </div>
-    <p class="status">IP: %s | <span class="online" id="status">Updating...</span></p>
-    <div class="menu">
-        <a href="/settings">Settings</a> | 
-        <a href="/send">Send Now</a> | 
-        <a href="/setup">WiFi Setup</a>
-    </div>
-    
-    <script>
-        function updateData() {
-            fetch('/api')
-                .then(response => response.json())
-                .then(data => {
-                    document.getElementById('volt').textContent = (data.voltage !== null) ? data.voltage.toFixed(1) : '---';
-                    document.getElementById('amp').textContent = (data.current !== null) ? data.current.toFixed(3) : '---';
-                    document.getElementById('watt').textContent = (data.power !== null) ? data.power.toFixed(1) : '---';
-                    document.getElementById('energy').textContent = (data.energy !== null) ? data.energy.toFixed(2) : '---';
-                    document.getElementById('freq').textContent = (data.frequency !== null) ? data.frequency.toFixed(1) : '---';
-                    document.getElementById('pf').textContent = (data.pf !== null) ? data.pf.toFixed(2) : '---';
-                    document.getElementById('devid').textContent = data.devid;
-                    document.getElementById('mcid').textContent = data.mcid;
-                    document.getElementById('interval').textContent = data.interval;
-                    document.getElementById('status').textContent = 'Live (5s refresh)';
-                })
-                .catch(err => {
-                    document.getElementById('status').textContent = 'Connection error';
-                });
-        }
-        updateData();
-        setInterval(updateData, 5000);
-    </script>
-</body>
-</html>""" % ip_address
-    return html
+    return reading_json()
 
 # ============== Web Server ==============
 def start_web_server():
-    global server
+    global server, poller
     try:
         server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         server.bind(('0.0.0.0', 80))
         server.listen(5)
         server.setblocking(False)
+        poller = select.poll()
+        poller.register(server, select.POLLIN)
         print("Web server started on port 80")
         return True
     except Exception as e:
         print("Web server error:", str(e))
         return False
 
+def export_params(request):
+    fmt = 'csv'
+    t_from = 0
+    t_to = 0xFFFFFFFF
+    params = request.split('GET /export')[1].split(' ')[0].lstrip('?')
+    for param in params.split('&'):
+        # from= / to= with no value leave that end unbounded
+        if param.startswith('fmt='):
+            fmt = param[4:]
+        elif param.startswith('from=') and len(param) > 5:
+            t_from = max(0, int(param[5:]) - EPOCH_OFFSET)
+        elif param.startswith('to=') and len(param) > 3:
+            t_to = max(0, int(param[3:]) - EPOCH_OFFSET)
+    return fmt, t_from, t_to
+
+def send_chunk(client, data, size):
+    client.sendall('%x\r\n' % size)
+    client.sendall(data)
+    client.sendall('\r\n')
+
+def export_history(client, fmt, t_from, t_to):
+    """Stream history records in [t_from, t_to] using chunked transfer encoding"""
+    if fmt == 'bin':
+        client.sendall('HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\n'
+                       'X-Record-Format: <7I ts,volt_dV,amp_mA,power_dW,energy_Wh,freq_dHz,pf_c\r\n'
+                       'X-Epoch-Offset: %d\r\n' % EPOCH_OFFSET)
+    else:
+        client.sendall('HTTP/1.1 200 OK\r\nContent-Type: text/csv\r\n'
+                       'Content-Disposition: attachment; filename="pzem_%s.csv"\r\n' % dev_id)
+    client.sendall('Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n')
+
+    mv = memoryview(hist)
+    buf = export_buf
+    per_chunk = EXPORT_CHUNK // (HIST_FIELDS * 4)
+    oldest = (hist_head - hist_count) % HIST_SIZE
+    pos = 0
+    run_start = -1
+    run_len = 0
+
+    if fmt != 'bin':
+        pos = put_bytes(buf, 0, b'ts,voltage,current,power,energy,frequency,pf\n')
+
+    for k in range(hist_count):
+        idx = (oldest + k) % HIST_SIZE
+        i = idx * HIST_FIELDS
+        match = t_from <= hist[i] <= t_to
+
+        if fmt == 'bin':
+            # Records are sent straight from the ring; a run ends on a miss, wrap or full chunk
+            if match and run_len and idx == run_start + run_len and run_len < per_chunk:
+                run_len += 1
+                continue
+            if run_len:
+                send_chunk(client, mv[run_start * HIST_FIELDS:(run_start + run_len) * HIST_FIELDS],
+                           run_len * HIST_FIELDS * 4)
+                run_len = 0
+            if match:
+                run_start = idx
+                run_len = 1
+            continue
+
+        if not match:
+            continue
+        if pos > EXPORT_CHUNK - CSV_ROW_MAX:
+            send_chunk(client, memoryview(buf)[:pos], pos)
+            pos = 0
+        pos = put_fixed(buf, pos, hist[i] + EPOCH_OFFSET, 0)
+        pos = put_bytes(buf, pos, b',')
+        pos = put_fixed(buf, pos, hist[i+1], 1)
+        pos = put_bytes(buf, pos, b',')
+        pos = put_fixed(buf, pos, hist[i+2], 3)
+        pos = put_bytes(buf, pos, b',')
+        pos = put_fixed(buf, pos, hist[i+3], 1)
+        pos = put_bytes(buf, pos, b',')
+        pos = put_fixed(buf, pos, hist[i+4], 3)
+        pos = put_bytes(buf, pos, b',')
+        pos = put_fixed(buf, pos, hist[i+5], 1)
+        pos = put_bytes(buf, pos, b',')
+        pos = put_fixed(buf, pos, hist[i+6], 2)
+        pos = put_bytes(buf, pos, b'\n')
+
+    if run_len:
+        send_chunk(client, mv[run_start * HIST_FIELDS:(run_start + run_len) * HIST_FIELDS],
+                           run_len * HIST_FIELDS * 4)
+    if pos:
+        send_chunk(client, memoryview(buf)[:pos], pos)
+    client.sendall('0\r\n\r\n')
+
 def handle_web_client():
     global dev_id, mc_id, send_interval
     if not server:
@@ -389,12 +447,36 @@ def handle_web_client():
         client.settimeout(2)
         request = client.recv(1024).decode('utf-8')
         
-        if 'GET /api' in request:
+        if 'GET /api/profile' in request:
+            metrics.inc(metrics.HTTP_PROFILE)
+            if 'reset=1' in request:
+                profiler.reset()
+            client.send('HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nAccess-Control-Allow-Origin: *\r\n\r\n')
+            import ujson
+            client.send(ujson.dumps(profiler.as_dict()))
+        
+        elif 'GET /api' in request:
+            metrics.inc(metrics.HTTP_API)
             response = api_json()
             client.send('HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nAccess-Control-Allow-Origin: *\r\n\r\n')
             client.send(response)
         
+        elif 'GET /metrics' in request:
+            metrics.inc(metrics.HTTP_METRICS)
+            client.send('HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n\r\n')
+            metrics.render(client.send)
+        
+        elif 'GET /export' in request:
+            metrics.inc(metrics.HTTP_EXPORT)
+            try:
+                fmt, t_from, t_to = export_params(request)
+                export_history(client, fmt, t_from, t_to)
+            except Exception as e:
+                print("Export error:", str(e))
+                client.send('HTTP/1.1 400 Bad Request\r\n\r\n')
+        
         elif 'GET /savesettings?' in request:
+            metrics.inc(metrics.HTTP_SAVESETTINGS)
             try:
                 params = request.split('GET /savesettings?')[1].split(' ')[0]
                 for param in params.split('&'):
@@ -405,13 +487,18 @@ def handle_web_client():
                     elif param.startswith('interval='):
                         send_interval = int(param[9:])
                 
+                cache_ids()
                 save_device_config()
+                if send_task:
+                    send_task.period = send_interval * 1000
+                    sched.reschedule(send_task, send_task.period)
                 client.send('HTTP/1.1 302 Found\r\nLocation: /settings\r\n\r\n')
             except Exception as e:
                 print("Save settings error:", str(e))
                 client.send('HTTP/1.1 400 Bad Request\r\n\r\n')
         
         elif 'GET /savewifi?' in request:
+            metrics.inc(metrics.HTTP_SAVEWIFI)
             try:
                 params = request.split('GET /savewifi?')[1].split(' ')[0]
                 ssid = ""
@@ -435,23 +522,27 @@ def handle_web_client():
                 client.send('HTTP/1.1 400 Bad Request\r\n\r\n')
         
         elif 'GET /settings' in request:
-            response = settings_page()
+            metrics.inc(metrics.HTTP_SETTINGS)
+            import pages
             client.send('HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n')
-            client.send(response)
+            pages.send_settings(client.send, dev_id, mc_id, send_interval, WEBHOOK_URL, last_send_status)
         
         elif 'GET /setup' in request:
-            response = wifi_manager_page()
+            metrics.inc(metrics.HTTP_SETUP)
+            import pages
             client.send('HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n')
-            client.send(response)
+            pages.send_setup(client.send)
         
         elif 'GET /send' in request:
+            metrics.inc(metrics.HTTP_SEND)
             send_to_remote()
             client.send('HTTP/1.1 302 Found\r\nLocation: /\r\n\r\n')
         
         else:
-            response = pzem_web_page()
+            metrics.inc(metrics.HTTP_INDEX)
+            import pages
             client.send('HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n')
-            client.send(response)
+            pages.send_index(client.send, ip_address)
         
         client.close()
     except OSError:
@@ -499,25 +590,35 @@ def pzem_read_input_registers(address, count):
         request.append((crc >> 8) & 0xFF)
         
         uart_pzem.read()
+        start = time.ticks_ms()
         uart_pzem.write(request)
         uart_pzem.flush()
         time.sleep_ms(100)
         
         response = uart_pzem.read()
+        metrics.observe(metrics.PZEM_RTT_MS, time.ticks_diff(time.ticks_ms(), start))
         if not response or len(response) < 5:
+            metrics.inc(metrics.PZEM_TIMEOUTS)
             return None
-        if response[0] != pzem_device_id or response[1] != 0x04:
+        if response[0] != pzem_device_id:
+            return None
+        if response[1] == 0x84:
+            metrics.inc(metrics.PZEM_EXCEPTIONS)
+            return None
+        if response[1] != 0x04:
             return None
         
         byte_count = response[2]
         expected_len = 3 + byte_count + 2
         if len(response) < expected_len:
+            metrics.inc(metrics.PZEM_TIMEOUTS)
             return None
         
         data = response[3:3+byte_count]
         received_crc = response[3+byte_count] | (response[3+byte_count+1] << 8)
         calculated_crc = pzem_calculate_crc(response[:3+byte_count])
         if received_crc != calculated_crc:
+            metrics.inc(metrics.PZEM_CRC_ERRORS)
             return None
         
         registers = []
@@ -530,55 +631,156 @@ def pzem_read_input_registers(address, count):
         return None
 
 def pzem_read_all():
-    global pzem_voltage, pzem_current, pzem_power, pzem_energy
-    global pzem_frequency, pzem_power_factor
-    
     if not pzem_enabled:
         return False
     try:
         result = pzem_read_input_registers(address=0x0000, count=10)
         if result and len(result) >= 10:
-            pzem_voltage = result[0] / 10.0
-            pzem_current = (result[1] + (result[2] << 16)) / 1000.0
-            pzem_power = (result[3] + (result[4] << 16)) / 10.0
-            pzem_energy = (result[5] + (result[6] << 16)) / 1000.0
-            pzem_frequency = result[7] / 10.0
-            pzem_power_factor = result[8] / 100.0
+            pzem_apply(result)
             return True
         return False
     except:
         return False
 
-# ============== LCD 16x2 Functions ==============
-def lcd_write(data):
-    if i2c and lcd_addr:
-        try:
-            i2c.writeto(lcd_addr, bytearray([data | 0x08]))
-        except:
-            pass
+def pzem_apply(result):
+    """Store 10 PZEM registers: live values, read counter and history"""
+    global pzem_voltage, pzem_current, pzem_power, pzem_energy
+    global pzem_frequency, pzem_power_factor
+    pzem_voltage = result[0] / 10.0
+    pzem_current = (result[1] + (result[2] << 16)) / 1000.0
+    pzem_power = (result[3] + (result[4] << 16)) / 10.0
+    pzem_energy = (result[5] + (result[6] << 16)) / 1000.0
+    pzem_frequency = result[7] / 10.0
+    pzem_power_factor = result[8] / 100.0
+    metrics.inc(metrics.PZEM_READS)
+    history_record(result)
+
+# ============== Sample History ==============
+def history_record(result):
+    global hist_head, hist_count, hist_seq
+    i = hist_head * HIST_FIELDS
+    # Wall-clock second of the scheduled sample tick, not of when the reply arrived
+    hist[i] = int(time.time()) - time.ticks_diff(time.ticks_ms(), pzem_stamp) // 1000
+    hist[i+1] = result[0]
+    hist[i+2] = result[1] | (result[2] << 16)
+    hist[i+3] = result[3] | (result[4] << 16)
+    hist[i+4] = result[5] | (result[6] << 16)
+    hist[i+5] = result[7]
+    hist[i+6] = result[8]
+    hist_head = (hist_head + 1) % HIST_SIZE
+    hist_seq += 1
+    if hist_count < HIST_SIZE:
+        hist_count += 1
+
+def history_shift(delta):
+    """Move the timestamps of all stored records by delta seconds (after a clock change)"""
+    for k in range(hist_count):
+        i = ((hist_head - 1 - k) % HIST_SIZE) * HIST_FIELDS
+        hist[i] = max(0, hist[i] + delta)
 
-def lcd_pulse(data):
-    lcd_write(data | 0x04)
-    time.sleep_us(1)
-    lcd_write(data)
-    time.sleep_us(50)
+def put_bytes(buf, pos, src):
+    for b in src:
+        buf[pos] = b
+        pos += 1
+    return pos
 
-def lcd_write_nibble(data):
-    lcd_write(data)
-    lcd_pulse(data)
+def put_fixed(buf, pos, value, decimals):
+    """Write value / 10**decimals as ASCII digits into buf at pos, return new pos"""
+    digits = 1
+    v = value // 10
+    while v:
+        digits += 1
+        v //= 10
+    if digits <= decimals:
+        digits = decimals + 1
+    end = pos + digits + (1 if decimals else 0)
+    i = end
+    for d in range(digits):
+        if decimals and d == decimals:
+            i -= 1
+            buf[i] = 46
+        i -= 1
+        buf[i] = 48 + value % 10
+        value //= 10
+    return end
 
-def lcd_cmd(cmd):
-    lcd_write_nibble(cmd & 0xF0)
-    lcd_write_nibble((cmd << 4) & 0xF0)
+# ============== JSON Serializer ==============
+# (key, decimals) for each raw register field of a history record
+JSON_FIELDS = (
+    (b',"voltage":', 1),
+    (b',"current":', 3),
+    (b',"power":', 1),
+    (b',"energy":', 3),
+    (b',"frequency":', 1),
+    (b',"pf":', 2),
+)
 
-def lcd_char(data):
-    lcd_write_nibble(0x01 | (data & 0xF0))
-    lcd_write_nibble(0x01 | ((data << 4) & 0xF0))
+def put_json_str(buf, pos, src):
+    for b in src:
+        if b == 34 or b == 92:
+            buf[pos] = 92
+            pos += 1
+        buf[pos] = b
+        pos += 1
+    return pos
 
+def reading_json(idx=-1, with_ts=False):
+    """Serialize a history record (default: the latest reading) into json_buf as fixed-point JSON.
+    Used by both /api and the webhook so they send identical bytes.
+    Returns a memoryview into json_buf, valid until the next call."""
+    buf = json_buf
+    pos = put_bytes(buf, 0, b'{"devid":"')
+    pos = put_json_str(buf, pos, dev_id_b)
+    pos = put_bytes(buf, pos, b'","mcid":"')
+    pos = put_json_str(buf, pos, mc_id_b)
+    buf[pos] = 34
+    pos += 1
+    
+    if idx < 0:
+        idx = (hist_head - 1) % HIST_SIZE
+    i = idx * HIST_FIELDS
+    if with_ts:
+        pos = put_bytes(buf, pos, b',"ts":')
+        pos = put_fixed(buf, pos, hist[i] + EPOCH_OFFSET, 0)
+    for f in range(len(JSON_FIELDS)):
+        key, decimals = JSON_FIELDS[f]
+        pos = put_bytes(buf, pos, key)
+        if hist_count:
+            pos = put_fixed(buf, pos, hist[i + 1 + f], decimals)
+        else:
+            pos = put_bytes(buf, pos, b'null')
+    
+    pos = put_bytes(buf, pos, b',"interval":')
+    pos = put_fixed(buf, pos, send_interval, 0)
+    buf[pos] = 125
+    return json_mv[:pos + 1]
+
+def bench_json(n=200):
+    """REPL helper: time and heap bytes per serialization, new vs. ujson"""
+    import ujson
+    reading = {
+        "devid": dev_id, "mcid": mc_id,
+        "voltage": pzem_voltage, "current": pzem_current, "power": pzem_power,
+        "energy": pzem_energy, "frequency": pzem_frequency, "pf": pzem_power_factor,
+        "interval": send_interval
+    }
+    for name, fn in (("reading_json", reading_json), ("ujson.dumps", lambda: ujson.dumps(reading))):
+        gc.collect()
+        gc.disable()
+        a0 = gc.mem_alloc()
+        t0 = time.ticks_us()
+        for _ in range(n):
+            fn()
+        us = time.ticks_diff(time.ticks_us(), t0)
+        used = gc.mem_alloc() - a0
+        gc.enable()
+        print("{}: {} us, {} bytes per call".format(name, us // n, used // n))
+
+# ============== LCD 16x2 Functions ==============
 def lcd_init():
-    global i2c, lcd_addr
+    global i2c, lcd
     try:
-        i2c = I2C(0, scl=Pin(22), sda=Pin(21), freq=100000)
+        i2c = I2C(0, scl=Pin(22), sda=Pin(21), freq=I2C_FREQ)
         time.sleep_ms(50)
         devices = i2c.scan()
         if not devices:
@@ -586,65 +788,34 @@ def lcd_init():
         
         for addr in [0x27, 0x3F]:
             if addr in devices:
-                lcd_addr = addr
+                lcd = I2cLcd(i2c, addr, 16, 2)
                 break
         
-        if not lcd_addr:
+        if not lcd:
             return False
         
-        time.sleep_ms(50)
-        lcd_write_nibble(0x30)
-        time.sleep_ms(5)
-        lcd_write_nibble(0x30)
-        time.sleep_ms(1)
-        lcd_write_nibble(0x30)
-        time.sleep_ms(1)
-        lcd_write_nibble(0x20)
-        lcd_cmd(0x28)
-        lcd_cmd(0x0C)
-        lcd_cmd(0x01)
-        time.sleep_ms(2)
-        lcd_cmd(0x06)
+        lcd.init()
         print("LCD initialized")
         return True
     except Exception as e:
         print("LCD error:", str(e))
         return False
 
-def lcd_clear():
-    if i2c and lcd_addr:
-        lcd_cmd(0x01)
-        time.sleep_ms(2)
-
-def lcd_set_pos(row, col):
-    if i2c and lcd_addr:
-        offsets = [0x00, 0x40]
-        if row < 2 and col < 16:
-            lcd_cmd(0x80 | (offsets[row] + col))
-
-def lcd_text(text, row=0, col=0):
-    if i2c and lcd_addr:
-        lcd_set_pos(row, col)
-        for c in text[:16]:
-            lcd_char(ord(c))
-
 def lcd_display(line1="", line2=""):
-    if not i2c or not lcd_addr:
+    if not lcd:
         return
     try:
-        lcd_clear()
-        if line1:
-            lcd_text(line1, 0, 0)
-        if line2:
-            lcd_text(line2, 1, 0)
+        lcd.show(line1, line2)
     except:
         pass
 
 def update_lcd():
-    if not i2c or not lcd_addr:
+    if not lcd:
         return
     
-    line1 = ip_address
+    start = time.ticks_ms()
+    profiler.start(profiler.LCD)
+    line1 = ip_address if (link and link.up) or ap else "Connecting WiFi"
     
     if pzem_current is not None and pzem_voltage is not None:
         line2 = "{:.2f}A {:.1f}V".format(pzem_current, pzem_voltage)
@@ -652,97 +823,369 @@ def update_lcd():
         line2 = "---A  ---V"
     
     lcd_display(line1, line2)
+    profiler.stop(profiler.LCD)
+    metrics.observe(metrics.LCD_MS, time.ticks_diff(time.ticks_ms(), start))
 
-# ============== Main ==============
-def main():
-    global ip_address, last_send
-    
-    print("\nStarting System...")
+# ============== Tasks ==============
+def task_read_pzem():
+    global pzem_fail_count
+    if not pzem_enabled:
+        return
+    profiler.start(profiler.PZEM)
+    ok = pzem_read_all()
+    profiler.stop(profiler.PZEM)
+    if ok:
+        pzem_fail_count = 0
+        reading_done()
+    else:
+        pzem_failed()
+    update_lcd()
+
+def reading_done():
+    global boot_reported
+    if not boot_reported:
+        # ticks_ms() starts at reset, so this is reset-to-first-reading
+        print("Boot: first reading at {} ms, {} bytes free".format(time.ticks_ms(), gc.mem_free()))
+        boot_reported = True
+    print("V:{:.1f} A:{:.2f} W:{:.1f} PF:{:.2f}".format(
+        pzem_voltage, pzem_current, pzem_power, pzem_power_factor))
+
+def pzem_failed():
+    """Count a failed read; restart the UART after max_pzem_failures in a row"""
+    global pzem_enabled, pzem_fail_count
+    pzem_fail_count += 1
+    print("PZEM read failed ({}/{})".format(pzem_fail_count, max_pzem_failures))
+    if pzem_fail_count >= max_pzem_failures:
+        print("PZEM restart triggered!")
+        metrics.inc(metrics.PZEM_RESTARTS)
+        pzem_enabled = False
+        time.sleep_ms(500)
+        if pzem_init():
+            pzem_fail_count = 0
+
+def task_sample():
+    global pzem_stamp
+    pzem_stamp = sample_task.due
+    metrics.observe(metrics.SAMPLE_JITTER_MS, time.ticks_diff(time.ticks_ms(), pzem_stamp))
+    task_read_pzem()
+
+def task_send():
+    global last_send_status
+    print("\n--- Sending to n8n webhook ---")
+    if not link.up:
+        last_send_status = "Offline"
+        print("WiFi down, reading kept for the backlog upload")
+        return
+    profiler.start(profiler.SEND)
+    send_to_remote()
+    profiler.stop(profiler.SEND)
+    task_gc()
+
+def task_backlog():
+    if link.up and upload_seq < backlog_end:
+        upload_pending(backlog_end, BACKLOG_BATCH)
+
+def task_gc():
+    profiler.start(profiler.GC)
     gc.collect()
+    profiler.stop(profiler.GC)
+
+def task_profile():
+    profiler.report()
+
+def wait_for_client(ms):
+    """Scheduler idle hook: sleep until the next task is due or a web client connects.
+    Returns the ms spent waiting, so serving the client is not counted as idle."""
+    if not poller:
+        time.sleep_ms(ms)
+        return ms
+    if sample_timer:
+        # The timer callback only marks the sample task due, so wake up for it
+        ms = min(ms, max(1, time.ticks_diff(time.ticks_add(sample_sched, pzem_read_interval), time.ticks_ms()) + 1))
+    start = time.ticks_ms()
+    for _ in poller.ipoll(ms):
+        waited = time.ticks_diff(time.ticks_ms(), start)
+        profiler.start(profiler.WEB)
+        handle_web_client()
+        profiler.stop(profiler.WEB)
+        return waited
+    return None
+
+# ============== Sampling Timer ==============
+def sample_isr(t):
+    try:
+        micropython.schedule(sample_trigger_ref, 0)
+    except RuntimeError:
+        metrics.inc(metrics.SAMPLE_DROPPED)
+
+def sample_trigger(_):
+    # Runs between any two bytecodes of the main loop, even mid heap update, so it only
+    # advances the deadline and bumps counters; run_once() queues the sample task
+    global sample_sched
+    sample_sched = time.ticks_add(sample_sched, pzem_read_interval)
+    if not sched.trigger(sample_task, sample_sched):
+        metrics.inc(metrics.SAMPLE_OVERRUNS)
+
+# Bound once so the ISR does not allocate a new reference on every tick
+sample_trigger_ref = sample_trigger
+
+def sample_timer_start():
+    """Pace PZEM sampling from a hardware timer; falls back to a scheduler task"""
+    global sample_timer, sample_task, sample_sched
+    try:
+        sample_timer = Timer(SAMPLE_TIMER_ID)
+    except Exception as e:
+        print("Sample timer error:", str(e))
+        sample_timer = None
+        sample_task = sched.every(pzem_read_interval, task_sample, "sample")
+        return False
     
-    # Load device config
-    load_device_config()
-    
-    # Initialize LCD
-    lcd_ok = lcd_init()
-    if lcd_ok:
-        lcd_display("PZEM Monitor", "Starting...")
-    
-    # Initialize PZEM
-    pzem_ok = pzem_init()
-    
-    # Connect to WiFi
-    if lcd_ok:
-        lcd_display("Connecting WiFi", DEFAULT_SSID[:16])
+    sample_task = sched.on_demand(task_sample, "sample")
+    sample_sched = time.ticks_ms()
+    sched.trigger(sample_task, sample_sched)
+    sample_timer.init(period=pzem_read_interval, mode=Timer.PERIODIC, callback=sample_isr)
+    return True
+
+# ============== Sampling Thread ==============
+def thread_read(stamp):
+    """Runs on the sampler thread, the only one that touches uart_pzem after start"""
+    global pzem_fail_count
+    metrics.observe(metrics.SAMPLE_JITTER_MS, time.ticks_diff(time.ticks_ms(), stamp))
+    if not pzem_enabled:
+        return None
+    profiler.start(profiler.PZEM)
+    result = pzem_read_input_registers(address=0x0000, count=10)
+    profiler.stop(profiler.PZEM)
+    if result and len(result) >= 10:
+        pzem_fail_count = 0
+        return result
+    pzem_failed()
+    return None
+
+def task_drain():
+    """Main thread: apply every reading the sampler thread queued"""
+    global pzem_stamp
+    ring = sample_ring
+    n = 0
+    while True:
+        i = ring.peek()
+        if i < 0:
+            break
+        pzem_stamp = ring.buf[i]
+        pzem_apply(ring.mv[i + 1:i + ring.fields])
+        ring.pop()
+        n += 1
+    if n:
+        reading_done()
+        update_lcd()
+
+def sample_thread_start():
+    """Hand the PZEM over to a sampling thread; False if threads are unavailable"""
+    global sample_thread, sample_ring
+    try:
+        from sampler import Sampler, SampleRing
+        sample_ring = SampleRing(SAMPLE_RING_SIZE, 11)
+        sample_thread = Sampler(thread_read, sample_ring, pzem_read_interval)
+        sample_thread.start()
+        profiler.shared = True
+    except Exception as e:
+        print("Sampler thread error:", str(e))
+        sample_thread = None
+        return False
+    sched.every(DRAIN_MS, task_drain, "drain")
+    return True
+
+# ============== Low Power ==============
+def radio_on():
+    global wlan
+    ssid, password = load_wifi_config()
+    wlan = network.WLAN(network.STA_IF)
+    wlan.active(True)
+    wlan.connect(ssid, password)
+
+def radio_ready():
+    return wlan is not None and wlan.isconnected()
+
+def radio_off():
+    if wlan:
+        try:
+            wlan.disconnect()
+        except:
+            pass
+        wlan.active(False)
+
+def lp_sample(stamp):
+    global pzem_stamp
+    pzem_stamp = stamp
+    task_read_pzem()
+
+def wall_ms():
+    try:
+        return time.time_ns() // 1000000
+    except AttributeError:
+        return int(time.time()) * 1000
+
+def lp_sleep(ms):
+    if POWER_MODE != "deep" or ms < DEEP_MIN_MS:
+        machine.lightsleep(ms)
+        return
+    rtc_save(ms)
+    machine.deepsleep(ms - DEEP_WAKE_ADVANCE_MS)
+
+def rtc_save(sleep_ms):
+    """Keep pending samples and counters in RTC memory across deep sleep"""
+    n = min(hist_seq - upload_seq, hist_count, RTC_MAX_RECORDS)
+    header = struct.calcsize(RTC_HEADER)
+    buf = bytearray(header + 8 + n * HIST_FIELDS * 4)
+    struct.pack_into(RTC_HEADER, buf, 0, RTC_MAGIC, hist_seq, hist_seq - n,
+                     power_mgr.pending, power_mgr.awake_ms, power_mgr.asleep_ms + sleep_ms, n)
+    # Wall-clock ms of the next sample, so cadence survives the reboot
+    struct.pack_into("<Q", buf, header, wall_ms() + sleep_ms)
+    pos = header + 8
+    for k in range(n):
+        i = ((hist_head - n + k) % HIST_SIZE) * HIST_FIELDS
+        for f in range(HIST_FIELDS):
+            struct.pack_into("<I", buf, pos, hist[i + f])
+            pos += 4
+    machine.RTC().memory(buf)
+
+def rtc_restore():
+    """Reload pending samples after a deep-sleep wake; returns (pending, awake, asleep, next_in) or None"""
+    global hist_head, hist_count, hist_seq, upload_seq
+    if machine.reset_cause() != machine.DEEPSLEEP_RESET:
+        return None
+    buf = machine.RTC().memory()
+    header = struct.calcsize(RTC_HEADER)
+    if len(buf) < header + 8:
+        return None
+    magic, seq, up, pending, awake, asleep, n = struct.unpack_from(RTC_HEADER, buf, 0)
+    if magic != RTC_MAGIC:
+        return None
+    next_wall = struct.unpack_from("<Q", buf, header)[0]
+    pos = header + 8
+    for k in range(n):
+        for f in range(HIST_FIELDS):
+            hist[k * HIST_FIELDS + f] = struct.unpack_from("<I", buf, pos)[0]
+            pos += 4
+    hist_head = n % HIST_SIZE
+    hist_count = n
+    hist_seq = seq
+    upload_seq = up
+    return pending, awake, asleep, max(0, next_wall - wall_ms())
+
+def run_low_power():
+    global power_mgr
+    from power import PowerManager, UPLOAD
+    print("Low-power mode:", POWER_MODE)
+    pzem_init()
+    power_mgr = PowerManager(
+        pzem_read_interval, max(1, send_interval * 1000 // pzem_read_interval),
+        lp_sample, upload_pending, radio_on, radio_off, radio_ready, sleep=lp_sleep)
     
-    wifi_connected = connect_wifi()
+    saved = rtc_restore()
+    if saved:
+        power_mgr.restore(*saved)
+        print("Resumed from deep sleep: {} pending".format(power_mgr.pending))
     
-    if not wifi_connected:
+    while True:
+        state = power_mgr.step()
+        if state == UPLOAD:
+            power_mgr.report()
+
+# ============== Network Boot ==============
+def task_net():
+    """Step the WiFi supervisor; AP mode for setup if no link NET_TIMEOUT_MS after boot"""
+    link.step()
+    if not web_started and not link.up and time.ticks_diff(time.ticks_ms(), net_start) >= NET_TIMEOUT_MS:
+        print("WiFi connection failed")
         print("Starting AP mode for setup...")
         start_ap_mode()
-        if lcd_ok:
-            lcd_display("AP:" + AP_SSID[:10], ip_address)
-    
-    # Start web server
+        net_up()
+
+def net_up():
+    global web_started
     web_ok = start_web_server()
-    
-    time.sleep(1)
+    web_started = True
     
     print("\n" + "="*40)
-    print("System Ready!")
+    print("System Ready!" if web_ok else "Web server failed!")
     print("="*40)
     print("IP:", ip_address)
     print("Web: http://" + ip_address)
     print("API: http://" + ip_address + "/api")
+    print("Metrics: http://" + ip_address + "/metrics")
+    print("Export: http://" + ip_address + "/export?fmt=csv&from=&to=")
+    print("Profile: http://" + ip_address + "/api/profile", "(on)" if PROFILE else "(off)")
     print("Settings: http://" + ip_address + "/settings")
     print("Device ID:", dev_id)
     print("Machine ID:", mc_id)
     print("Send Interval:", send_interval, "seconds")
     print("Webhook:", WEBHOOK_URL)
-    print("LCD:", "OK" if lcd_ok else "Failed")
-    print("PZEM:", "OK" if pzem_ok else "Failed")
+    print("LCD:", "OK" if lcd else "Failed")
+    print("PZEM:", "OK" if pzem_enabled else "Failed")
+    print("Readings during boot:", hist_seq)
     print("="*40 + "\n")
     
+    update_lcd()
+
+# ============== Main ==============
+def main():
+    global sched, net_task
+    
+    print("\nStarting System...")
+    gc.collect()
+    
+    # Load device config
+    load_device_config()
+    
+    if POWER_MODE != "normal":
+        run_low_power()
+        return
+    
+    # Initialize LCD
+    lcd_ok = lcd_init()
     if lcd_ok:
-        update_lcd()
+        lcd_display("PZEM Monitor", "Starting...")
+    
+    # Initialize PZEM and start sampling before the network is up
+    pzem_init()
+    sched = Scheduler(wait=wait_for_client)
+    if THREAD_SAMPLING and sample_thread_start():
+        print("Sampling: Thread")
+    else:
+        timer_ok = sample_timer_start()
+        print("Sampling:", "Timer" if timer_ok else "Scheduler")
+    
+    # WiFi, web server and AP fallback come up in the background
+    if lcd_ok:
+        lcd_display("Connecting WiFi", DEFAULT_SSID[:16])
+    connect_wifi()
+    net_task = sched.every(NET_POLL_MS, task_net, "net")
     
-    last_read = 0
-    last_send = time.ticks_ms()
-    last_gc = 0
+    sched.every(60000, task_gc, "gc", 60000)
+    sched.every(5000, task_config, "config", 5000)
+    profiler.enabled = PROFILE
+    if PROFILE:
+        sched.every(PROFILE_REPORT_MS, task_profile, "profile", PROFILE_REPORT_MS)
     
     try:
         while True:
-            now = time.ticks_ms()
-            
-            # Handle web clients
-            handle_web_client()
-            
-            # Read PZEM every 5 seconds
-            if pzem_enabled and time.ticks_diff(now, last_read) >= pzem_read_interval:
-                if pzem_read_all():
-                    print("V:{:.1f} A:{:.2f} W:{:.1f} PF:{:.2f}".format(
-                        pzem_voltage, pzem_current, pzem_power, pzem_power_factor))
-                last_read = now
-                
-                if lcd_ok:
-                    update_lcd()
-            
-            # Send to n8n webhook every send_interval seconds
-            if wifi_connected and time.ticks_diff(now, last_send) >= (send_interval * 1000):
-                print("\n--- Sending to n8n webhook ---")
-                send_to_remote()
-                last_send = now
-                gc.collect()
-            
-            # GC every 60s
-            if time.ticks_diff(now, last_gc) > 60000:
-                gc.collect()
-                last_gc = now
-            
-            time.sleep_ms(50)
+            ran = sched.run_once()
+            if ran >= 0:
+                metrics.observe(metrics.LOOP_MS, ran)
     
     except KeyboardInterrupt:
         print("\nStopped")
+        if sample_timer:
+            sample_timer.deinit()
+        if sample_thread:
+            sample_thread.stop()
+            sample_thread.report()
+        config.flush()
+        sched.report()
+        link.report()
+        if PROFILE:
+            profiler.report()
         if lcd_ok:
             lcd_display("Stopped", "Goodbye!")
 
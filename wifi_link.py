@@ -0,0 +1,230 @@
+"""
+Non-blocking WiFi link supervisor
+- step() is called from a scheduler task; it never waits for the radio
+- First connect scans once, picks the strongest AP for the SSID and caches its
+  BSSID, channel and DHCP lease; the (blocking) scan only runs while no BSSID is cached
+- Reconnects go straight to the cached BSSID with the cached lease as a hint; DHCP
+  takes the address back once associated, so the lease is still renewed. If that
+  fails it falls back to connecting by SSID, still no scan
+- The link only counts as up (and on_up runs) once the interface has an address
+- Failed attempts back off exponentially up to backoff_max
+- Association time, outage length and counters for diagnostics
+- wlan, clock and the cache are passed in, so it runs against a fake WLAN
+"""
+
+import time
+
+DOWN = 0
+CONNECTING = 1
+UP = 2
+BACKOFF = 3
+STATE_NAMES = ("down", "connecting", "up", "backoff")
+
+class WifiLink:
+    def __init__(self, wlan, ssid, password, cache=None, save=None, static=None,
+                 clock=time.ticks_ms, fast_timeout=5000, full_timeout=15000,
+                 backoff_min=2000, backoff_max=300000, on_up=None, on_down=None):
+        """cache: dict from a previous save(cache) call; static: ifconfig tuple or None"""
+        self.wlan = wlan
+        self.ssid = ssid
+        self.password = password
+        self.cache = cache or {}
+        self.save = save
+        self.static = static
+        self.clock = clock
+        self.fast_timeout = fast_timeout
+        self.full_timeout = full_timeout
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.on_up = on_up
+        self.on_down = on_down
+
+        self.state = DOWN
+        self.fast = False
+        self.hinted = False
+        self.stale = False
+        self.attempt_start = 0
+        self.assoc_at = None
+        self.retry_at = 0
+        self.down_since = clock()
+        self.failures = 0
+
+        self.connects = 0
+        self.fast_connects = 0
+        self.disconnects = 0
+        self.assoc_ms = 0
+        self.assoc_max = 0
+        self.outage_ms = 0
+        self.outage_max = 0
+        self.outage_total = 0
+
+    @property
+    def up(self):
+        return self.state == UP
+
+    # ============== Attempts ==============
+    def start(self):
+        """Begin an attempt: cached BSSID first, full scan if there is none"""
+        self.wlan.active(True)
+        if self.cache.get("bssid"):
+            self._connect_fast()
+        else:
+            self._connect_full()
+
+    def _connect_fast(self):
+        self.fast = True
+        self.stale = False
+        start = self.clock()
+        lease = self.static or self.cache.get("lease")
+        # A cached lease is only a hint; _addressed() hands the address back to DHCP
+        self.hinted = bool(lease) and not self.static
+        try:
+            if lease:
+                self.wlan.ifconfig(tuple(lease))
+            self.wlan.connect(self.ssid, self.password, bssid=bytes.fromhex(self.cache["bssid"]))
+        except Exception as e:
+            print("WiFi fast connect error:", str(e))
+            self._connect_full()
+            return
+        self._begin(start)
+
+    def _connect_full(self):
+        self.fast = False
+        self.hinted = False
+        start = self.clock()
+        bssid = None
+        try:
+            if not self.static:
+                self.wlan.ifconfig("dhcp")
+            else:
+                self.wlan.ifconfig(tuple(self.static))
+        except:
+            pass
+        # scan() blocks the loop for seconds: only when there is no BSSID at all.
+        # A stale one (fast attempt failed) gets a plain connect by SSID instead;
+        # the driver finds the AP in the background and the BSSID is relearned
+        # by the scan on the next attempt without one.
+        self.stale = stale = bool(self.cache.get("bssid"))
+        try:
+            if not stale:
+                best = None
+                for net in self.wlan.scan():
+                    if net[0] == self.ssid.encode() and (best is None or net[3] > best[3]):
+                        best = net
+                if best:
+                    bssid = best[1]
+                    self.cache["channel"] = best[2]
+            if bssid:
+                self.wlan.connect(self.ssid, self.password, bssid=bssid)
+            else:
+                self.wlan.connect(self.ssid, self.password)
+            if not stale:
+                self.cache["bssid"] = bssid.hex() if bssid else None
+        except Exception as e:
+            print("WiFi connect error:", str(e))
+        self._begin(start)
+
+    def _begin(self, start):
+        # Association time includes the scan, if there was one
+        self.state = CONNECTING
+        self.attempt_start = start
+        self.assoc_at = None
+
+    # ============== State Machine ==============
+    def step(self):
+        now = self.clock()
+        state = self.state
+
+        if state == UP:
+            if not self.wlan.isconnected():
+                self.state = DOWN
+                self.down_since = now
+                self.disconnects += 1
+                print("WiFi link lost")
+                if self.on_down:
+                    self.on_down()
+                self.start()
+
+        elif state == CONNECTING:
+            if self.wlan.isconnected() and self._addressed(now):
+                self._link_up(now)
+            elif time.ticks_diff(now, self.attempt_start) >= (self.fast_timeout if self.fast else self.full_timeout):
+                try:
+                    self.wlan.disconnect()
+                except:
+                    pass
+                if self.fast:
+                    # Cached AP or lease no longer valid: forget the lease, connect by SSID
+                    print("WiFi fast reconnect failed, connecting by SSID")
+                    self.cache["lease"] = None
+                    self._connect_full()
+                else:
+                    self.failures += 1
+                    delay = min(self.backoff_max, self.backoff_min << min(self.failures - 1, 16))
+                    print("WiFi connect failed ({}), retry in {} s".format(self.failures, delay // 1000))
+                    self.retry_at = time.ticks_add(now, delay)
+                    self.state = BACKOFF
+
+        elif state == BACKOFF:
+            if time.ticks_diff(now, self.retry_at) >= 0:
+                self.start()
+
+        else:
+            self.start()
+
+        return self.state
+
+    def _addressed(self, now):
+        """Associated: hand a lease hint back to DHCP, then wait for an address"""
+        if self.assoc_at is None:
+            self.assoc_at = now
+            if self.hinted:
+                # Don't keep the cached lease pinned as a static address: restart DHCP,
+                # which re-requests the same address and keeps renewing it. Until it
+                # answers the interface has no address, so nothing may use the link yet.
+                self.hinted = False
+                try:
+                    self.wlan.ifconfig("dhcp")
+                except:
+                    pass
+        try:
+            return self.wlan.ifconfig()[0] != "0.0.0.0"
+        except:
+            return True
+
+    def _link_up(self, now):
+        self.state = UP
+        self.assoc_ms = time.ticks_diff(self.assoc_at, self.attempt_start)
+        # The first connect after boot is not an outage
+        self.outage_ms = time.ticks_diff(now, self.down_since) if self.connects else 0
+        if self.assoc_ms > self.assoc_max:
+            self.assoc_max = self.assoc_ms
+        if self.outage_ms > self.outage_max:
+            self.outage_max = self.outage_ms
+        self.outage_total += self.outage_ms
+        self.connects += 1
+        if self.fast:
+            self.fast_connects += 1
+        self.failures = 0
+
+        if self.stale:
+            # Connected by SSID past a stale BSSID: scan for the new one next time
+            self.stale = False
+            self.cache["bssid"] = None
+        try:
+            self.cache["lease"] = list(self.wlan.ifconfig())
+            self.cache["channel"] = self.wlan.config("channel")
+        except:
+            pass
+        if self.save:
+            self.save(dict(self.cache))
+        print("WiFi up ({}): associated in {} ms, address after {} ms, outage {} ms".format(
+            "fast" if self.fast else "scan", self.assoc_ms,
+            time.ticks_diff(now, self.attempt_start), self.outage_ms))
+        if self.on_up:
+            self.on_up()
+
+    def report(self):
+        print("WiFi: {}, {} connects ({} fast), {} drops, assoc {}/{} ms, outage {}/{} ms, total {} s down".format(
+            STATE_NAMES[self.state], self.connects, self.fast_connects, self.disconnects,
+            self.assoc_ms, self.assoc_max, self.outage_ms, self.outage_max, self.outage_total // 1000))
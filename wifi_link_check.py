@@ -0,0 +1,209 @@
+"""
+State machine checks for wifi_link.py against a fake network.WLAN
+- Cold boot (scan), drop + fast reconnect (cached BSSID, lease as a hint, then DHCP
+  with on_up held until there is an address again),
+  stale cache fallback by SSID without a scan, AP outage with exponential backoff
+  and no scans, recovery
+- Virtual clock, no radio; runs on CPython or the MicroPython unix port
+- Usage: python wifi_link_check.py   (exits non-zero if a check fails)
+"""
+
+import sys
+import time
+
+if not hasattr(time, "ticks_ms"):
+    # CPython: plain integers are enough for a virtual clock
+    time.ticks_ms = lambda: 0
+    time.ticks_add = lambda t, d: t + d
+    time.ticks_diff = lambda a, b: a - b
+
+from wifi_link import WifiLink, CONNECTING, BACKOFF
+
+SSID = "Site-AP"
+BSSID = b"\x10\x20\x30\x40\x50\x60"
+LEASE = ("192.168.1.77", "255.255.255.0", "192.168.1.1", "8.8.8.8")
+
+
+class Clock:
+    def __init__(self):
+        self.ms = 0
+
+    def __call__(self):
+        return self.ms
+
+
+class FakeWLAN:
+    """AP that can be up or down; scan() blocks for scan_ms like the real one,
+    association takes assoc_ms plus dhcp_ms unless an address is configured;
+    restarting DHCP while linked leaves no address (0.0.0.0) for dhcp_ms"""
+    def __init__(self, clock):
+        self.clock = clock
+        self.ap_up = True
+        self.ap_bssid = BSSID
+        self.scan_ms = 3000
+        self.assoc_ms = 400
+        self.dhcp_ms = 1500
+        self.static = None
+        self.dhcp_restarts = 0
+        self.dhcp_at = None
+        self.ready_at = None
+        self.linked = False
+        self.scans = 0
+        self.connect_calls = []
+
+    def active(self, state=None):
+        return True
+
+    def scan(self):
+        self.scans += 1
+        self.clock.ms += self.scan_ms
+        return [(SSID.encode(), self.ap_bssid, 6, -60, 3, False)] if self.ap_up else []
+
+    def ifconfig(self, arg=None):
+        if arg is None:
+            if self.static:
+                return self.static
+            if self.dhcp_at is not None and self.clock() < self.dhcp_at:
+                return ("0.0.0.0",) * 4
+            return LEASE
+        if arg == "dhcp" and self.linked:
+            self.dhcp_restarts += 1
+            self.dhcp_at = self.clock() + self.dhcp_ms
+        self.static = None if arg == "dhcp" else tuple(arg)
+
+    def config(self, key):
+        return 6
+
+    def connect(self, ssid, password, bssid=None):
+        self.connect_calls.append(bssid)
+        self.linked = False
+        if not self.ap_up or (bssid and bssid != self.ap_bssid):
+            self.ready_at = None
+            return
+        delay = self.assoc_ms
+        if not self.static:
+            delay += self.dhcp_ms
+        self.ready_at = self.clock() + delay
+
+    def disconnect(self):
+        self.ready_at = None
+        self.linked = False
+
+    def isconnected(self):
+        if self.ready_at is not None and self.ap_up and self.clock() >= self.ready_at:
+            self.linked = True
+            self.ready_at = None
+        return self.linked and self.ap_up
+
+    def drop(self):
+        self.linked = False
+
+
+failed = []
+
+
+def check(name, ok):
+    print("  %-52s %s" % (name, "ok" if ok else "FAIL"))
+    if not ok:
+        failed.append(name)
+
+
+def run(link, clock, ms, step=100):
+    end = clock.ms + ms
+    while clock.ms < end:
+        clock.ms += step
+        link.step()
+
+
+def main():
+    clock = Clock()
+    wlan = FakeWLAN(clock)
+    saved = []
+    events = []
+    addrs = []
+
+    def on_up():
+        events.append("up")
+        addrs.append(wlan.ifconfig()[0])
+
+    link = WifiLink(wlan, SSID, "pw", save=saved.append, clock=clock,
+                    on_up=on_up, on_down=lambda: events.append("down"))
+
+    print("Cold boot:")
+    link.start()
+    check("first attempt scans", wlan.scans == 1 and link.state == CONNECTING)
+    run(link, clock, 5000)
+    check("link up after scan + DHCP", link.up and link.assoc_ms == 4900)
+    check("cache has BSSID, channel and lease", saved and saved[-1]["bssid"] == BSSID.hex()
+          and saved[-1]["channel"] == 6 and tuple(saved[-1]["lease"]) == LEASE)
+    check("no outage recorded for the first connect", link.outage_ms == 0)
+
+    print("Drop and fast reconnect:")
+    wlan.drop()
+    clock.ms += 100
+    link.step()
+    check("drop detected, on_down called", link.disconnects == 1 and events == ["up", "down"])
+    check("reconnect uses cached BSSID", wlan.connect_calls[-1] == BSSID and wlan.scans == 1)
+    check("reconnect uses the lease as a hint", wlan.static == LEASE)
+    run(link, clock, 1000)
+    check("associated, address handed back to DHCP (not pinned)", wlan.linked and wlan.static is None
+          and wlan.dhcp_restarts == 1)
+    check("not up and no on_up while DHCP has no address", not link.up and events == ["up", "down"]
+          and wlan.ifconfig()[0] == "0.0.0.0")
+    run(link, clock, 1000)
+    check("up once DHCP answers, fast association < 1 s", link.up and link.assoc_ms <= 500
+          and link.fast_connects == 1 and events[-1] == "up")
+    check("on_up only ever saw a real address", addrs == [LEASE[0]] * 2)
+    check("cached lease is the DHCP one", tuple(saved[-1]["lease"]) == LEASE)
+    check("outage recorded", 1500 < link.outage_ms <= 2100 and link.outage_max == link.outage_ms)
+
+    print("Stale cache (AP replaced):")
+    wlan.ap_bssid = b"\xaa\xbb\xcc\xdd\xee\xff"
+    wlan.drop()
+    run(link, clock, 5200)
+    check("fast attempt times out, connects by SSID, no scan", not link.up and link.state == CONNECTING
+          and wlan.scans == 1 and wlan.connect_calls[-1] is None)
+    check("lease dropped, DHCP", wlan.static is None)
+    run(link, clock, 3000)
+    check("SSID connect finds the new AP, stale BSSID forgotten", link.up and saved[-1]["bssid"] is None
+          and saved[-1]["lease"] is not None)
+    wlan.drop()
+    run(link, clock, 100)
+    check("next attempt scans once and caches the new BSSID", wlan.scans == 2
+          and wlan.connect_calls[-1] == wlan.ap_bssid)
+    run(link, clock, 5000)
+    check("back up on the new AP", link.up and saved[-1]["bssid"] == wlan.ap_bssid.hex())
+    check("on_up never ran without an address", "0.0.0.0" not in addrs)
+
+    print("AP outage with backoff:")
+    wlan.ap_up = False
+    wlan.drop()
+    run(link, clock, 100)
+    retries = []
+    last = None
+    while clock.ms < 2000000 and len(retries) < 9:
+        clock.ms += 100
+        link.step()
+        if link.state == BACKOFF and last != BACKOFF:
+            retries.append(time.ticks_diff(link.retry_at, clock.ms) // 1000)
+        last = link.state
+    check("backoff doubles 2,4,8,16,... s", retries[:5] == [2, 4, 8, 16, 32])
+    check("backoff capped at backoff_max", max(retries) == 300)
+    check("no blocking scan while the AP is down", wlan.scans == 2)
+
+    print("Recovery:")
+    wlan.ap_up = True
+    run(link, clock, 330000)
+    check("link back up after the AP returns", link.up)
+    check("failure count reset", link.failures == 0)
+    check("long outage recorded", link.outage_ms > 600000)
+
+    link.report()
+    if failed:
+        print("FAIL:", ", ".join(failed))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()